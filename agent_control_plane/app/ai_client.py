@@ -0,0 +1,225 @@
+from __future__ import annotations
+
+import http.client
+import json
+import os
+import queue
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+from .metrics import ai_errors, ai_timeouts
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold: int, cooldown_seconds: float) -> None:
+        self.failure_threshold = failure_threshold
+        self.cooldown_seconds = cooldown_seconds
+        self._failures = 0
+        self._opened_at: float | None = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at < self.cooldown_seconds or self._trial_in_flight:
+                return False
+            # Half-open: let a single trial request through.
+            self._trial_in_flight = True
+            return True
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            self._trial_in_flight = False
+            if self._opened_at is not None or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            if time.monotonic() - self._opened_at < self.cooldown_seconds:
+                return "open"
+            return "half-open"
+
+
+class AIHTTPClient:
+    def __init__(
+        self,
+        base_url: str,
+        pool_size: int = 8,
+        connect_timeout: float = 3.0,
+        read_timeout: float = 10.0,
+        max_retries: int = 2,
+        backoff_base: float = 0.25,
+        backoff_max: float = 4.0,
+        breaker: CircuitBreaker | None = None,
+    ) -> None:
+        parts = urlsplit(base_url)
+        self.base_url = base_url
+        self._scheme = parts.scheme or "https"
+        self._host = parts.hostname or ""
+        self._port = parts.port
+        self._path_prefix = parts.path.rstrip("/")
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.breaker = breaker or CircuitBreaker(failure_threshold=5, cooldown_seconds=30.0)
+        self._idle: queue.LifoQueue[http.client.HTTPConnection] = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(pool_size)
+        self.pool_size = pool_size
+        self.connections_opened = 0
+
+    def _connect(self) -> http.client.HTTPConnection:
+        connection_class = http.client.HTTPSConnection if self._scheme == "https" else http.client.HTTPConnection
+        connection = connection_class(self._host, self._port, timeout=self.connect_timeout)
+        connection.connect()
+        connection.sock.settimeout(self.read_timeout)
+        self.connections_opened += 1
+        return connection
+
+    def _acquire(self) -> tuple[http.client.HTTPConnection, bool]:
+        try:
+            return self._idle.get_nowait(), True
+        except queue.Empty:
+            return self._connect(), False
+
+    def _exchange(
+        self, connection: http.client.HTTPConnection, path: str, body: bytes, headers: dict[str, str]
+    ) -> tuple[http.client.HTTPResponse, bytes]:
+        try:
+            connection.request("POST", f"{self._path_prefix}{path}", body=body, headers=headers)
+            response = connection.getresponse()
+            return response, response.read()
+        except BaseException:
+            connection.close()
+            raise
+
+    def _send(self, path: str, body: bytes, headers: dict[str, str]) -> tuple[int, dict[str, str], bytes]:
+        if not self._slots.acquire(timeout=self.connect_timeout + self.read_timeout):
+            raise TimeoutError("ai_pool_exhausted")
+        try:
+            connection, reused = self._acquire()
+            try:
+                response, data = self._exchange(connection, path, body, headers)
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                if not reused:
+                    raise
+                # The server closed an idle keep-alive connection; retry once on a fresh socket.
+                connection = self._connect()
+                response, data = self._exchange(connection, path, body, headers)
+            if response.will_close:
+                connection.close()
+            else:
+                self._idle.put(connection)
+            return response.status, dict(response.getheaders()), data
+        finally:
+            self._slots.release()
+
+    def _backoff(self, attempt: int, retry_after: str | None) -> float:
+        if retry_after:
+            try:
+                return min(float(retry_after), self.backoff_max)
+            except ValueError:
+                pass
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def post_json(self, path: str, payload: dict, headers: dict[str, str]) -> dict | None:
+        if not self.breaker.allow():
+            ai_errors.inc(reason="circuit_open")
+            return None
+
+        body = json.dumps(payload).encode("utf-8")
+        headers = {"Content-Type": "application/json", "Connection": "keep-alive", **headers}
+        for attempt in range(self.max_retries + 1):
+            retry_after = None
+            try:
+                status, response_headers, data = self._send(path, body, headers)
+            except (OSError, http.client.HTTPException) as exc:
+                if isinstance(exc, TimeoutError):
+                    ai_timeouts.inc()
+                status, data = None, b""
+            else:
+                if status < 400:
+                    self.breaker.record_success()
+                    try:
+                        return json.loads(data.decode("utf-8"))
+                    except (UnicodeDecodeError, json.JSONDecodeError):
+                        return None
+                if status not in RETRYABLE_STATUS:
+                    # Client errors (bad key, bad request) are not provider degradation.
+                    self.breaker.record_success()
+                    ai_errors.inc(reason="client_error")
+                    return None
+                retry_after = response_headers.get("Retry-After")
+            if attempt < self.max_retries:
+                time.sleep(self._backoff(attempt, retry_after))
+
+        self.breaker.record_failure()
+        ai_errors.inc(reason="exhausted")
+        return None
+
+    def close(self) -> None:
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+    def stats(self) -> dict[str, int | float | str]:
+        return {
+            "pool_size": self.pool_size,
+            "idle_connections": self._idle.qsize(),
+            "connections_opened": self.connections_opened,
+            "connect_timeout": self.connect_timeout,
+            "read_timeout": self.read_timeout,
+            "max_retries": self.max_retries,
+            "circuit": self.breaker.state,
+        }
+
+
+_client: AIHTTPClient | None = None
+_client_lock = threading.Lock()
+
+
+def get_ai_client(base_url: str) -> AIHTTPClient:
+    global _client
+    with _client_lock:
+        if _client is None or _client.base_url != base_url:
+            if _client is not None:
+                _client.close()
+            _client = AIHTTPClient(
+                base_url,
+                pool_size=int(os.getenv("AI_POOL_SIZE", "8")),
+                connect_timeout=float(os.getenv("AI_CONNECT_TIMEOUT", "3")),
+                read_timeout=float(os.getenv("AI_READ_TIMEOUT", "10")),
+                max_retries=int(os.getenv("AI_MAX_RETRIES", "2")),
+                breaker=CircuitBreaker(
+                    failure_threshold=int(os.getenv("AI_BREAKER_THRESHOLD", "5")),
+                    cooldown_seconds=float(os.getenv("AI_BREAKER_COOLDOWN_SECONDS", "30")),
+                ),
+            )
+        return _client
+
+
+def close_ai_client() -> None:
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+            _client = None
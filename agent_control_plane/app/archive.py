@@ -0,0 +1,253 @@
+from __future__ import annotations
+
+import gzip
+import hashlib
+import json
+import logging
+import os
+import threading
+from datetime import date, datetime, time, timedelta, timezone
+from pathlib import Path
+from typing import Any, Iterator
+from urllib.parse import quote
+
+from sqlalchemy import delete
+from sqlalchemy.exc import SQLAlchemyError
+from sqlmodel import Session, select
+
+from . import db
+from .models import AuditLog
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_SUFFIX = ".ndjson.gz"
+INDEX_SUFFIX = ".index.json"
+MAX_INDEXED_ENTITIES = 1000
+
+
+def _tenant_dir(tenant_id: str) -> str:
+    # Percent-encoding keeps any tenant id a single, reversible path component.
+    return quote(tenant_id, safe="").replace(".", "%2E")
+
+
+def _write_atomic(path: Path, data: bytes) -> None:
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "wb") as handle:
+        handle.write(data)
+        handle.flush()
+        os.fsync(handle.fileno())
+    os.replace(tmp, path)
+
+
+def _naive_utc(value: datetime | None) -> datetime | None:
+    # Stored timestamps are naive UTC; query parameters may carry an offset.
+    if value is None or value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def _row_dict(row: AuditLog) -> dict[str, Any]:
+    return {
+        "id": row.id,
+        "tenant_id": row.tenant_id,
+        "event_type": row.event_type,
+        "entity_id": row.entity_id,
+        "payload_json": row.payload_json,
+        "created_at": row.created_at.isoformat(timespec="microseconds"),
+    }
+
+
+class AuditArchive:
+    def __init__(self, directory: str, retention_days: int, batch_size: int, interval: float) -> None:
+        # Layout: <directory>/<tenant>/<YYYY-MM-DD>/<min_id>-<max_id>.ndjson.gz plus a .index.json sidecar.
+        # Segments are written once and never modified; a day gains more segments if later runs find more rows.
+        self.directory = Path(directory)
+        self.retention_days = retention_days
+        self.batch_size = batch_size
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread: threading.Thread | None = None
+        self.archived = 0
+        self.segments_written = 0
+        self.last_run: dict[str, Any] | None = None
+
+    def cutoff(self, older_than_days: int | None = None, now: datetime | None = None) -> datetime:
+        # Whole days only, so a run never splits a tenant's day between the table and a half-written archive.
+        days = self.retention_days if older_than_days is None else older_than_days
+        today = (now or datetime.utcnow()).date()
+        return datetime.combine(today - timedelta(days=days), time.min)
+
+    def archive(self, before: datetime) -> dict[str, Any]:
+        archived = 0
+        segments = 0
+        with self._lock:
+            while True:
+                with Session(db.engine) as session:
+                    rows = session.exec(
+                        select(AuditLog)
+                        .where(AuditLog.created_at < before)
+                        .order_by(AuditLog.created_at, AuditLog.id)
+                        .limit(self.batch_size)
+                    ).all()
+                    if not rows:
+                        break
+                    groups: dict[tuple[str, date], list[AuditLog]] = {}
+                    for row in rows:
+                        groups.setdefault((row.tenant_id, row.created_at.date()), []).append(row)
+                    for (tenant_id, day), group in groups.items():
+                        self._write_segment(tenant_id, day, group)
+                    # Rows are deleted only after their segments are durable; a crash in between re-archives the
+                    # same ids and readers drop the duplicates. The FTS delete trigger keeps search in step.
+                    session.execute(delete(AuditLog).where(AuditLog.id.in_([row.id for row in rows])))
+                    session.commit()
+                archived += len(rows)
+                segments += len(groups)
+        self.archived += archived
+        self.segments_written += segments
+        self.last_run = {"before": before.isoformat(), "archived": archived, "segments": segments}
+        return self.last_run
+
+    def _write_segment(self, tenant_id: str, day: date, rows: list[AuditLog]) -> None:
+        folder = self.directory / _tenant_dir(tenant_id) / day.isoformat()
+        folder.mkdir(parents=True, exist_ok=True)
+        ids = [row.id for row in rows]
+        name = f"{min(ids):012d}-{max(ids):012d}"
+        body = "".join(json.dumps(_row_dict(row), separators=(",", ":")) + "\n" for row in rows)
+        compressed = gzip.compress(body.encode("utf-8"), mtime=0)
+        _write_atomic(folder / f"{name}{SEGMENT_SUFFIX}", compressed)
+
+        entities = sorted({row.entity_id for row in rows if row.entity_id is not None})
+        index = {
+            "tenant_id": tenant_id,
+            "day": day.isoformat(),
+            "segment": f"{name}{SEGMENT_SUFFIX}",
+            "count": len(rows),
+            "min_id": min(ids),
+            "max_id": max(ids),
+            # Fixed precision so the timestamps also sort correctly as strings.
+            "min_created_at": min(row.created_at for row in rows).isoformat(timespec="microseconds"),
+            "max_created_at": max(row.created_at for row in rows).isoformat(timespec="microseconds"),
+            "event_types": sorted({row.event_type for row in rows}),
+            # None means "too many to list"; readers then have to open the segment.
+            "entity_ids": entities if len(entities) <= MAX_INDEXED_ENTITIES else None,
+            "bytes": len(compressed),
+            "sha256": hashlib.sha256(compressed).hexdigest(),
+        }
+        _write_atomic(folder / f"{name}{INDEX_SUFFIX}", json.dumps(index, separators=(",", ":")).encode("utf-8"))
+
+    def segments(
+        self, tenant_id: str | None = None, since: datetime | None = None, until: datetime | None = None
+    ) -> list[dict[str, Any]]:
+        if not self.directory.is_dir():
+            return []
+        since, until = _naive_utc(since), _naive_utc(until)
+        if tenant_id is not None:
+            tenant_dirs = [self.directory / _tenant_dir(tenant_id)]
+        else:
+            tenant_dirs = [path for path in self.directory.iterdir() if path.is_dir()]
+        found = []
+        for tenant_dir in tenant_dirs:
+            if not tenant_dir.is_dir():
+                continue
+            for day_dir in tenant_dir.iterdir():
+                try:
+                    day = date.fromisoformat(day_dir.name)
+                except ValueError:
+                    continue
+                # Day directories prune the search before any sidecar is opened.
+                if (since and day < since.date()) or (until and day > until.date()):
+                    continue
+                for index_path in day_dir.glob(f"*{INDEX_SUFFIX}"):
+                    index = json.loads(index_path.read_text(encoding="utf-8"))
+                    if since and datetime.fromisoformat(index["max_created_at"]) < since:
+                        continue
+                    if until and datetime.fromisoformat(index["min_created_at"]) >= until:
+                        continue
+                    found.append({**index, "path": str(index_path.with_name(index["segment"]))})
+        return sorted(found, key=lambda index: (index["max_created_at"], index["max_id"]), reverse=True)
+
+    def _read(self, segment: dict[str, Any]) -> Iterator[dict[str, Any]]:
+        with gzip.open(segment["path"], "rt", encoding="utf-8") as handle:
+            for line in handle:
+                if line.strip():
+                    yield json.loads(line)
+
+    def query(
+        self,
+        limit: int,
+        before: tuple[datetime, int] | None = None,
+        text_query: str | None = None,
+        tenant_id: str | None = None,
+        event_type: str | None = None,
+        entity_id: str | None = None,
+        since: datetime | None = None,
+        until: datetime | None = None,
+    ) -> list[dict[str, Any]]:
+        # Newest first by (created_at, id), the same order and cursor key as GET /audit on the live table.
+        since, until = _naive_utc(since), _naive_utc(until)
+        terms = text_query.lower().split() if text_query else []
+        found: dict[int, dict[str, Any]] = {}
+        for segment in self.segments(tenant_id, since, until):
+            if event_type and event_type not in segment["event_types"]:
+                continue
+            if entity_id and segment["entity_ids"] is not None and entity_id not in segment["entity_ids"]:
+                continue
+            if before and datetime.fromisoformat(segment["min_created_at"]) > before[0]:
+                continue
+            if len(found) >= limit:
+                oldest = sorted(found.values(), key=lambda row: (row["created_at"], row["id"]))[-limit]
+                if datetime.fromisoformat(segment["max_created_at"]) < oldest["created_at"]:
+                    break
+            for row in self._read(segment):
+                created_at = datetime.fromisoformat(row["created_at"])
+                if (event_type and row["event_type"] != event_type) or (entity_id and row["entity_id"] != entity_id):
+                    continue
+                if (since and created_at < since) or (until and created_at >= until):
+                    continue
+                if before and (created_at, row["id"]) >= before:
+                    continue
+                if terms:
+                    haystack = f"{row['event_type']} {row['entity_id'] or ''} {row['payload_json']}".lower()
+                    if not all(term in haystack for term in terms):
+                        continue
+                found[row["id"]] = {**row, "created_at": created_at}
+        return sorted(found.values(), key=lambda row: (row["created_at"], row["id"]), reverse=True)[:limit]
+
+    def start(self) -> None:
+        if self.interval <= 0 or (self._thread is not None and self._thread.is_alive()):
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="audit-archive", daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        while not self._stopped.wait(self.interval):
+            try:
+                self.archive(self.cutoff())
+            except (SQLAlchemyError, OSError):
+                logger.exception("audit archival failed")
+
+    def shutdown(self) -> None:
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout=30)
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "directory": str(self.directory),
+            "retention_days": self.retention_days,
+            "batch_size": self.batch_size,
+            "interval_seconds": self.interval,
+            "archived": self.archived,
+            "segments_written": self.segments_written,
+            "last_run": self.last_run,
+        }
+
+
+audit_archive = AuditArchive(
+    directory=os.getenv("AUDIT_ARCHIVE_DIR", "./audit_archive"),
+    retention_days=int(os.getenv("AUDIT_RETENTION_DAYS", "90")),
+    batch_size=int(os.getenv("AUDIT_ARCHIVE_BATCH_SIZE", "5000")),
+    interval=float(os.getenv("AUDIT_ARCHIVE_INTERVAL_SECONDS", "0")),
+)
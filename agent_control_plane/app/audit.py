@@ -0,0 +1,216 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any
+
+from sqlalchemy import event, insert
+from sqlalchemy.exc import SQLAlchemyError
+from sqlmodel import Session
+
+from . import db
+from .models import AuditLog
+
+logger = logging.getLogger(__name__)
+
+_PENDING_KEY = "audit_pending"
+
+
+class AuditSink:
+    def __init__(
+        self,
+        mode: str = "inline",
+        max_queue: int = 10000,
+        flush_size: int = 500,
+        flush_interval: float = 1.0,
+        enqueue_timeout: float = 0.5,
+        sync_tenants: set[str] | None = None,
+    ) -> None:
+        self.mode = mode
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.enqueue_timeout = enqueue_timeout
+        self.sync_tenants = sync_tenants or set()
+        self._queue: queue.Queue[dict[str, Any]] = queue.Queue(maxsize=max_queue)
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._thread_lock = threading.Lock()
+        self._overflow_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="audit-overflow")
+        self.flushed = 0
+        self.inline_overflow = 0
+
+    def _is_buffered(self, tenant_id: str) -> bool:
+        return self.mode == "buffered" and tenant_id not in self.sync_tenants
+
+    def record(
+        self,
+        session: Session,
+        tenant_id: str,
+        event_type: str,
+        entity_id: str | None,
+        payload: dict[str, Any],
+    ) -> None:
+        self.record_many(
+            session,
+            [
+                {
+                    "tenant_id": tenant_id,
+                    "event_type": event_type,
+                    "entity_id": entity_id,
+                    "payload_json": json.dumps(payload),
+                }
+            ],
+        )
+
+    def record_many(self, session: Session, rows: list[dict[str, Any]]) -> None:
+        now = datetime.utcnow()
+        inline = []
+        for row in rows:
+            row = {"created_at": now, **row}
+            if self._is_buffered(row["tenant_id"]):
+                # Handed to the queue only once the caller's transaction commits; dropped on rollback.
+                if not session.in_transaction():
+                    session.begin()
+                session.info.setdefault(_PENDING_KEY, []).append((self, row))
+            else:
+                inline.append(row)
+        if inline:
+            session.execute(insert(AuditLog), inline)
+
+    def _enqueue_committed(self, rows: list[dict[str, Any]]) -> None:
+        self._ensure_worker()
+        try:
+            asyncio.get_running_loop()
+            on_loop = True
+        except RuntimeError:
+            on_loop = False
+        overflow = []
+        # Backpressure: producers wait briefly for the flusher before writing synchronously. One deadline covers
+        # the whole batch, so a full queue costs at most enqueue_timeout per commit, not per row. Commits from an
+        # AsyncSession run on the event loop, which must not wait or write, so their overflow goes to a thread.
+        deadline = time.monotonic() + (0.0 if on_loop else self.enqueue_timeout)
+        for index, row in enumerate(rows):
+            try:
+                if on_loop:
+                    self._queue.put_nowait(row)
+                else:
+                    self._queue.put(row, timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Full:
+                overflow = rows[index:]
+                break
+        if self._queue.qsize() >= self.flush_size:
+            self._wake.set()
+        if overflow:
+            self.inline_overflow += len(overflow)
+            if on_loop:
+                self._overflow_pool.submit(self._write_overflow, overflow)
+            else:
+                self._write_overflow(overflow)
+
+    def _write_overflow(self, rows: list[dict[str, Any]]) -> None:
+        try:
+            with Session(db.engine) as session:
+                session.execute(insert(AuditLog), rows)
+                session.commit()
+        except SQLAlchemyError:
+            logger.exception("audit overflow write failed; dropping %d events", len(rows))
+            raise
+
+    def _ensure_worker(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._thread_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stopped.clear()
+                self._thread = threading.Thread(target=self._run, name="audit-sink", daemon=True)
+                self._thread.start()
+
+    def _run(self) -> None:
+        while not self._stopped.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+
+    def flush(self) -> int:
+        with self._flush_lock:
+            total = 0
+            while True:
+                batch = []
+                while len(batch) < self.flush_size:
+                    try:
+                        batch.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+                if not batch:
+                    return total
+                try:
+                    with Session(db.engine) as session:
+                        session.execute(insert(AuditLog), batch)
+                        session.commit()
+                except SQLAlchemyError:
+                    logger.exception("audit flush failed; requeueing %d events", len(batch))
+                    for row in batch:
+                        try:
+                            self._queue.put_nowait(row)
+                        except queue.Full:
+                            logger.error("audit queue full; dropping event %s", row["event_type"])
+                    return total
+                total += len(batch)
+                self.flushed += len(batch)
+
+    def shutdown(self) -> None:
+        self._stopped.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        # Wait for overflow writes in flight; the fresh pool starts no thread until the sink is used again.
+        self._overflow_pool.shutdown(wait=True)
+        self._overflow_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="audit-overflow")
+        self.flush()
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "mode": self.mode,
+            "queued": self._queue.qsize(),
+            "max_queue": self._queue.maxsize,
+            "flush_size": self.flush_size,
+            "flush_interval": self.flush_interval,
+            "flushed": self.flushed,
+            "inline_overflow": self.inline_overflow,
+            "sync_tenants": sorted(self.sync_tenants),
+        }
+
+
+audit_sink = AuditSink(
+    mode=os.getenv("AUDIT_SINK_MODE", "inline"),
+    max_queue=int(os.getenv("AUDIT_QUEUE_SIZE", "10000")),
+    flush_size=int(os.getenv("AUDIT_FLUSH_SIZE", "500")),
+    flush_interval=float(os.getenv("AUDIT_FLUSH_INTERVAL_SECONDS", "1.0")),
+    sync_tenants={tenant for tenant in os.getenv("AUDIT_SYNC_TENANTS", "").split(",") if tenant},
+)
+
+
+@event.listens_for(Session, "after_commit")
+def _enqueue_after_commit(session: Session) -> None:
+    pending = session.info.pop(_PENDING_KEY, None)
+    if not pending:
+        return
+    by_sink: dict[AuditSink, list[dict[str, Any]]] = {}
+    for sink, row in pending:
+        by_sink.setdefault(sink, []).append(row)
+    for sink, rows in by_sink.items():
+        sink._enqueue_committed(rows)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _discard_after_rollback(session: Session, previous_transaction) -> None:
+    session.info.pop(_PENDING_KEY, None)
@@ -0,0 +1,185 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from sqlmodel import Session, select
+
+from . import db
+from .manifests import load_manifest
+from .models import CapabilitySnapshot, ClassificationCacheEntry, RiskLevel
+
+Classification = tuple[str, str, float, RiskLevel]
+
+_WHITESPACE = re.compile(r"\s+")
+_DIGITS = re.compile(r"\d+")
+
+
+def normalize_email_text(subject: str, body: str) -> str:
+    # Templated mails differ mostly in numbers (invoice no., amounts, dates) and whitespace.
+    text = f"{subject}\n{body}".lower()
+    text = _DIGITS.sub("#", text)
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+class ClassificationCache:
+    def __init__(self, max_entries: int, ttl_seconds: int, persist: bool) -> None:
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.persist = persist
+        self._entries: OrderedDict[str, tuple[float, Classification]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.persistent_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key(subject: str, body: str, model: str) -> str:
+        digest = hashlib.sha256(f"{model}\0{normalize_email_text(subject, body)}".encode("utf-8"))
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Classification | None:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and now - entry[0] < self.ttl_seconds:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry:
+                del self._entries[key]
+
+        if self.persist:
+            stored = self._load(key)
+            if stored is not None:
+                with self._lock:
+                    self.hits += 1
+                    self.persistent_hits += 1
+                    self._store(key, stored[0], stored[1])
+                return stored[1]
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: str, model: str, value: Classification) -> None:
+        with self._lock:
+            self._store(key, time.time(), value)
+        if self.persist:
+            with Session(db.engine) as session:
+                session.merge(
+                    ClassificationCacheEntry(
+                        key=key,
+                        model=model,
+                        result_json=json.dumps([value[0], value[1], value[2], value[3].value]),
+                    )
+                )
+                session.commit()
+
+    def _store(self, key: str, stored_at: float, value: Classification) -> None:
+        self._entries[key] = (stored_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def _load(self, key: str) -> tuple[float, Classification] | None:
+        with Session(db.engine) as session:
+            entry = session.get(ClassificationCacheEntry, key)
+            if not entry:
+                return None
+            if entry.created_at < datetime.utcnow() - timedelta(seconds=self.ttl_seconds):
+                session.delete(entry)
+                session.commit()
+                return None
+            intent, why, confidence, risk = json.loads(entry.result_json)
+            stored_at = time.time() - (datetime.utcnow() - entry.created_at).total_seconds()
+            return stored_at, (intent, why, float(confidence), RiskLevel(risk))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict[str, int | bool]:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "persist": self.persist,
+                "hits": self.hits,
+                "persistent_hits": self.persistent_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+classification_cache = ClassificationCache(
+    max_entries=int(os.getenv("CLASSIFY_CACHE_SIZE", "10000")),
+    ttl_seconds=int(os.getenv("CLASSIFY_CACHE_TTL_SECONDS", "86400")),
+    persist=os.getenv("CLASSIFY_CACHE_PERSIST", "false").lower() in {"1", "true", "yes"},
+)
+
+
+class CachedManifest:
+    __slots__ = ("snapshot_id", "version", "pages", "body", "etag", "actions")
+
+    def __init__(self, snapshot_id: int | None, version: str, pages: list[dict]) -> None:
+        self.snapshot_id = snapshot_id
+        self.version = version
+        self.pages = pages
+        self.body = json.dumps({"version": version, "pages": pages}, separators=(",", ":")).encode("utf-8")
+        self.etag = f'"{hashlib.sha256(self.body).hexdigest()[:32]}"'
+        self.actions = {action["id"]: action for page in pages for action in page.get("actions", []) if "id" in action}
+
+
+class ManifestCache:
+    def __init__(self) -> None:
+        self._entry: CachedManifest | None = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.loads = 0
+
+    def latest_id(self, session: Session) -> int | None:
+        return session.exec(
+            select(CapabilitySnapshot.id).order_by(CapabilitySnapshot.created_at.desc(), CapabilitySnapshot.id.desc())
+        ).first()
+
+    def is_current(self, snapshot_id: int | None) -> bool:
+        entry = self._entry
+        return entry is not None and entry.snapshot_id == snapshot_id
+
+    def latest(self, session: Session) -> CachedManifest:
+        # Only the id is read on the hot path; the manifest blob is parsed once per snapshot.
+        snapshot_id = self.latest_id(session)
+        entry = self._entry
+        if entry is not None and entry.snapshot_id == snapshot_id:
+            self.hits += 1
+            return entry
+
+        if snapshot_id is None:
+            entry = CachedManifest(None, "bootstrap", [])
+        else:
+            snapshot = session.get(CapabilitySnapshot, snapshot_id)
+            entry = CachedManifest(snapshot_id, snapshot.version, load_manifest(session, snapshot)["pages"])
+        self.loads += 1
+        with self._lock:
+            self._entry = entry
+        return entry
+
+    def action(self, session: Session, action_id: str) -> dict | None:
+        return self.latest(session).actions.get(action_id)
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._entry = None
+
+
+manifest_cache = ManifestCache()
@@ -1,12 +1,174 @@
+import os
+from enum import Enum
+
+from sqlalchemy import event, inspect, text
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
 from sqlmodel import Session, SQLModel, create_engine
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./agent_control_plane.db")
+DATABASE_READ_URL = os.getenv("DATABASE_READ_URL", DATABASE_URL)
+_ASYNC_DRIVERS = {"sqlite": "sqlite+aiosqlite", "postgresql": "postgresql+asyncpg"}
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+
+
+def _is_memory(url: str) -> bool:
+    database = make_url(url).database
+    return not database or database == ":memory:" or "mode=memory" in url
+
+
+def _async_url(url: str) -> str:
+    scheme, rest = url.split("://", 1)
+    return f"{_ASYNC_DRIVERS.get(scheme, scheme)}://{rest}"
+
+
+def _engine_options(url: str) -> dict:
+    options = {"echo": False}
+    if url.startswith("sqlite") and _is_memory(url):
+        options["connect_args"] = {"check_same_thread": False}
+    else:
+        options["pool_size"] = int(os.getenv("DB_POOL_SIZE", "20"))
+        options["max_overflow"] = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+        options["pool_timeout"] = float(os.getenv("DB_POOL_TIMEOUT_SECONDS", "30"))
+        if url.startswith("sqlite"):
+            options["connect_args"] = {"check_same_thread": False, "timeout": SQLITE_BUSY_TIMEOUT_MS / 1000}
+        else:
+            options["pool_pre_ping"] = True
+            options["pool_recycle"] = int(os.getenv("DB_POOL_RECYCLE_SECONDS", "1800"))
+    return options
+
+
+def _make_engine(url: str, read_only: bool = False) -> Engine:
+    created = create_engine(url, **_engine_options(url))
+    if created.dialect.name == "sqlite":
+        _configure_sqlite(created, read_only, memory=_is_memory(url))
+    return created
+
+
+def _make_async_engine(url: str, read_only: bool = False) -> AsyncEngine:
+    created = create_async_engine(url, **_engine_options(url))
+    if created.dialect.name == "sqlite":
+        _configure_sqlite(created.sync_engine, read_only, memory=_is_memory(url))
+    return created
+
+
+def _configure_sqlite(target: Engine, read_only: bool, memory: bool) -> None:
+    # WAL lets dashboard reads proceed while ingestion writes; NORMAL is durable across app crashes in WAL mode.
+    @event.listens_for(target, "connect")
+    def _on_connect(dbapi_connection, connection_record) -> None:
+        cursor = dbapi_connection.cursor()
+        if not memory:
+            cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+        if read_only:
+            cursor.execute("PRAGMA query_only=ON")
+        cursor.close()
+
+
+engine = _make_engine(DATABASE_URL)
+# In-memory databases are per connection, so reads must share the writer's engine there.
+read_engine = engine if _is_memory(DATABASE_READ_URL) else _make_engine(DATABASE_READ_URL, read_only=True)
 
-engine = create_engine("sqlite:///./agent_control_plane.db", echo=False)
+# Async engines back the hot endpoints. An in-memory SQLite URL gives them a database separate from the sync
+# engine's, so async endpoints need a file or server database.
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL", _async_url(DATABASE_URL))
+ASYNC_DATABASE_READ_URL = os.getenv("ASYNC_DATABASE_READ_URL", _async_url(DATABASE_READ_URL))
+async_engine = _make_async_engine(ASYNC_DATABASE_URL)
+async_read_engine = (
+    async_engine
+    if _is_memory(ASYNC_DATABASE_READ_URL)
+    else _make_async_engine(ASYNC_DATABASE_READ_URL, read_only=True)
+)
+
+AUDIT_FTS_TABLE = "auditlog_fts"
+audit_fts_enabled = False
+
+_AUDIT_FTS_DDL = [
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {AUDIT_FTS_TABLE} USING fts5("
+    "event_type, entity_id, payload_json, content='auditlog', content_rowid='id')",
+    f"CREATE TRIGGER IF NOT EXISTS auditlog_fts_ai AFTER INSERT ON auditlog BEGIN "
+    f"INSERT INTO {AUDIT_FTS_TABLE}(rowid, event_type, entity_id, payload_json) "
+    "VALUES (new.id, new.event_type, new.entity_id, new.payload_json); END",
+    f"CREATE TRIGGER IF NOT EXISTS auditlog_fts_ad AFTER DELETE ON auditlog BEGIN "
+    f"INSERT INTO {AUDIT_FTS_TABLE}({AUDIT_FTS_TABLE}, rowid, event_type, entity_id, payload_json) "
+    "VALUES ('delete', old.id, old.event_type, old.entity_id, old.payload_json); END",
+]
+
+
+def _create_audit_fts() -> bool:
+    if engine.dialect.name != "sqlite":
+        return False
+    try:
+        with engine.begin() as connection:
+            exists = connection.execute(
+                text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+                {"name": AUDIT_FTS_TABLE},
+            ).first()
+            for statement in _AUDIT_FTS_DDL:
+                connection.execute(text(statement))
+            if not exists:
+                # Index audit rows written before the FTS table existed.
+                connection.execute(text(f"INSERT INTO {AUDIT_FTS_TABLE}({AUDIT_FTS_TABLE}) VALUES ('rebuild')"))
+    except OperationalError:
+        # SQLite build without FTS5; audit search falls back to LIKE.
+        return False
+    return True
+
+
+def _add_missing_columns() -> None:
+    # Minimal forward migration for columns added to existing tables; create_all never alters tables.
+    with engine.begin() as connection:
+        inspector = inspect(connection)
+        for table in SQLModel.metadata.sorted_tables:
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                column_type = column.type.compile(dialect=engine.dialect)
+                default = column.default.arg if column.default is not None and column.default.is_scalar else None
+                if isinstance(default, Enum):
+                    default = default.name
+                clause = f" DEFAULT {default!r}" if isinstance(default, str) else ""
+                if isinstance(default, bool):
+                    clause = f" DEFAULT {int(default)}"
+                elif isinstance(default, (int, float)):
+                    clause = f" DEFAULT {default}"
+                connection.execute(text(f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column_type}{clause}'))
 
 
 def create_db() -> None:
+    global audit_fts_enabled
     SQLModel.metadata.create_all(engine)
+    _add_missing_columns()
+    # create_all skips tables that already exist, so indexes added later are created explicitly.
+    for table in SQLModel.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(engine, checkfirst=True)
+    audit_fts_enabled = _create_audit_fts()
 
 
 def get_session():
     with Session(engine) as session:
         yield session
+
+
+def get_read_session():
+    # List and lookup endpoints; query_only on SQLite turns any accidental write into an error.
+    with Session(read_engine, autoflush=False) as session:
+        yield session
+
+
+async def get_async_session():
+    # Objects stay loaded after commit; an expired attribute would need IO outside the event loop's reach.
+    async with AsyncSession(async_engine, expire_on_commit=False) as session:
+        yield session
+
+
+async def get_async_read_session():
+    async with AsyncSession(async_read_engine, autoflush=False) as session:
+        yield session
@@ -0,0 +1,285 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Any, AsyncIterator
+
+from sqlalchemy import delete, event, func, insert
+from sqlalchemy.exc import SQLAlchemyError
+from sqlmodel import Session, select
+
+from . import db
+from .models import ChangeEvent
+
+logger = logging.getLogger(__name__)
+
+_WAKE_KEY = "change_feed_wake"
+ENTITY_TYPES = ("job", "step", "task", "approval")
+
+
+def _event_dict(row: ChangeEvent) -> dict[str, Any]:
+    return {
+        "id": row.id,
+        "tenant_id": row.tenant_id,
+        "entity_type": row.entity_type,
+        "entity_id": row.entity_id,
+        "status": row.status,
+        "data": json.loads(row.payload_json),
+        "created_at": row.created_at.isoformat(),
+    }
+
+
+def format_sse(change: dict[str, Any]) -> str:
+    return f"id: {change['id']}\nevent: {change['entity_type']}\ndata: {json.dumps(change, separators=(',', ':'))}\n\n"
+
+
+class Subscription:
+    def __init__(self, loop: asyncio.AbstractEventLoop, tenant_id: str | None, entity_types: set[str] | None) -> None:
+        self.loop = loop
+        self.tenant_id = tenant_id
+        self.entity_types = entity_types
+        self.queue: asyncio.Queue[dict[str, Any] | None] = asyncio.Queue()
+        self.overflowed = False
+
+    def matches(self, change: dict[str, Any]) -> bool:
+        if self.tenant_id and change["tenant_id"] != self.tenant_id:
+            return False
+        return not self.entity_types or change["entity_type"] in self.entity_types
+
+
+class ChangeFeed:
+    def __init__(
+        self,
+        poll_interval: float,
+        retention_seconds: int,
+        replay_limit: int,
+        max_queue: int,
+        heartbeat_seconds: float,
+    ) -> None:
+        # Changes are rows written in the same transaction as the change itself, so every worker process
+        # sees every change and clients resume by id. One poller per process fans out to its subscribers.
+        self.poll_interval = poll_interval
+        self.retention_seconds = retention_seconds
+        self.replay_limit = replay_limit
+        self.max_queue = max_queue
+        self.heartbeat_seconds = heartbeat_seconds
+        self._subscribers: set[Subscription] = set()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._cursor: int | None = None
+        self._last_prune = 0.0
+        self.published = 0
+        self.delivered = 0
+        self.overflows = 0
+
+    def publish(
+        self,
+        session: Session,
+        tenant_id: str,
+        entity_type: str,
+        entity_id: int | str,
+        status: str | None = None,
+        **data: Any,
+    ) -> None:
+        self.publish_many(
+            session,
+            [{"tenant_id": tenant_id, "entity_type": entity_type, "entity_id": entity_id, "status": status, **data}],
+        )
+
+    def publish_many(self, session: Session, changes: list[dict[str, Any]]) -> None:
+        if not changes:
+            return
+        now = datetime.utcnow()
+        rows = []
+        for change in changes:
+            change = dict(change)
+            status = change.pop("status", None)
+            rows.append(
+                {
+                    "tenant_id": change.pop("tenant_id"),
+                    "entity_type": change.pop("entity_type"),
+                    "entity_id": str(change.pop("entity_id")),
+                    "status": getattr(status, "value", status),
+                    "payload_json": json.dumps(change, default=str),
+                    "created_at": now,
+                }
+            )
+        session.execute(insert(ChangeEvent), rows)
+        session.info[_WAKE_KEY] = self
+        self.published += len(rows)
+
+    def subscribe(self, tenant_id: str | None = None, entity_types: set[str] | None = None) -> Subscription:
+        subscription = Subscription(asyncio.get_running_loop(), tenant_id, entity_types)
+        with self._lock:
+            self._subscribers.add(subscription)
+        self.start()
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def _replay(self, subscription: Subscription, after_id: int) -> tuple[list[dict[str, Any]], bool]:
+        with Session(db.engine) as session:
+            oldest, newest = session.exec(select(func.min(ChangeEvent.id), func.max(ChangeEvent.id))).one()
+            if after_id > (newest or 0) or (oldest is not None and after_id < oldest - 1):
+                # Pruned past the client's position (or the store was reset): the client must refetch state.
+                return [], True
+            query = select(ChangeEvent).where(ChangeEvent.id > after_id)
+            if subscription.tenant_id:
+                query = query.where(ChangeEvent.tenant_id == subscription.tenant_id)
+            if subscription.entity_types:
+                query = query.where(ChangeEvent.entity_type.in_(subscription.entity_types))
+            rows = session.exec(query.order_by(ChangeEvent.id).limit(self.replay_limit + 1)).all()
+        if len(rows) > self.replay_limit:
+            return [], True
+        return [_event_dict(row) for row in rows], False
+
+    def _head(self) -> int:
+        with Session(db.engine) as session:
+            return session.exec(select(func.max(ChangeEvent.id))).one() or 0
+
+    async def stream(self, subscription: Subscription, last_event_id: str | None) -> AsyncIterator[str]:
+        try:
+            # The subscription is registered before replaying, so nothing committed in between is lost;
+            # anything seen twice is skipped by id.
+            if last_event_id and last_event_id.isdigit():
+                replayed, reset = await asyncio.to_thread(self._replay, subscription, int(last_event_id))
+                if reset:
+                    yield "event: reset\ndata: {}\n\n"
+                    last_id = await asyncio.to_thread(self._head)
+                else:
+                    last_id = int(last_event_id)
+                for change in replayed:
+                    last_id = change["id"]
+                    yield format_sse(change)
+            else:
+                last_id = await asyncio.to_thread(self._head)
+                yield ": connected\n\n"
+
+            while True:
+                try:
+                    change = await asyncio.wait_for(subscription.queue.get(), self.heartbeat_seconds)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                if change is None:
+                    # Slow consumer; it reconnects with Last-Event-ID and replays from the table.
+                    yield "event: overflow\ndata: {}\n\n"
+                    return
+                if change["id"] <= last_id:
+                    continue
+                last_id = change["id"]
+                yield format_sse(change)
+        finally:
+            self.unsubscribe(subscription)
+
+    def poll(self) -> int:
+        # Reading "id > cursor" relies on SQLite's single writer: ids become visible in commit order.
+        with Session(db.engine) as session:
+            if self._cursor is None:
+                self._cursor = session.exec(select(func.max(ChangeEvent.id))).one() or 0
+            rows = []
+            if self._subscribers:
+                rows = session.exec(
+                    select(ChangeEvent).where(ChangeEvent.id > self._cursor).order_by(ChangeEvent.id).limit(1000)
+                ).all()
+            # Snapshot after the read so a subscriber that registered meanwhile still gets these rows.
+            with self._lock:
+                subscribers = list(self._subscribers)
+            if rows:
+                self._cursor = rows[-1].id
+            elif not subscribers:
+                # Nobody is listening; skip ahead so a later subscriber starts from now.
+                self._cursor = session.exec(select(func.max(ChangeEvent.id))).one() or 0
+            if time.monotonic() - self._last_prune >= 60:
+                cutoff = datetime.utcnow() - timedelta(seconds=self.retention_seconds)
+                # The newest row always survives: tables created before AUTOINCREMENT would otherwise restart
+                # at id 1 and every connected cursor would skip the new events.
+                newest = session.exec(select(func.max(ChangeEvent.id))).one() or 0
+                session.execute(delete(ChangeEvent).where(ChangeEvent.created_at < cutoff, ChangeEvent.id < newest))
+                session.commit()
+                self._last_prune = time.monotonic()
+
+        changes = [_event_dict(row) for row in rows]
+        for subscription in subscribers:
+            for change in changes:
+                if not subscription.matches(change) or subscription.overflowed:
+                    continue
+                if subscription.queue.qsize() >= self.max_queue:
+                    subscription.overflowed = True
+                    self.overflows += 1
+                    subscription.loop.call_soon_threadsafe(subscription.queue.put_nowait, None)
+                    continue
+                subscription.loop.call_soon_threadsafe(subscription.queue.put_nowait, change)
+                self.delivered += 1
+        return len(changes)
+
+    def wake(self) -> None:
+        self._wake.set()
+
+    def start(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stopped.clear()
+                self._thread = threading.Thread(target=self._run, name="change-feed", daemon=True)
+                self._thread.start()
+
+    def _run(self) -> None:
+        while not self._stopped.is_set():
+            try:
+                self.poll()
+            except SQLAlchemyError:
+                logger.exception("change feed poll failed")
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+
+    def shutdown(self) -> None:
+        self._stopped.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            subscribers = len(self._subscribers)
+        return {
+            "subscribers": subscribers,
+            "cursor": self._cursor,
+            "poll_interval": self.poll_interval,
+            "retention_seconds": self.retention_seconds,
+            "published": self.published,
+            "delivered": self.delivered,
+            "overflows": self.overflows,
+        }
+
+
+change_feed = ChangeFeed(
+    poll_interval=float(os.getenv("EVENTS_POLL_INTERVAL_SECONDS", "0.5")),
+    retention_seconds=int(os.getenv("EVENTS_RETENTION_SECONDS", "3600")),
+    replay_limit=int(os.getenv("EVENTS_REPLAY_LIMIT", "10000")),
+    max_queue=int(os.getenv("EVENTS_SUBSCRIBER_QUEUE_SIZE", "1000")),
+    heartbeat_seconds=float(os.getenv("EVENTS_HEARTBEAT_SECONDS", "15")),
+)
+
+
+@event.listens_for(Session, "after_commit")
+def _wake_after_commit(session: Session) -> None:
+    # Local commits wake the poller immediately; changes from other processes arrive on the next poll.
+    feed = session.info.pop(_WAKE_KEY, None)
+    if feed is not None:
+        feed.wake()
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _discard_after_rollback(session: Session, previous_transaction) -> None:
+    session.info.pop(_WAKE_KEY, None)
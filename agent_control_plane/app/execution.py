@@ -0,0 +1,371 @@
+from __future__ import annotations
+
+import json
+import logging
+import os
+import socket
+import threading
+import uuid
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from datetime import datetime, timedelta
+from typing import Any, Callable
+
+from sqlalchemy import and_, exists, func, or_, update
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import aliased
+from sqlmodel import Session, select
+
+from . import db
+from .audit import audit_sink
+from .events import change_feed
+from .models import Approval, Job, JobStatus, JobStep, Settings
+from .settings_cache import tenant_settings
+from .workers import BoundedExecutor
+
+logger = logging.getLogger(__name__)
+
+StepHandler = Callable[[dict[str, Any]], dict[str, Any]]
+
+
+def dispatch_handler(step: dict[str, Any]) -> dict[str, Any]:
+    # No backend integration exists yet; the step is recorded as handed off to the dispatch surface.
+    return {"dispatched": step["action_id"], "input": json.loads(step["input_json"])}
+
+
+class JobEngine:
+    def __init__(
+        self,
+        max_workers: int,
+        tenant_concurrency: int,
+        lease_seconds: int,
+        max_attempts: int,
+        poll_interval: float,
+    ) -> None:
+        self.max_workers = max_workers
+        self.tenant_concurrency = tenant_concurrency
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.handlers: dict[str, StepHandler] = {"dispatch": dispatch_handler}
+        # Caps are enforced by _running; the pool's headroom only covers the gap between a step
+        # finishing and its thread slot being released.
+        self._pool = BoundedExecutor("jobs", max_workers=max_workers, max_pending=max_workers)
+        self._running: Counter[str] = Counter()
+        self._futures: set[Future] = set()
+        self._lock = threading.Lock()
+        self._claim_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread: threading.Thread | None = None
+        self.claimed = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.retried = 0
+        self.lost_leases = 0
+
+    def register(self, backend: str, handler: StepHandler) -> None:
+        self.handlers[backend] = handler
+
+    @staticmethod
+    def _runnable(now: datetime):
+        # Pending steps of executing jobs, plus running steps whose lease expired (crashed worker).
+        # Kill-switched tenants keep their queue; it is picked up again once the switch is lifted.
+        killed = select(Settings.tenant_id).where(Settings.kill_switch == True)  # noqa: E712
+        # The job status is not trusted alone: no step runs while any gated step of its job lacks an approval.
+        gate = aliased(JobStep)
+        ungated = exists().where(
+            gate.job_id == Job.id,
+            gate.requires_approval == True,  # noqa: E712
+            ~exists().where(Approval.job_step_id == gate.id, Approval.decision == "approved"),
+        )
+        return and_(
+            Job.status == JobStatus.executing,
+            Job.tenant_id.not_in(killed),
+            ~ungated,
+            or_(
+                JobStep.status == "pending",
+                and_(JobStep.status == "running", JobStep.lease_expires_at < now),
+            ),
+        )
+
+    def _allocate(self, tenants: list[str], free: int) -> dict[str, int]:
+        # Round-robin one slot at a time so a tenant with thousands of queued steps cannot take every worker.
+        allocation = {tenant: 0 for tenant in tenants}
+        while free > 0:
+            progressed = False
+            for tenant in tenants:
+                if free == 0:
+                    break
+                if self._running[tenant] + allocation[tenant] < self.tenant_concurrency:
+                    allocation[tenant] += 1
+                    free -= 1
+                    progressed = True
+            if not progressed:
+                break
+        return {tenant: slots for tenant, slots in allocation.items() if slots}
+
+    def _claim(self) -> list[dict[str, Any]]:
+        with self._lock:
+            free = self.max_workers - sum(self._running.values())
+        if free <= 0:
+            return []
+
+        now = datetime.utcnow()
+        with Session(db.engine) as session:
+            # Tenants are visited oldest-work-first so allocation order is stable between polls.
+            tenants = session.exec(
+                select(Job.tenant_id)
+                .join(JobStep, JobStep.job_id == Job.id)
+                .where(self._runnable(now))
+                .group_by(Job.tenant_id)
+                .order_by(func.min(JobStep.id))
+            ).all()
+            with self._lock:
+                allocation = self._allocate(list(tenants), free)
+
+            candidates: dict[int, str] = {}
+            for tenant, slots in allocation.items():
+                ids = session.exec(
+                    select(JobStep.id)
+                    .join(Job, Job.id == JobStep.job_id)
+                    .where(Job.tenant_id == tenant, self._runnable(now))
+                    .order_by(JobStep.id)
+                    .limit(slots)
+                ).all()
+                candidates.update({step_id: tenant for step_id in ids})
+            if not candidates:
+                return []
+
+            # The conditional update is the lease: another worker that read the same candidates claims none of them.
+            rows = session.execute(
+                update(JobStep)
+                .where(
+                    JobStep.id.in_(candidates),
+                    or_(
+                        JobStep.status == "pending",
+                        and_(JobStep.status == "running", JobStep.lease_expires_at < now),
+                    ),
+                )
+                .values(
+                    status="running",
+                    lease_owner=self.owner,
+                    lease_expires_at=now + timedelta(seconds=self.lease_seconds),
+                    attempts=JobStep.attempts + 1,
+                    started_at=now,
+                )
+                .returning(
+                    JobStep.id, JobStep.job_id, JobStep.action_id, JobStep.backend, JobStep.input_json, JobStep.attempts
+                )
+                .execution_options(synchronize_session=False)
+            ).all()
+            steps = [{**row._asdict(), "tenant_id": candidates[row.id]} for row in rows]
+            change_feed.publish_many(session, [self._step_change(step, "running") for step in steps])
+            session.commit()
+
+        with self._lock:
+            self._running.update(step["tenant_id"] for step in steps)
+        self.claimed += len(steps)
+        return steps
+
+    def run_once(self) -> list[Future]:
+        with self._claim_lock:
+            steps = self._claim()
+        futures = []
+        for step in steps:
+            future = self._pool.try_submit(self._execute, step)
+            if future is None:
+                self._release(step)
+                continue
+            with self._lock:
+                self._futures.add(future)
+            future.add_done_callback(self._forget)
+            futures.append(future)
+        return futures
+
+    def _forget(self, future: Future) -> None:
+        with self._lock:
+            self._futures.discard(future)
+
+    def drain(self, timeout: float = 30.0) -> int:
+        # Runs until no step can be claimed; used by tests and one-off maintenance.
+        total = 0
+        while True:
+            claimed = len(self.run_once())
+            total += claimed
+            with self._lock:
+                pending = list(self._futures)
+            if not pending:
+                # A fast step can finish before its future is looked at; its retry may be claimable already.
+                if not claimed:
+                    return total
+                continue
+            wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+
+    def _execute(self, step: dict[str, Any]) -> None:
+        try:
+            if self._kill_switched(step["tenant_id"]):
+                # Thrown between claim and run: hand the step back unrun and unbilled.
+                self._unclaim(step)
+                return
+            try:
+                handler = self.handlers.get(step["backend"])
+                if handler is None:
+                    raise LookupError(f"no handler for backend {step['backend']!r}")
+                output, ok = handler(step), True
+            except Exception as exc:
+                output, ok = {"error": f"{type(exc).__name__}: {exc}"}, False
+            self._finish(step, output, ok)
+        except SQLAlchemyError:
+            # The lease expires and another poll picks the step up again.
+            logger.exception("failed to update job step %s", step["id"])
+        finally:
+            with self._lock:
+                self._running[step["tenant_id"]] -= 1
+            self._wake.set()
+
+    @staticmethod
+    def _kill_switched(tenant_id: str) -> bool:
+        with Session(db.engine) as session:
+            return tenant_settings.get(session, tenant_id).kill_switch
+
+    def _finish(self, step: dict[str, Any], output: dict[str, Any], ok: bool) -> None:
+        now = datetime.utcnow()
+        if ok:
+            status = "succeeded"
+        elif step["attempts"] < self.max_attempts:
+            status = "pending"
+        else:
+            status = "failed"
+
+        with Session(db.engine) as session:
+            result = session.execute(
+                update(JobStep)
+                .where(JobStep.id == step["id"], JobStep.status == "running", JobStep.lease_owner == self.owner)
+                .values(
+                    status=status,
+                    output_json=json.dumps(output),
+                    lease_owner=None,
+                    lease_expires_at=None,
+                    finished_at=None if status == "pending" else now,
+                )
+                .execution_options(synchronize_session=False)
+            )
+            if result.rowcount == 0:
+                # Lease expired and the step was reclaimed elsewhere; that run owns the outcome.
+                self.lost_leases += 1
+                session.rollback()
+                return
+            change_feed.publish_many(session, [self._step_change(step, status)])
+            if status == "pending":
+                self.retried += 1
+                session.commit()
+                return
+
+            audit_sink.record(session, step["tenant_id"], f"job_step_{status}", str(step["id"]), output)
+            job_status = JobStatus.failed if status == "failed" else None
+            if job_status is None:
+                unfinished = session.exec(
+                    select(func.count())
+                    .select_from(JobStep)
+                    .where(JobStep.job_id == step["job_id"], JobStep.status != "succeeded")
+                ).one()
+                if unfinished == 0:
+                    job_status = JobStatus.succeeded
+            if job_status is not None:
+                # Aborted jobs keep their status even if an in-flight step completes afterwards.
+                updated = session.execute(
+                    update(Job)
+                    .where(Job.id == step["job_id"], Job.status == JobStatus.executing)
+                    .values(status=job_status, updated_at=now)
+                    .execution_options(synchronize_session=False)
+                )
+                if updated.rowcount:
+                    audit_sink.record(session, step["tenant_id"], f"job_{job_status.value}", str(step["job_id"]), {})
+                    change_feed.publish(session, step["tenant_id"], "job", step["job_id"], job_status)
+            session.commit()
+        if status == "succeeded":
+            self.succeeded += 1
+        else:
+            self.failed += 1
+
+    @staticmethod
+    def _step_change(step: dict[str, Any], status: str) -> dict[str, Any]:
+        return {
+            "tenant_id": step["tenant_id"],
+            "entity_type": "step",
+            "entity_id": step["id"],
+            "status": status,
+            "job_id": step["job_id"],
+            "attempts": step["attempts"],
+        }
+
+    def _release(self, step: dict[str, Any]) -> None:
+        self._unclaim(step)
+        with self._lock:
+            self._running[step["tenant_id"]] -= 1
+
+    def _unclaim(self, step: dict[str, Any]) -> None:
+        with Session(db.engine) as session:
+            session.execute(
+                update(JobStep)
+                .where(JobStep.id == step["id"], JobStep.lease_owner == self.owner)
+                .values(status="pending", lease_owner=None, lease_expires_at=None, attempts=JobStep.attempts - 1)
+                .execution_options(synchronize_session=False)
+            )
+            unclaimed = {**step, "attempts": step["attempts"] - 1}
+            change_feed.publish_many(session, [self._step_change(unclaimed, "pending")])
+            session.commit()
+
+    def wake(self) -> None:
+        self._wake.set()
+
+    def start(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="job-engine", daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        while not self._stopped.is_set():
+            try:
+                self.run_once()
+            except SQLAlchemyError:
+                logger.exception("job engine poll failed")
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+
+    def shutdown(self) -> None:
+        self._stopped.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        self._pool.shutdown(wait=True)
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            running = {tenant: count for tenant, count in self._running.items() if count}
+        return {
+            "owner": self.owner,
+            "concurrency": self.max_workers,
+            "tenant_concurrency": self.tenant_concurrency,
+            "lease_seconds": self.lease_seconds,
+            "max_attempts": self.max_attempts,
+            "running": running,
+            "claimed": self.claimed,
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "retried": self.retried,
+            "lost_leases": self.lost_leases,
+        }
+
+
+job_engine = JobEngine(
+    max_workers=int(os.getenv("JOB_CONCURRENCY", "8")),
+    tenant_concurrency=int(os.getenv("JOB_TENANT_CONCURRENCY", "2")),
+    lease_seconds=int(os.getenv("JOB_LEASE_SECONDS", "60")),
+    max_attempts=int(os.getenv("JOB_MAX_ATTEMPTS", "3")),
+    poll_interval=float(os.getenv("JOB_POLL_INTERVAL_SECONDS", "1.0")),
+)
@@ -0,0 +1,107 @@
+from __future__ import annotations
+
+import csv
+import io
+import json
+import os
+from datetime import datetime
+from enum import Enum
+from typing import Any, Iterator
+
+from sqlalchemy import select
+from sqlmodel import Session
+
+from . import db
+from .models import AuditLog, Job, Task
+
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv; charset=utf-8"}
+
+# entity -> (table, time column used for the window and ordering, exported columns)
+EXPORTS = {
+    "audit": (
+        AuditLog,
+        AuditLog.created_at,
+        [
+            AuditLog.id,
+            AuditLog.tenant_id,
+            AuditLog.event_type,
+            AuditLog.entity_id,
+            AuditLog.payload_json,
+            AuditLog.created_at,
+        ],
+    ),
+    "jobs": (
+        Job,
+        Job.started_at,
+        [Job.id, Job.task_id, Job.tenant_id, Job.status, Job.source, Job.started_at, Job.updated_at],
+    ),
+    "tasks": (
+        Task,
+        Task.created_at,
+        [
+            Task.id,
+            Task.email_id,
+            Task.tenant_id,
+            Task.intent,
+            Task.confidence,
+            Task.risk,
+            Task.status,
+            Task.why,
+            Task.missing_fields,
+            Task.created_at,
+        ],
+    ),
+}
+
+
+def _plain(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, Enum):
+        return value.value
+    return value
+
+
+def iter_export(
+    entity: str,
+    fmt: str,
+    tenant_id: str | None = None,
+    since: datetime | None = None,
+    until: datetime | None = None,
+    status: str | None = None,
+    batch_size: int = EXPORT_BATCH_SIZE,
+) -> Iterator[str]:
+    model, time_column, columns = EXPORTS[entity]
+    query = select(*columns)
+    if tenant_id:
+        query = query.where(model.tenant_id == tenant_id)
+    if status and entity != "audit":
+        query = query.where(model.status == status)
+    if since:
+        query = query.where(time_column >= since)
+    if until:
+        query = query.where(time_column < until)
+    # Oldest first so a nightly pull can resume from the last timestamp it saw.
+    query = query.order_by(time_column, model.id).execution_options(yield_per=batch_size)
+
+    names = [column.key for column in columns]
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    if fmt == "csv":
+        writer.writerow(names)
+        yield buffer.getvalue()
+
+    # The session lives inside the generator: it outlives the request handler and closes when the client goes away.
+    # Plain column rows (no ORM identity map) fetched in yield_per batches keep memory flat regardless of volume.
+    with Session(db.read_engine) as session:
+        for partition in session.execute(query).partitions():
+            buffer.seek(0)
+            buffer.truncate()
+            if fmt == "csv":
+                writer.writerows([[_plain(value) for value in row] for row in partition])
+            else:
+                for row in partition:
+                    record = {name: _plain(value) for name, value in zip(names, row)}
+                    buffer.write(json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n")
+            yield buffer.getvalue()
@@ -0,0 +1,136 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any
+
+from sqlalchemy import delete
+from sqlmodel import Session, select
+
+from .models import DispatchIdempotency
+
+StoredResponse = tuple[str, dict[str, Any]]
+
+
+class IdempotencyStore:
+    def __init__(self, ttl_seconds: int, max_cached: int, purge_interval: float) -> None:
+        # The table is the source of truth; the in-process LRU absorbs retry storms on the same key.
+        self.ttl_seconds = ttl_seconds
+        self.max_cached = max_cached
+        self.purge_interval = purge_interval
+        self._entries: OrderedDict[tuple[str, str], tuple[float, StoredResponse]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._last_purge = time.monotonic()
+        self.hits = 0
+        self.persistent_hits = 0
+        self.misses = 0
+        self.purged = 0
+
+    @staticmethod
+    def request_hash(request: dict[str, Any]) -> str:
+        body = json.dumps(request, sort_keys=True, separators=(",", ":"), default=str)
+        return hashlib.sha256(body.encode("utf-8")).hexdigest()
+
+    def get(self, session: Session, tenant_id: str, key: str) -> StoredResponse | None:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get((tenant_id, key))
+            if entry and now < entry[0]:
+                self._entries.move_to_end((tenant_id, key))
+                self.hits += 1
+                return entry[1]
+            if entry:
+                del self._entries[(tenant_id, key)]
+
+        row = session.exec(
+            select(DispatchIdempotency).where(
+                DispatchIdempotency.tenant_id == tenant_id,
+                DispatchIdempotency.idempotency_key == key,
+                DispatchIdempotency.expires_at > datetime.utcnow(),
+            )
+        ).first()
+        if row is None:
+            self.misses += 1
+            return None
+        stored = (row.request_hash, json.loads(row.response_json))
+        self.persistent_hits += 1
+        self._remember(tenant_id, key, row.expires_at, stored)
+        return stored
+
+    def add(self, session: Session, tenant_id: str, key: str, request_hash: str, response: dict[str, Any]) -> None:
+        # Written in the caller's transaction so the stored response commits together with the side effects;
+        # a concurrent duplicate fails on the unique index instead of executing twice.
+        now = datetime.utcnow()
+        session.execute(
+            delete(DispatchIdempotency).where(
+                DispatchIdempotency.tenant_id == tenant_id,
+                DispatchIdempotency.idempotency_key == key,
+                DispatchIdempotency.expires_at <= now,
+            )
+        )
+        session.add(
+            DispatchIdempotency(
+                tenant_id=tenant_id,
+                idempotency_key=key,
+                request_hash=request_hash,
+                response_json=json.dumps(response),
+                created_at=now,
+                expires_at=now + timedelta(seconds=self.ttl_seconds),
+            )
+        )
+
+    def remember(self, tenant_id: str, key: str, request_hash: str, response: dict[str, Any]) -> None:
+        # Called after commit, so a losing concurrent duplicate never caches its rolled-back response.
+        expires_at = datetime.utcnow() + timedelta(seconds=self.ttl_seconds)
+        self._remember(tenant_id, key, expires_at, (request_hash, response))
+
+    def _remember(self, tenant_id: str, key: str, expires_at: datetime, stored: StoredResponse) -> None:
+        expires = time.time() + (expires_at - datetime.utcnow()).total_seconds()
+        with self._lock:
+            self._entries[(tenant_id, key)] = (expires, stored)
+            self._entries.move_to_end((tenant_id, key))
+            while len(self._entries) > self.max_cached:
+                self._entries.popitem(last=False)
+
+    def purge_expired(self, session: Session) -> int:
+        result = session.execute(delete(DispatchIdempotency).where(DispatchIdempotency.expires_at <= datetime.utcnow()))
+        session.commit()
+        self._last_purge = time.monotonic()
+        self.purged += result.rowcount
+        return result.rowcount
+
+    def purge_due(self) -> bool:
+        return time.monotonic() - self._last_purge >= self.purge_interval
+
+    def maybe_purge(self, session: Session) -> None:
+        if self.purge_due():
+            self.purge_expired(session)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict[str, int | float]:
+        with self._lock:
+            size = len(self._entries)
+        return {
+            "cached": size,
+            "max_cached": self.max_cached,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "persistent_hits": self.persistent_hits,
+            "misses": self.misses,
+            "purged": self.purged,
+        }
+
+
+idempotency_store = IdempotencyStore(
+    ttl_seconds=int(os.getenv("IDEMPOTENCY_TTL_SECONDS", str(24 * 3600))),
+    max_cached=int(os.getenv("IDEMPOTENCY_CACHE_SIZE", "10000")),
+    purge_interval=float(os.getenv("IDEMPOTENCY_PURGE_INTERVAL_SECONDS", "300")),
+)
@@ -1,17 +1,47 @@
 from __future__ import annotations
 
+import asyncio
+import base64
+import binascii
 import json
+import logging
 import os
-import urllib.error
-import urllib.request
-from datetime import datetime
+import re
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timedelta
 
+from sqlalchemy import column, delete, func, insert, or_, table, text, tuple_, update
+from sqlalchemy.exc import IntegrityError
 from sqlmodel import Session, select
+from sqlmodel.ext.asyncio.session import AsyncSession
 
+from . import db, workers
+from .ai_client import get_ai_client
+from .archive import audit_archive
+from .audit import audit_sink
+from .cache import classification_cache, manifest_cache
+from .events import change_feed
+from .idempotency import idempotency_store
+from .manifests import (
+    ENCODING_DELTA,
+    ENCODING_FULL,
+    ENCODING_JSON,
+    compress,
+    diff_manifest,
+    load_manifest,
+    manifest_hash,
+)
+from .metrics import ai_classify_duration, ai_parse_failures, classifications
+from .rules import rule_engines, validate_regex
+from .settings_cache import tenant_settings
 from .models import (
     Approval,
     AuditLog,
+    AutonomyMode,
+    CapabilityInsights,
     CapabilitySnapshot,
+    ClassificationRule,
     EmailNormalized,
     Job,
     JobStatus,
@@ -21,6 +51,156 @@ from .models import (
     Task,
 )
 
+logger = logging.getLogger(__name__)
+
+# Intents that remove data; tenant policy `no_delete_without_approval` puts them behind an approval in any mode.
+DESTRUCTIVE_INTENT = re.compile(r"delete|remove|slet|fjern|dangerous", re.IGNORECASE)
+
+CAPABILITY_KEYFRAME_INTERVAL = int(os.getenv("CAPABILITY_KEYFRAME_INTERVAL", "20"))
+
+audit_fts = table(db.AUDIT_FTS_TABLE, column("rowid"), column("rank"))
+
+
+def _encode_token(value) -> str:
+    raw = json.dumps(value).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def _decode_token(token: str):
+    raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+    return json.loads(raw)
+
+
+def encode_cursor(timestamp: datetime, row_id: int) -> str:
+    return _encode_token([timestamp.isoformat(), row_id])
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, int]:
+    try:
+        timestamp, row_id = _decode_token(cursor)
+        return datetime.fromisoformat(timestamp), int(row_id)
+    except (binascii.Error, ValueError, TypeError):
+        raise ValueError("invalid_cursor") from None
+
+
+def paginate(session: Session, query, order_column, id_column, limit: int, cursor: str | None = None):
+    if cursor:
+        timestamp, row_id = decode_cursor(cursor)
+        query = query.where(tuple_(order_column, id_column) < tuple_(timestamp, row_id))
+    rows = session.exec(query.order_by(order_column.desc(), id_column.desc()).limit(limit + 1)).all()
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = rows[-1]
+    return rows, encode_cursor(getattr(last, order_column.key), last.id)
+
+
+async def paginate_async(session: AsyncSession, query, order_column, id_column, limit: int, cursor: str | None = None):
+    return await session.run_sync(paginate, query, order_column, id_column, limit, cursor)
+
+
+def _fts_match_expression(query: str) -> str:
+    # Quote every term so user input never hits FTS5 query syntax; the trailing * keeps prefix matching.
+    terms = [term.replace('"', '""') for term in query.split()]
+    return " ".join(f'"{term}"*' for term in terms)
+
+
+def filter_audit(
+    query,
+    text_query: str | None = None,
+    tenant_id: str | None = None,
+    event_type: str | None = None,
+    entity_id: str | None = None,
+    since: datetime | None = None,
+    until: datetime | None = None,
+):
+    if text_query and text_query.strip():
+        if db.audit_fts_enabled:
+            matches = text(f"SELECT rowid FROM {db.AUDIT_FTS_TABLE} WHERE {db.AUDIT_FTS_TABLE} MATCH :match")
+            matches = matches.bindparams(match=_fts_match_expression(text_query)).columns(column("rowid"))
+            query = query.where(AuditLog.id.in_(matches))
+        else:
+            query = query.where(AuditLog.payload_json.contains(text_query))
+    if tenant_id:
+        query = query.where(AuditLog.tenant_id == tenant_id)
+    if event_type:
+        query = query.where(AuditLog.event_type == event_type)
+    if entity_id:
+        query = query.where(AuditLog.entity_id == entity_id)
+    if since:
+        query = query.where(AuditLog.created_at >= since)
+    if until:
+        query = query.where(AuditLog.created_at < until)
+    return query
+
+
+def list_audit(
+    session: Session,
+    limit: int,
+    cursor: str | None = None,
+    text_query: str | None = None,
+    tenant_id: str | None = None,
+    event_type: str | None = None,
+    entity_id: str | None = None,
+    since: datetime | None = None,
+    until: datetime | None = None,
+) -> tuple[list[AuditLog], str | None]:
+    query = filter_audit(select(AuditLog), text_query, tenant_id, event_type, entity_id, since, until)
+    rows, next_cursor = paginate(session, query, AuditLog.created_at, AuditLog.id, limit, cursor)
+    if since is None:
+        # Archived segments are only read for an explicit time range, so open-ended queries stay on the hot table.
+        return rows, next_cursor
+
+    archived = audit_archive.query(
+        limit + 1,
+        decode_cursor(cursor) if cursor else None,
+        text_query,
+        tenant_id,
+        event_type,
+        entity_id,
+        since,
+        until,
+    )
+    if not archived:
+        return rows, next_cursor
+    # Both sides are newest-first; a crash between archiving and deleting can leave an id in both.
+    merged = {row["id"]: AuditLog(**row) for row in archived}
+    merged.update({row.id: row for row in rows})
+    ordered = sorted(merged.values(), key=lambda row: (row.created_at, row.id), reverse=True)
+    if len(ordered) <= limit and next_cursor is None:
+        return ordered, None
+    page = ordered[:limit]
+    return page, encode_cursor(page[-1].created_at, page[-1].id)
+
+
+def search_audit(
+    session: Session,
+    text_query: str,
+    limit: int,
+    cursor: str | None = None,
+    **filters,
+) -> tuple[list[AuditLog], str | None]:
+    try:
+        offset = int(_decode_token(cursor)["offset"]) if cursor else 0
+    except (binascii.Error, ValueError, TypeError, KeyError):
+        raise ValueError("invalid_cursor") from None
+
+    if db.audit_fts_enabled:
+        query = (
+            select(AuditLog)
+            .join(audit_fts, audit_fts.c.rowid == AuditLog.id)
+            .where(text(f"{db.AUDIT_FTS_TABLE} MATCH :match").bindparams(match=_fts_match_expression(text_query)))
+            .order_by(audit_fts.c.rank, AuditLog.id.desc())
+        )
+        query = filter_audit(query, **filters)
+    else:
+        query = filter_audit(select(AuditLog), text_query, **filters)
+        query = query.order_by(AuditLog.created_at.desc(), AuditLog.id.desc())
+
+    rows = session.exec(query.offset(offset).limit(limit + 1)).all()
+    if len(rows) <= limit:
+        return rows, None
+    return rows[:limit], _encode_token({"offset": offset + limit})
 
 
 def get_ai_integration_status() -> dict[str, str | bool]:
@@ -48,51 +228,55 @@ def _parse_json_object(raw: str) -> dict | None:
         return None
 
 
-def classify_email_with_ai(subject: str, body: str) -> tuple[str, str, float, RiskLevel] | None:
+def _parse_json_array(raw: str) -> list | None:
+    value = raw.strip()
+    if value.startswith("```"):
+        value = value.strip("`")
+        if value.startswith("json"):
+            value = value[4:].strip()
+    start = value.find("[")
+    end = value.rfind("]")
+    if start == -1 or end == -1 or end <= start:
+        parsed = _parse_json_object(value)
+        results = parsed.get("results") if parsed else None
+        return results if isinstance(results, list) else None
+    try:
+        parsed = json.loads(value[start:end + 1])
+    except json.JSONDecodeError:
+        return None
+    return parsed if isinstance(parsed, list) else None
+
+
+def _chat_completion(system_prompt: str, user_content: str) -> str | None:
     status = get_ai_integration_status()
     api_key = os.getenv("AI_API_KEY")
     if not api_key:
         return None
 
-    prompt = (
-        "You classify support emails into an automation intent. "
-        "Return strict JSON with keys: intent (string), why (string), confidence (0..1 number), "
-        "risk (one of low, medium, high)."
-    )
     payload = {
         "model": status["model"],
         "messages": [
-            {"role": "system", "content": prompt},
-            {"role": "user", "content": f"Subject: {subject}\nBody: {body}"},
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_content},
         ],
         "temperature": 0.1,
     }
 
-    req = urllib.request.Request(
-        f"{status['base_url'].rstrip('/')}/chat/completions",
-        data=json.dumps(payload).encode("utf-8"),
-        headers={
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {api_key}",
-        },
-        method="POST",
+    raw = get_ai_client(status["base_url"].rstrip("/")).post_json(
+        "/chat/completions",
+        payload,
+        headers={"Authorization": f"Bearer {api_key}"},
     )
-
-    try:
-        with urllib.request.urlopen(req, timeout=10) as response:
-            raw = json.loads(response.read().decode("utf-8"))
-    except (urllib.error.URLError, TimeoutError, json.JSONDecodeError):
+    if raw is None:
         return None
 
     try:
-        content = raw["choices"][0]["message"]["content"]
+        return raw["choices"][0]["message"]["content"]
     except (KeyError, IndexError, TypeError):
         return None
 
-    parsed = _parse_json_object(content)
-    if not parsed:
-        return None
 
+def _classification_from_dict(parsed: dict) -> tuple[str, str, float, RiskLevel]:
     risk_raw = str(parsed.get("risk", "low")).lower()
     risk = RiskLevel.low
     if risk_raw == "medium":
@@ -113,86 +297,433 @@ def classify_email_with_ai(subject: str, body: str) -> tuple[str, str, float, Ri
     )
 
 
-def classify_email(subject: str, body: str) -> tuple[str, str, float, RiskLevel]:
-    ai_result = classify_email_with_ai(subject, body)
-    if ai_result is not None:
-        return ai_result
+def classify_email_with_ai(subject: str, body: str) -> tuple[str, str, float, RiskLevel] | None:
+    prompt = (
+        "You classify support emails into an automation intent. "
+        "Return strict JSON with keys: intent (string), why (string), confidence (0..1 number), "
+        "risk (one of low, medium, high)."
+    )
+    started = time.perf_counter()
+    content = _chat_completion(prompt, f"Subject: {subject}\nBody: {body}")
+    parsed = _parse_json_object(content) if content is not None else None
+    outcome = "no_response" if content is None else "ok" if parsed else "parse_failure"
+    ai_classify_duration.observe(time.perf_counter() - started, mode="single", outcome=outcome)
+    if not parsed:
+        if content is not None:
+            ai_parse_failures.inc(mode="single")
+        return None
+    return _classification_from_dict(parsed)
+
+
+def _classify_email_chunk_with_ai(emails: list[tuple[str, str]]) -> list[tuple[str, str, float, RiskLevel] | None]:
+    prompt = (
+        "You classify support emails into an automation intent. Each email is numbered. "
+        "Return a strict JSON array with one object per email, each with keys: index (the email number), "
+        "intent (string), why (string), confidence (0..1 number), risk (one of low, medium, high)."
+    )
+    user_content = "\n\n".join(
+        f"Email {index}\nSubject: {subject}\nBody: {body}" for index, (subject, body) in enumerate(emails)
+    )
+    results: list[tuple[str, str, float, RiskLevel] | None] = [None] * len(emails)
+    started = time.perf_counter()
+    content = _chat_completion(prompt, user_content)
+    parsed = _parse_json_array(content) if content is not None else None
+    outcome = "no_response" if content is None else "ok" if parsed else "parse_failure"
+    ai_classify_duration.observe(time.perf_counter() - started, mode="batch", outcome=outcome)
+    if not parsed:
+        if content is not None:
+            ai_parse_failures.inc(mode="batch")
+        return results
+
+    for position, item in enumerate(parsed):
+        if not isinstance(item, dict):
+            continue
+        try:
+            index = int(item.get("index", position))
+        except (TypeError, ValueError):
+            continue
+        if 0 <= index < len(emails) and results[index] is None:
+            results[index] = _classification_from_dict(item)
+    missing = results.count(None)
+    if missing:
+        # Items the provider dropped or mangled inside an otherwise valid array.
+        ai_parse_failures.inc(missing, mode="batch_item")
+    return results
+
+
+def classify_emails_with_ai(emails: list[tuple[str, str]]) -> list[tuple[str, str, float, RiskLevel] | None]:
+    if not emails or not os.getenv("AI_API_KEY"):
+        return [None] * len(emails)
+
+    batch_size = max(1, int(os.getenv("AI_BATCH_SIZE", "20")))
+    chunks = [emails[start:start + batch_size] for start in range(0, len(emails), batch_size)]
+    if len(chunks) == 1:
+        return _classify_email_chunk_with_ai(chunks[0])
+
+    concurrency = max(1, int(os.getenv("AI_BATCH_CONCURRENCY", "4")))
+    with ThreadPoolExecutor(max_workers=min(concurrency, len(chunks))) as executor:
+        return [result for chunk in executor.map(_classify_email_chunk_with_ai, chunks) for result in chunk]
+
+
+def classify_email(subject: str, body: str, tenant_id: str | None = None) -> tuple[str, str, float, RiskLevel]:
+    return rule_engines.get(tenant_id).classify(subject, body)
+
+
+def classify_emails(
+    emails: list[tuple[str, str]], tenant_id: str | None = None
+) -> list[tuple[str, str, float, RiskLevel]]:
+    return rule_engines.get(tenant_id).classify_many(emails)
+
+
+def add_classification_rules(session: Session, rules: list[dict]) -> list[ClassificationRule]:
+    stored = []
+    for rule in rules:
+        for pattern in rule["patterns"]:
+            if rule["kind"] == "regex":
+                validate_regex(pattern)
+            elif not pattern.strip():
+                raise ValueError("invalid_pattern: empty keyword")
+            stored.append(
+                ClassificationRule(
+                    tenant_id=rule["tenant_id"],
+                    kind=rule["kind"],
+                    pattern=pattern if rule["kind"] == "regex" else pattern.lower(),
+                    intent=rule["intent"],
+                    why=rule["why"],
+                    confidence=rule["confidence"],
+                    risk=rule["risk"],
+                    priority=rule["priority"],
+                )
+            )
+    session.add_all(stored)
+    session.commit()
+    for rule in stored:
+        session.refresh(rule)
+    for tenant_id in {rule.tenant_id for rule in stored}:
+        rule_engines.invalidate(tenant_id)
+    return stored
+
+
+def triage_email(subject: str, body: str, tenant_id: str | None = None) -> tuple[str, str, float, RiskLevel]:
+    status = get_ai_integration_status()
+    if status["api_key_configured"]:
+        key = classification_cache.key(subject, body, status["model"])
+        cached = classification_cache.get(key)
+        if cached is not None:
+            classifications.inc(source="cache")
+            return cached
+        ai_result = classify_email_with_ai(subject, body)
+        if ai_result is not None:
+            classification_cache.put(key, status["model"], ai_result)
+            classifications.inc(source="ai")
+            return ai_result
+        classifications.inc(source="rules_fallback")
+    else:
+        classifications.inc(source="rules")
+    return classify_email(subject, body, tenant_id)
+
+
+def triage_emails(
+    emails: list[tuple[str, str]], tenant_ids: list[str | None] | None = None
+) -> list[tuple[str, str, float, RiskLevel]]:
+    results: list[tuple[str, str, float, RiskLevel] | None] = [None] * len(emails)
+    status = get_ai_integration_status()
+    if status["api_key_configured"]:
+        keys = [classification_cache.key(subject, body, status["model"]) for subject, body in emails]
+        misses = []
+        for index, key in enumerate(keys):
+            results[index] = classification_cache.get(key)
+            if results[index] is None:
+                misses.append(index)
+        ai_results = classify_emails_with_ai([emails[index] for index in misses])
+        for index, ai_result in zip(misses, ai_results):
+            if ai_result is not None:
+                classification_cache.put(keys[index], status["model"], ai_result)
+                results[index] = ai_result
+        answered = sum(1 for result in ai_results if result is not None)
+        classifications.inc(len(emails) - len(misses), source="cache")
+        classifications.inc(answered, source="ai")
+        classifications.inc(len(misses) - answered, source="rules_fallback")
+    else:
+        classifications.inc(len(emails), source="rules")
+
+    tenant_ids = tenant_ids or [None] * len(emails)
+    pending: dict[str | None, list[int]] = {}
+    for index, result in enumerate(results):
+        if result is None:
+            pending.setdefault(tenant_ids[index], []).append(index)
+    for tenant_id, indexes in pending.items():
+        for index, result in zip(indexes, classify_emails([emails[index] for index in indexes], tenant_id)):
+            results[index] = result
+    return results
+
+
+def _insert_emails(session: Session, emails: list[dict], returning) -> list:
+    now = datetime.utcnow()
+    rows = [{**email, "status": "new", "created_at": now} for email in emails]
+    inserted = session.scalars(insert(EmailNormalized).returning(returning, sort_by_parameter_order=True), rows).all()
+    audit_sink.record_many(
+        session,
+        [
+            {
+                "tenant_id": email["tenant_id"],
+                "event_type": "email_ingested",
+                "entity_id": None,
+                "payload_json": json.dumps(email),
+            }
+            for email in emails
+        ],
+    )
+    return list(inserted)
+
+
+def ingest_emails(session: Session, emails: list[dict], commit: bool = True) -> list[int]:
+    if not emails:
+        return []
+
+    ids = _insert_emails(session, emails, EmailNormalized.id)
+    if commit:
+        session.commit()
+    return ids
 
-def classify_email(subject: str, body: str) -> tuple[str, str, float, RiskLevel]:
-    text = f"{subject} {body}".lower()
-    if "opret kunde" in text or "new customer" in text:
-        return "create customer", "Detected customer onboarding keywords", 0.93, RiskLevel.low
-    if "invoice" in text or "faktura" in text:
-        return "invoice follow-up", "Detected invoicing workflow", 0.88, RiskLevel.medium
-    if "delete" in text or "slet" in text:
-        return "dangerous change", "Detected destructive intent", 0.81, RiskLevel.high
-    return "needs triage", "No strong intent; route to inbox", 0.55, RiskLevel.low
+
+def _task_change(task: Task) -> dict:
+    return {
+        "tenant_id": task.tenant_id,
+        "entity_type": "task",
+        "entity_id": task.id,
+        "status": task.status,
+        "email_id": task.email_id,
+        "intent": task.intent,
+        "risk": task.risk,
+    }
+
+
+def _apply_classification(
+    session: Session,
+    task: Task,
+    email: EmailNormalized,
+    classification: tuple[str, str, float, RiskLevel],
+) -> None:
+    intent, why, confidence, risk = classification
+    task.intent = intent
+    task.why = why
+    task.confidence = confidence
+    task.risk = risk
+    task.status = "proposed"
+    task.missing_fields = None if confidence >= 0.7 else "customer_reference"
+    session.add(task)
+    audit_sink.record(
+        session,
+        email.tenant_id,
+        "task_suggested",
+        str(email.id),
+        {"intent": intent, "confidence": confidence},
+    )
 
 
-def create_task_from_email(session: Session, email_id: int) -> Task:
+def create_task_from_email(
+    session: Session,
+    email_id: int,
+    defer_classification: bool = False,
+    classification: tuple[str, str, float, RiskLevel] | None = None,
+) -> Task:
     email = session.get(EmailNormalized, email_id)
     if not email:
         raise ValueError("email_not_found")
 
-    intent, why, confidence, risk = classify_email(email.subject, email.body)
-    missing_fields = None if confidence >= 0.7 else "customer_reference"
-
-    task = Task(
-        email_id=email.id,
-        tenant_id=email.tenant_id,
-        intent=intent,
-        confidence=confidence,
-        risk=risk,
-        status="proposed",
-        why=why,
-        missing_fields=missing_fields,
-    )
-    session.add(task)
+    task = Task(email_id=email.id, tenant_id=email.tenant_id, intent="pending", confidence=0.0, why="")
     email.status = "triaged"
-    session.add(
-        AuditLog(
-            tenant_id=email.tenant_id,
-            event_type="task_suggested",
-            entity_id=str(email.id),
-            payload_json=json.dumps({"intent": intent, "confidence": confidence}),
-        )
-    )
+    session.add(email)
+
+    # Only the AI round-trip is worth queueing; the rule-based classifier runs inline.
+    if defer_classification and get_ai_integration_status()["api_key_configured"]:
+        task.status = "classifying"
+        task.why = "Classification queued"
+        session.add(task)
+        session.flush()
+        change_feed.publish_many(session, [_task_change(task)])
+        session.commit()
+        session.refresh(task)
+        if schedule_task_classification(task.id):
+            return task
+        # Queue is full: classify inline with the rule engine rather than blocking on the LLM.
+        fallback = classification or classify_email(email.subject, email.body, email.tenant_id)
+        _apply_classification(session, task, email, fallback)
+    else:
+        if classification is None:
+            classification = triage_email(email.subject, email.body, email.tenant_id)
+        _apply_classification(session, task, email, classification)
+
+    session.flush()
+    change_feed.publish_many(session, [_task_change(task)])
     session.commit()
     session.refresh(task)
     return task
 
 
+async def create_task_from_email_async(
+    session: AsyncSession, email_id: int, defer_classification: bool = False
+) -> Task:
+    # The DB work runs on the async driver; classification (LLM round-trip, rule loading) is blocking and
+    # runs in a thread first so the event loop stays free. A deferred task gets the rule-based result up front,
+    # for the case that the classification queue is full.
+    email = await session.get(EmailNormalized, email_id)
+    if not email:
+        raise ValueError("email_not_found")
+    if defer_classification and get_ai_integration_status()["api_key_configured"]:
+        classification = await asyncio.to_thread(classify_email, email.subject, email.body, email.tenant_id)
+    else:
+        classification = await asyncio.to_thread(triage_email, email.subject, email.body, email.tenant_id)
+    return await session.run_sync(create_task_from_email, email_id, defer_classification, classification)
+
+
+def create_tasks_from_emails(session: Session, email_ids: list[int]) -> list[Task]:
+    # Flushes but does not commit, so callers can serialize the rows and commit once.
+    emails = session.exec(select(EmailNormalized).where(EmailNormalized.id.in_(email_ids))).all()
+    by_id = {email.id: email for email in emails}
+    if any(email_id not in by_id for email_id in email_ids):
+        raise ValueError("email_not_found")
+
+    return _create_tasks(session, [by_id[email_id] for email_id in email_ids])
+
+
+def _create_tasks(
+    session: Session,
+    ordered: list[EmailNormalized],
+    classified: list[tuple[str, str, float, RiskLevel]] | None = None,
+) -> list[Task]:
+    if not ordered:
+        return []
+    if classified is None:
+        classified = triage_emails(
+            [(email.subject, email.body) for email in ordered],
+            [email.tenant_id for email in ordered],
+        )
+    tasks = []
+    for email, classification in zip(ordered, classified):
+        task = Task(email_id=email.id, tenant_id=email.tenant_id, intent="pending", confidence=0.0, why="")
+        email.status = "triaged"
+        session.add(email)
+        _apply_classification(session, task, email, classification)
+        tasks.append(task)
+    session.flush()
+    change_feed.publish_many(session, [_task_change(task) for task in tasks])
+    return tasks
+
+
+def complete_task_classification(task_id: int, rules_only: bool = False) -> None:
+    classify = classify_email if rules_only else triage_email
+    with Session(db.engine) as session:
+        task = session.get(Task, task_id)
+        if not task or task.status != "classifying":
+            return
+        email = session.get(EmailNormalized, task.email_id)
+        _apply_classification(session, task, email, classify(email.subject, email.body, email.tenant_id))
+        change_feed.publish_many(session, [_task_change(task)])
+        session.commit()
+
+
+def schedule_task_classification(task_id: int) -> bool:
+    future = workers.classification_pool.try_submit(complete_task_classification, task_id)
+    if future is None:
+        return False
+    future.add_done_callback(lambda done: _classification_done(task_id, done))
+    return True
+
+
+def _classification_done(task_id: int, future: Future) -> None:
+    if future.cancelled() or future.exception() is None:
+        return
+    logger.error("deferred classification of task %s failed", task_id, exc_info=future.exception())
+    # Without this the task would stay "classifying" forever; the rule engine needs neither the LLM nor the cache.
+    try:
+        complete_task_classification(task_id, rules_only=True)
+    except Exception:
+        logger.exception("rule fallback for task %s failed", task_id)
+
+
+def requeue_pending_classifications() -> int:
+    # Tasks still "classifying" lost their queued job with the previous process; hand them to the pool again,
+    # or classify them with rules when it is full. Completing a task twice is a no-op.
+    with Session(db.engine) as session:
+        task_ids = session.exec(select(Task.id).where(Task.status == "classifying").order_by(Task.id)).all()
+    for task_id in task_ids:
+        if not schedule_task_classification(task_id):
+            complete_task_classification(task_id, rules_only=True)
+    return len(task_ids)
+
+
+def _step_values(task: Task, require_approval: bool = False) -> dict:
+    return {
+        "index": 1,
+        "action_id": f"tasks.{task.intent.replace(' ', '_')}",
+        "backend": "dispatch",
+        "input_json": json.dumps({"task_id": task.id, "intent": task.intent}),
+        "requires_approval": require_approval or task.risk in {RiskLevel.medium, RiskLevel.high},
+    }
+
+
+def _policy_gates(session: Session, tasks: list[Task]) -> list[bool]:
+    # Per task, whether the tenant policy forces an approval: destructive intents when no_delete_without_approval
+    # is set, and every job past max_bulk_updates planned for one tenant in a single call.
+    policies = {tenant_id: tenant_settings.get(session, tenant_id).policy for tenant_id in {t.tenant_id for t in tasks}}
+    planned: dict[str, int] = {}
+    gates = []
+    for task in tasks:
+        policy = policies[task.tenant_id]
+        planned[task.tenant_id] = planned.get(task.tenant_id, 0) + 1
+        destructive = policy.no_delete_without_approval and DESTRUCTIVE_INTENT.search(task.intent) is not None
+        gates.append(destructive or planned[task.tenant_id] > policy.max_bulk_updates)
+    return gates
+
+
+def _job_change(job: Job) -> dict:
+    return {
+        "tenant_id": job.tenant_id,
+        "entity_type": "job",
+        "entity_id": job.id,
+        "status": job.status,
+        "task_id": job.task_id,
+    }
+
+
+def _child_change(entity_type: str, job: Job, entity_id: int, status: str | None) -> dict:
+    return {
+        "tenant_id": job.tenant_id,
+        "entity_type": entity_type,
+        "entity_id": entity_id,
+        "status": status,
+        "job_id": job.id,
+    }
+
+
 def plan_job(session: Session, task: Task) -> Job:
     job = Job(task_id=task.id, tenant_id=task.tenant_id, status=JobStatus.planned)
     session.add(job)
-    session.commit()
-    session.refresh(job)
+    session.flush()
 
-    step = JobStep(
-        job_id=job.id,
-        index=1,
-        action_id=f"tasks.{task.intent.replace(' ', '_')}",
-        backend="dispatch",
-        input_json=json.dumps({"task_id": task.id, "intent": task.intent}),
-        requires_approval=task.risk in {RiskLevel.medium, RiskLevel.high},
-    )
+    step = JobStep(job_id=job.id, **_step_values(task, _policy_gates(session, [task])[0]))
     session.add(step)
-    session.commit()
-    session.refresh(step)
+    session.flush()
 
+    changes = [_child_change("step", job, step.id, step.status)]
     if step.requires_approval:
         job.status = JobStatus.requires_approval
-        session.add(Approval(job_step_id=step.id))
+        approval = Approval(job_step_id=step.id)
+        session.add(approval)
+        session.flush()
+        changes.append(_child_change("approval", job, approval.id, None))
     else:
         job.status = JobStatus.executing
+    change_feed.publish_many(session, [_job_change(job), *changes])
 
-    session.add(
-        AuditLog(
-            tenant_id=task.tenant_id,
-            event_type="job_planned",
-            entity_id=str(job.id),
-            payload_json=json.dumps({"task_id": task.id, "risk": task.risk.value}),
-        )
+    audit_sink.record(
+        session,
+        task.tenant_id,
+        "job_planned",
+        str(job.id),
+        {"task_id": task.id, "risk": task.risk.value},
     )
     job.updated_at = datetime.utcnow()
     session.commit()
@@ -200,8 +731,430 @@ def plan_job(session: Session, task: Task) -> Job:
     return job
 
 
+def plan_jobs(session: Session, tasks: list[Task], require_approval: bool = False) -> list[Job]:
+    # Flushes but does not commit, so callers can serialize the rows and commit once.
+    if not tasks:
+        return []
+
+    now = datetime.utcnow()
+    gates = _policy_gates(session, tasks)
+    steps = [_step_values(task, require_approval or gated) for task, gated in zip(tasks, gates)]
+    jobs = session.scalars(
+        insert(Job).returning(Job, sort_by_parameter_order=True),
+        [
+            {
+                "task_id": task.id,
+                "tenant_id": task.tenant_id,
+                "status": JobStatus.requires_approval if step["requires_approval"] else JobStatus.executing,
+                "source": "email",
+                "started_at": now,
+                "updated_at": now,
+            }
+            for task, step in zip(tasks, steps)
+        ],
+    ).all()
+    step_ids = session.scalars(
+        insert(JobStep).returning(JobStep.id, sort_by_parameter_order=True),
+        [{**step, "job_id": job.id, "status": "pending", "created_at": now} for job, step in zip(jobs, steps)],
+    ).all()
+
+    approvals = [
+        {"job_step_id": step_id, "created_at": now}
+        for step_id, step in zip(step_ids, steps)
+        if step["requires_approval"]
+    ]
+    approval_ids = []
+    if approvals:
+        approval_ids = session.scalars(
+            insert(Approval).returning(Approval.id, sort_by_parameter_order=True), approvals
+        ).all()
+    job_by_step = {step_id: job for step_id, job in zip(step_ids, jobs)}
+    change_feed.publish_many(
+        session,
+        [_job_change(job) for job in jobs]
+        + [_child_change("step", job, step_id, "pending") for step_id, job in job_by_step.items()]
+        + [
+            _child_change("approval", job_by_step[approval["job_step_id"]], approval_id, None)
+            for approval_id, approval in zip(approval_ids, approvals)
+        ],
+    )
+    audit_sink.record_many(
+        session,
+        [
+            {
+                "tenant_id": task.tenant_id,
+                "event_type": "job_planned",
+                "entity_id": str(job.id),
+                "payload_json": json.dumps({"task_id": task.id, "risk": task.risk.value}),
+            }
+            for task, job in zip(tasks, jobs)
+        ],
+    )
+    return list(jobs)
+
+
+def decide_approval(session: Session, approval: Approval, decision: str, comment: str | None, decided_by: str) -> Job:
+    approval.decision = decision
+    approval.comment = comment
+    approval.decided_by = decided_by
+    session.add(approval)
+    step = session.get(JobStep, approval.job_step_id)
+    job = session.get(Job, step.job_id)
+    if decision == "rejected":
+        step.status = "rejected"
+        session.add(step)
+        if job.status == JobStatus.requires_approval:
+            job.status = JobStatus.aborted
+    elif job.status == JobStatus.requires_approval:
+        session.flush()
+        undecided = session.exec(
+            select(func.count())
+            .select_from(Approval)
+            .join(JobStep, JobStep.id == Approval.job_step_id)
+            .where(JobStep.job_id == job.id, or_(Approval.decision.is_(None), Approval.decision != "approved"))
+        ).one()
+        if undecided == 0:
+            # Every gate is approved; the execution engine can now claim the job's steps.
+            job.status = JobStatus.executing
+    job.updated_at = datetime.utcnow()
+    session.add(job)
+    audit_sink.record(session, job.tenant_id, f"approval_{decision}", str(approval.id), {"job_id": job.id})
+    changes = [_child_change("approval", job, approval.id, decision), _job_change(job)]
+    if decision == "rejected":
+        changes.append(_child_change("step", job, step.id, step.status))
+    change_feed.publish_many(session, changes)
+    session.commit()
+    session.refresh(job)
+    return job
+
+
+def abort_job(session: Session, job: Job) -> Job:
+    job.status = JobStatus.aborted
+    job.updated_at = datetime.utcnow()
+    session.add(job)
+    change_feed.publish_many(session, [_job_change(job)])
+    session.commit()
+    session.refresh(job)
+    return job
+
+
+def requeue_job(session: Session, job: Job) -> Job:
+    # Retry only re-runs failed steps; it never reopens an approval gate or revives a rejected or finished job.
+    if job.status == JobStatus.requires_approval:
+        raise ValueError("job_requires_approval")
+    statuses = set(session.exec(select(JobStep.status).where(JobStep.job_id == job.id)).all())
+    if "rejected" in statuses:
+        raise ValueError("job_rejected")
+    if "failed" not in statuses:
+        raise ValueError("job_has_no_failed_steps")
+    step_ids = session.scalars(
+        update(JobStep)
+        .where(JobStep.job_id == job.id, JobStep.status == "failed")
+        .values(status="pending", attempts=0, finished_at=None)
+        .returning(JobStep.id)
+    ).all()
+    job.status = JobStatus.executing
+    job.updated_at = datetime.utcnow()
+    session.add(job)
+    change_feed.publish_many(
+        session,
+        [_job_change(job)] + [_child_change("step", job, step_id, "pending") for step_id in step_ids],
+    )
+    session.commit()
+    session.refresh(job)
+    return job
+
+
+def run_pipeline(session: Session, emails: list[dict]) -> list[dict]:
+    # Ingest -> triage -> plan in one transaction, gated per tenant: the kill switch stops after ingest,
+    # OFF stops after triage, SUPERVISED plans every step behind an approval, AUTONOMOUS plans by risk.
+    tenant_ids = {email["tenant_id"] for email in emails}
+    settings = {tenant_id: tenant_settings.get(session, tenant_id) for tenant_id in tenant_ids}
+    # Classify before the insert opens the write transaction: LLM round-trips and the persistent classification
+    # cache (its own session) must not run while this session holds the SQLite write lock.
+    live = [index for index, email in enumerate(emails) if not settings[email["tenant_id"]].kill_switch]
+    classified = triage_emails(
+        [(emails[index]["subject"], emails[index]["body"]) for index in live],
+        [emails[index]["tenant_id"] for index in live],
+    )
+
+    inserted: list[EmailNormalized] = _insert_emails(session, emails, EmailNormalized)
+    tasks = _create_tasks(session, [inserted[index] for index in live], classified)
+    by_mode: dict[AutonomyMode, list[Task]] = {}
+    for task in tasks:
+        by_mode.setdefault(settings[task.tenant_id].autonomy_mode, []).append(task)
+    jobs = plan_jobs(session, by_mode.get(AutonomyMode.supervised, []), require_approval=True)
+    jobs += plan_jobs(session, by_mode.get(AutonomyMode.autonomous, []))
+
+    task_by_email = {task.email_id: task for task in tasks}
+    job_by_task = {job.task_id: job for job in jobs}
+    results = []
+    for email in inserted:
+        tenant = settings[email.tenant_id]
+        task = task_by_email.get(email.id)
+        job = job_by_task.get(task.id) if task else None
+        results.append(
+            {
+                "email_id": email.id,
+                "tenant_id": email.tenant_id,
+                "stage": "planned" if job else "triaged" if task else "ingested",
+                "autonomy_mode": tenant.autonomy_mode,
+                "kill_switch": tenant.kill_switch,
+                "task_id": task.id if task else None,
+                "intent": task.intent if task else None,
+                "risk": task.risk if task else None,
+                "job_id": job.id if job else None,
+                "job_status": job.status if job else None,
+            }
+        )
+    session.commit()
+    return results
+
+
 def latest_manifest(session: Session) -> CapabilitySnapshot | None:
-    return session.exec(select(CapabilitySnapshot).order_by(CapabilitySnapshot.created_at.desc())).first()
+    return session.exec(
+        select(CapabilitySnapshot).order_by(CapabilitySnapshot.created_at.desc(), CapabilitySnapshot.id.desc())
+    ).first()
+
+
+def _manifest_counts(manifest: dict) -> tuple[int, int]:
+    pages = manifest.get("pages", [])
+    return len(pages), sum(len(page.get("actions", [])) for page in pages)
+
+
+def _capability_insights_row(session: Session) -> CapabilityInsights:
+    insights = session.get(CapabilityInsights, 1)
+    if insights:
+        return insights
+
+    # One-time backfill for databases created before the counters existed.
+    insights = CapabilityInsights(id=1)
+    insights.total_snapshots = session.exec(select(func.count()).select_from(CapabilitySnapshot)).one()
+    latest = latest_manifest(session)
+    if latest:
+        insights.latest_snapshot_id = latest.id
+        insights.latest_version = latest.version
+        insights.learned_pages, insights.learned_actions = _manifest_counts(load_manifest(session, latest))
+    session.add(insights)
+    session.flush()
+    return insights
+
+
+def _encode_snapshot(
+    snapshot: CapabilitySnapshot,
+    manifest: dict,
+    base: CapabilitySnapshot | None,
+    base_manifest: dict | None,
+) -> None:
+    # Store a delta against the previous snapshot, with a full keyframe every KEYFRAME_INTERVAL snapshots
+    # so reconstruction never replays a long chain.
+    snapshot.manifest_json = ""
+    if base is not None and base.chain_length + 1 < CAPABILITY_KEYFRAME_INTERVAL:
+        snapshot.encoding = ENCODING_DELTA
+        snapshot.base_id = base.id
+        snapshot.chain_length = base.chain_length + 1
+        snapshot.manifest_blob = compress(diff_manifest(base_manifest, manifest))
+    else:
+        snapshot.encoding = ENCODING_FULL
+        snapshot.base_id = None
+        snapshot.chain_length = 0
+        snapshot.manifest_blob = compress(manifest)
+
+
+def record_capability_snapshot(session: Session, manifest: dict) -> tuple[CapabilitySnapshot, bool]:
+    content_hash = manifest_hash(manifest)
+    latest = latest_manifest(session)
+    latest_content = load_manifest(session, latest) if latest else None
+    if latest and (latest.content_hash or manifest_hash(latest_content)) == content_hash:
+        return latest, False
+
+    # Versions are second-resolution scan timestamps; keep them unique so /capabilities/diff can address them.
+    version = manifest["version"]
+    suffix = 1
+    while session.exec(select(CapabilitySnapshot.id).where(CapabilitySnapshot.version == version)).first():
+        suffix += 1
+        version = f"{manifest['version']}-{suffix}"
+    manifest = {**manifest, "version": version}
+
+    page_count, action_count = _manifest_counts(manifest)
+    insights = _capability_insights_row(session)
+    snapshot = CapabilitySnapshot(
+        version=version,
+        content_hash=content_hash,
+        page_count=page_count,
+        action_count=action_count,
+    )
+    _encode_snapshot(snapshot, manifest, latest, latest_content)
+    session.add(snapshot)
+    session.flush()
+
+    # Increment in SQL so concurrent rescans on other workers are not lost.
+    session.execute(
+        update(CapabilityInsights)
+        .where(CapabilityInsights.id == insights.id)
+        .values(
+            total_snapshots=CapabilityInsights.total_snapshots + 1,
+            latest_snapshot_id=snapshot.id,
+            latest_version=snapshot.version,
+            learned_pages=page_count,
+            learned_actions=action_count,
+            updated_at=datetime.utcnow(),
+        )
+    )
+    session.commit()
+    session.refresh(snapshot)
+    return snapshot, True
+
+
+def _snapshot_by_version(session: Session, version: str) -> CapabilitySnapshot:
+    snapshot = session.exec(
+        select(CapabilitySnapshot).where(CapabilitySnapshot.version == version).order_by(CapabilitySnapshot.id.desc())
+    ).first()
+    if not snapshot:
+        raise ValueError("snapshot_not_found")
+    return snapshot
+
+
+def capability_diff(session: Session, from_version: str, to_version: str) -> dict:
+    old = load_manifest(session, _snapshot_by_version(session, from_version))
+    new = load_manifest(session, _snapshot_by_version(session, to_version))
+    delta = diff_manifest(old, new)
+    return {"from": from_version, "to": to_version, "changed": delta is not None, "diff": delta}
+
+
+def compact_capability_snapshots(session: Session, keep_latest: int, max_age_days: int) -> dict:
+    ids = session.exec(
+        select(CapabilitySnapshot.id).order_by(CapabilitySnapshot.created_at, CapabilitySnapshot.id)
+    ).all()
+    cutoff = datetime.utcnow() - timedelta(days=max_age_days)
+    protected = set(ids[-keep_latest:]) if keep_latest > 0 else set()
+
+    base: CapabilitySnapshot | None = None
+    base_manifest: dict | None = None
+    base_hash: str | None = None
+    doomed: list[int] = []
+    rewritten = 0
+    for position, snapshot_id in enumerate(ids):
+        snapshot = session.get(CapabilitySnapshot, snapshot_id)
+        manifest = load_manifest(session, snapshot)
+        content_hash = manifest_hash(manifest)
+        is_latest = position == len(ids) - 1
+        expired = snapshot_id not in protected and snapshot.created_at < cutoff
+        duplicate = base_hash == content_hash
+        if not is_latest and (expired or duplicate):
+            # Deleted only after every survivor has been re-encoded against surviving bases.
+            doomed.append(snapshot_id)
+            continue
+
+        needs_rewrite = (
+            snapshot.encoding == ENCODING_JSON
+            or snapshot.content_hash != content_hash
+            or (
+                snapshot.encoding == ENCODING_DELTA
+                and (base is None or snapshot.base_id != base.id or snapshot.chain_length != base.chain_length + 1)
+            )
+        )
+        if needs_rewrite:
+            snapshot.content_hash = content_hash
+            _encode_snapshot(snapshot, manifest, base, base_manifest)
+            session.add(snapshot)
+            session.flush()
+            rewritten += 1
+        if base is not None:
+            session.expunge(base)
+        base, base_manifest, base_hash = snapshot, manifest, content_hash
+
+    if doomed:
+        session.execute(delete(CapabilitySnapshot).where(CapabilitySnapshot.id.in_(doomed)))
+    total = session.exec(select(func.count()).select_from(CapabilitySnapshot)).one()
+    session.execute(update(CapabilityInsights).where(CapabilityInsights.id == 1).values(total_snapshots=total))
+    session.commit()
+    return {"deleted": len(doomed), "rewritten": rewritten, "remaining": total}
+
+
+def capability_insights(session: Session) -> dict:
+    insights = _capability_insights_row(session)
+    recent_versions = session.exec(
+        select(CapabilitySnapshot.version)
+        .order_by(CapabilitySnapshot.created_at.desc(), CapabilitySnapshot.id.desc())
+        .limit(5)
+    ).all()
+    session.commit()
+    return {
+        "latest_version": insights.latest_version,
+        "total_snapshots": insights.total_snapshots,
+        "learned_pages": insights.learned_pages,
+        "learned_actions": insights.learned_actions,
+        "recent_versions": list(recent_versions),
+    }
+
+
+def dispatch_action(session: Session, request: dict, purge: bool = True) -> tuple[dict, bool]:
+    tenant_id = request.get("tenant_id")
+    tenant_key = tenant_id or "shared"
+    key = request["idempotency_key"]
+    request_hash = idempotency_store.request_hash({k: v for k, v in request.items() if k != "idempotency_key"})
+    stored = idempotency_store.get(session, tenant_key, key)
+    if stored is not None:
+        if stored[0] != request_hash:
+            raise ValueError("idempotency_key_conflict")
+        return stored[1], True
+
+    settings = tenant_settings.get(session, tenant_id) if tenant_id else None
+    if settings and settings.kill_switch:
+        raise ValueError("kill_switch_enabled")
+    action = manifest_cache.action(session, request["action_id"])
+    if action is None:
+        raise ValueError("unknown_action")
+    required = action.get("required_permissions", [])
+    if settings is None:
+        # Without a tenant there are no scopes or kill switch to check, so only ungated low-risk actions run.
+        if required or action.get("risk", RiskLevel.low.value) != RiskLevel.low.value:
+            raise ValueError("tenant_required")
+    else:
+        # Permissions are "<resource>:<verb>"; tenant scopes grant whole resources.
+        scopes = {scope.lower() for scope in settings.scopes}
+        if any(p.split(":", 1)[0].lower() not in scopes for p in required):
+            raise ValueError("missing_scope")
+
+    response = {
+        "ok": True,
+        "action_id": request["action_id"],
+        "idempotency_key": key,
+        "performed_as": request["on_behalf_of"],
+        "risk": action.get("risk", RiskLevel.low.value),
+    }
+    audit_sink.record(session, tenant_key, "dispatch_called", request["action_id"], request)
+    idempotency_store.add(session, tenant_key, key, request_hash, response)
+    try:
+        session.commit()
+    except IntegrityError:
+        # A concurrent request with the same key won the unique index; serve its stored result.
+        session.rollback()
+        stored = idempotency_store.get(session, tenant_key, key)
+        if stored is None or stored[0] != request_hash:
+            raise ValueError("idempotency_key_conflict")
+        return stored[1], True
+    idempotency_store.remember(tenant_key, key, request_hash, response)
+    if purge:
+        idempotency_store.maybe_purge(session)
+    return response, False
+
+
+def _with_session(work):
+    with Session(db.engine) as session:
+        return work(session)
+
+
+async def dispatch_action_async(session: AsyncSession, request: dict) -> tuple[dict, bool]:
+    # Only indexed lookups and the insert run on the loop. Parsing a new manifest snapshot (decompressing a
+    # delta chain) and the periodic idempotency purge run in a thread with their own session.
+    if not manifest_cache.is_current(await session.run_sync(manifest_cache.latest_id)):
+        await asyncio.to_thread(_with_session, manifest_cache.latest)
+    result = await session.run_sync(dispatch_action, request, False)
+    if idempotency_store.purge_due():
+        await asyncio.to_thread(_with_session, idempotency_store.purge_expired)
+    return result
 
 
 def ensure_default_settings(session: Session, tenant_id: str) -> Settings:
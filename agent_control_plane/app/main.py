@@ -1,54 +1,153 @@
 from __future__ import annotations
 
 import json
+import os
 from datetime import datetime
 from pathlib import Path
+from typing import Literal
 
-from fastapi import Depends, FastAPI, HTTPException, Query
-from fastapi.responses import FileResponse
+from fastapi import Depends, FastAPI, Header, HTTPException, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
+from sqlalchemy import update
 from sqlmodel import Session, select
-
-from .db import create_db, get_session
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from . import metrics
+from .ai_client import close_ai_client, get_ai_client
+from .archive import audit_archive
+from .audit import audit_sink
+from .cache import classification_cache, manifest_cache
+from .db import create_db, get_async_read_session, get_async_session, get_read_session, get_session
+from .events import ENTITY_TYPES, change_feed
+from .execution import job_engine
+from .export import MEDIA_TYPES, iter_export
+from .idempotency import idempotency_store
 from .logic import (
-    create_task_from_email,
+    abort_job,
+    add_classification_rules,
+    capability_diff,
+    capability_insights,
+    compact_capability_snapshots,
+    decide_approval,
+    create_task_from_email_async,
+    create_tasks_from_emails,
+    dispatch_action_async,
     ensure_default_settings,
     get_ai_integration_status,
-    latest_manifest,
+    ingest_emails,
+    list_audit,
+    paginate,
+    paginate_async,
     plan_job,
+    plan_jobs,
+    record_capability_snapshot,
+    requeue_job,
+    requeue_pending_classifications,
+    run_pipeline,
+    search_audit,
 )
-
-from fastapi import Depends, FastAPI, HTTPException, Query
-from sqlmodel import Session, select
-
-from .db import create_db, get_session
-from .logic import create_task_from_email, ensure_default_settings, latest_manifest, plan_job
-from .models import Approval, AuditLog, CapabilitySnapshot, EmailNormalized, Job, JobStatus, Settings, Task
+from .models import (
+    Approval,
+    ClassificationRule,
+    EmailNormalized,
+    Job,
+    JobStatus,
+    Settings,
+    Task,
+)
+from .profiling import PROFILE_HEADER, request_profiler, slow_query_log
+from .rules import rule_engines
 from .schemas import (
     ApprovalDecision,
+    ClassificationRulesPayload,
     DispatchRequest,
+    EmailBatchCreate,
     EmailCreate,
+    JobPlanBatch,
+    JobRead,
+    ManifestPush,
     ManifestResponse,
+    PipelineRequest,
     SettingsPayload,
     TaskCreateFromEmail,
+    TaskCreateFromEmails,
+    TaskRead,
 )
+from .settings_cache import tenant_settings
+from .workers import classification_pool
 
 
 STATIC_DIR = Path(__file__).resolve().parent / "static"
+INGEST_CHUNK_SIZE = 500
+# The NDJSON body is buffered before the write, so it is capped like the JSON batch endpoints.
+INGEST_MAX_LINES = int(os.getenv("INGEST_MAX_LINES", "10000"))
+INGEST_MAX_BYTES = int(os.getenv("INGEST_MAX_BYTES", str(32 * 1024 * 1024)))
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+CAPABILITY_RETENTION_KEEP = int(os.getenv("CAPABILITY_RETENTION_KEEP", "100"))
+CAPABILITY_RETENTION_DAYS = int(os.getenv("CAPABILITY_RETENTION_DAYS", "90"))
 
 app = FastAPI(title="ARX Agent Control Plane API", version="0.1.0")
 app.mount("/static", StaticFiles(directory=str(STATIC_DIR)), name="static")
 
 
+@app.middleware("http")
+async def record_metrics(request: Request, call_next):
+    return await metrics.track_request(request, call_next)
+
+
+@app.middleware("http")
+async def profile_requests(request: Request, call_next):
+    return await request_profiler(request, call_next)
+
+
 @app.get("/")
 def webapp() -> FileResponse:
     return FileResponse(str(STATIC_DIR / "index.html"))
-app = FastAPI(title="ARX Agent Control Plane API", version="0.1.0")
 
 
 @app.on_event("startup")
 def on_startup() -> None:
     create_db()
+    requeue_pending_classifications()
+    if os.getenv("JOB_ENGINE_ENABLED", "1") == "1":
+        job_engine.start()
+    change_feed.start()
+    audit_archive.start()
+
+
+@app.on_event("shutdown")
+def on_shutdown() -> None:
+    classification_pool.shutdown(wait=True)
+    job_engine.shutdown()
+    change_feed.shutdown()
+    audit_archive.shutdown()
+    close_ai_client()
+    audit_sink.shutdown()
+
+
+def _page(session: Session, response: Response, query, order_column, id_column, limit: int, cursor: str | None):
+    try:
+        rows, next_cursor = paginate(session, query, order_column, id_column, limit, cursor)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc)) from exc
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return rows
+
+
+async def _page_async(
+    session: AsyncSession, response: Response, query, order_column, id_column, limit: int, cursor: str | None
+):
+    try:
+        rows, next_cursor = await paginate_async(session, query, order_column, id_column, limit, cursor)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc)) from exc
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return rows
 
 
 @app.get("/health")
@@ -56,52 +155,200 @@ def health() -> dict[str, str]:
     return {"status": "ok"}
 
 
+@app.get("/metrics")
+def get_metrics() -> Response:
+    return Response(content=metrics.registry.render(), media_type=metrics.CONTENT_TYPE)
+
+
+def _require_admin(token: str | None) -> None:
+    if not request_profiler.authorized(token):
+        raise HTTPException(status_code=403, detail="admin_token_required")
+
+
+@app.get("/debug/profiles")
+def list_profiles(token: str | None = Header(default=None, alias=PROFILE_HEADER)):
+    _require_admin(token)
+    return {"stats": request_profiler.stats(), "profiles": request_profiler.profiles()}
+
+
+@app.get("/debug/profiles/{profile_id}")
+def get_profile(profile_id: str, token: str | None = Header(default=None, alias=PROFILE_HEADER)) -> Response:
+    _require_admin(token)
+    profile = request_profiler.get(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="profile_not_found")
+    return Response(content=profile["folded"] + "\n", media_type="text/plain")
+
+
+@app.get("/debug/slow-queries")
+def list_slow_queries(
+    limit: int = Query(default=100, ge=1, le=1000),
+    token: str | None = Header(default=None, alias=PROFILE_HEADER),
+):
+    _require_admin(token)
+    return {"stats": slow_query_log.stats(), "entries": slow_query_log.entries(limit)}
+
+
+@app.get("/audit/sink")
+def audit_sink_status():
+    return audit_sink.stats()
+
+
+@app.get("/events/stream")
+async def events_stream(
+    tenant_id: str | None = None,
+    entity_type: str | None = Query(default=None, description="Comma-separated: job, step, task, approval"),
+    last_event_id: str | None = Query(default=None),
+    last_event_id_header: str | None = Header(default=None, alias="Last-Event-ID"),
+):
+    entity_types = {value.strip() for value in entity_type.split(",") if value.strip()} if entity_type else None
+    if entity_types and not entity_types <= set(ENTITY_TYPES):
+        raise HTTPException(status_code=400, detail="unknown_entity_type")
+    subscription = change_feed.subscribe(tenant_id, entity_types)
+    return StreamingResponse(
+        change_feed.stream(subscription, last_event_id_header or last_event_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/events/status")
+def events_status():
+    return change_feed.stats()
+
+
 @app.get("/emails")
-def get_emails(
+async def get_emails(
+    response: Response,
     status: str = Query(default="new"),
     tenant_id: str | None = None,
-    session: Session = Depends(get_session),
+    limit: int = Query(default=DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: str | None = None,
+    session: AsyncSession = Depends(get_async_read_session),
 ):
     query = select(EmailNormalized)
     if status:
         query = query.where(EmailNormalized.status == status)
     if tenant_id:
         query = query.where(EmailNormalized.tenant_id == tenant_id)
-    return session.exec(query.order_by(EmailNormalized.created_at.desc())).all()
+    return await _page_async(session, response, query, EmailNormalized.created_at, EmailNormalized.id, limit, cursor)
 
 
 @app.post("/emails")
-def create_email(payload: EmailCreate, session: Session = Depends(get_session)):
+async def create_email(payload: EmailCreate, session: AsyncSession = Depends(get_async_session)):
     email = EmailNormalized(**payload.model_dump())
     session.add(email)
-    session.add(
-        AuditLog(
-            tenant_id=email.tenant_id,
-            event_type="email_ingested",
-            entity_id=None,
-            payload_json=json.dumps(payload.model_dump()),
-        )
-    )
-    session.commit()
-    session.refresh(email)
+    await session.run_sync(audit_sink.record, email.tenant_id, "email_ingested", None, payload.model_dump())
+    await session.commit()
+    await session.refresh(email)
     return email
 
 
+@app.post("/emails/batch")
+def create_emails_batch(payload: EmailBatchCreate, session: Session = Depends(get_session)):
+    ids = ingest_emails(session, [email.model_dump() for email in payload.emails])
+    return {"ok": True, "count": len(ids), "ids": ids}
+
+
+@app.post("/emails/ndjson")
+async def create_emails_ndjson(request: Request, session: Session = Depends(get_session)):
+    # The whole body is validated before anything is written, so a slow upload never holds the write lock.
+    emails: list[dict] = []
+    buffer = b""
+    line_no = 0
+
+    received = 0
+
+    def parse(line: bytes) -> None:
+        if not line.strip():
+            return
+        if len(emails) >= INGEST_MAX_LINES:
+            raise HTTPException(status_code=413, detail="too_many_lines")
+        try:
+            emails.append(EmailCreate.model_validate_json(line).model_dump())
+        except ValueError as exc:
+            raise HTTPException(status_code=422, detail={"line": line_no, "error": str(exc)}) from exc
+
+    if int(request.headers.get("content-length") or 0) > INGEST_MAX_BYTES:
+        raise HTTPException(status_code=413, detail="body_too_large")
+    async for data in request.stream():
+        received += len(data)
+        if received > INGEST_MAX_BYTES:
+            raise HTTPException(status_code=413, detail="body_too_large")
+        buffer += data
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            line_no += 1
+            parse(line)
+    line_no += 1
+    parse(buffer)
+
+    def write() -> list[int]:
+        ids = []
+        for start in range(0, len(emails), INGEST_CHUNK_SIZE):
+            ids.extend(ingest_emails(session, emails[start:start + INGEST_CHUNK_SIZE], commit=False))
+        session.commit()
+        return ids
+
+    ids = await run_in_threadpool(write)
+    return {"ok": True, "count": len(ids), "ids": ids}
+
+
+@app.post("/pipeline/emails")
+def pipeline_emails(payload: PipelineRequest, session: Session = Depends(get_session)):
+    results = run_pipeline(session, [email.model_dump() for email in payload.emails])
+    job_engine.wake()
+    return results
+
+
 @app.post("/tasks/from-email")
-def create_task(payload: TaskCreateFromEmail, session: Session = Depends(get_session)):
+async def create_task(payload: TaskCreateFromEmail, session: AsyncSession = Depends(get_async_session)):
     try:
-        task = create_task_from_email(session, payload.email_id)
+        task = await create_task_from_email_async(session, payload.email_id, payload.async_classification)
     except ValueError as exc:
         raise HTTPException(status_code=404, detail=str(exc)) from exc
     return task
 
 
+@app.post("/tasks/from-emails")
+def create_tasks(payload: TaskCreateFromEmails, session: Session = Depends(get_session)):
+    try:
+        tasks = create_tasks_from_emails(session, payload.email_ids)
+    except ValueError as exc:
+        raise HTTPException(status_code=404, detail=str(exc)) from exc
+    created = [TaskRead.model_validate(task, from_attributes=True) for task in tasks]
+    session.commit()
+    return created
+
+
 @app.get("/tasks")
-def get_tasks(status: str | None = None, session: Session = Depends(get_session)):
+def get_tasks(
+    response: Response,
+    status: str | None = None,
+    tenant_id: str | None = None,
+    limit: int = Query(default=DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: str | None = None,
+    session: Session = Depends(get_read_session),
+):
     query = select(Task)
     if status:
         query = query.where(Task.status == status)
-    return session.exec(query.order_by(Task.created_at.desc())).all()
+    if tenant_id:
+        query = query.where(Task.tenant_id == tenant_id)
+    return _page(session, response, query, Task.created_at, Task.id, limit, cursor)
+
+
+@app.post("/jobs/plan/batch")
+def plan_from_tasks(payload: JobPlanBatch, session: Session = Depends(get_session)):
+    tasks = session.exec(select(Task).where(Task.id.in_(payload.task_ids))).all()
+    by_id = {task.id: task for task in tasks}
+    if any(task_id not in by_id for task_id in payload.task_ids):
+        raise HTTPException(status_code=404, detail="task_not_found")
+    jobs = plan_jobs(session, [by_id[task_id] for task_id in payload.task_ids])
+    planned = [JobRead.model_validate(job, from_attributes=True) for job in jobs]
+    session.commit()
+    job_engine.wake()
+    return planned
 
 
 @app.post("/jobs/plan/{task_id}")
@@ -109,19 +356,35 @@ def plan_from_task(task_id: int, session: Session = Depends(get_session)):
     task = session.get(Task, task_id)
     if not task:
         raise HTTPException(status_code=404, detail="task_not_found")
-    return plan_job(session, task)
+    job = plan_job(session, task)
+    job_engine.wake()
+    return job
 
 
 @app.get("/jobs")
-def get_jobs(status: JobStatus | None = None, session: Session = Depends(get_session)):
+async def get_jobs(
+    response: Response,
+    status: JobStatus | None = None,
+    tenant_id: str | None = None,
+    limit: int = Query(default=DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: str | None = None,
+    session: AsyncSession = Depends(get_async_read_session),
+):
     query = select(Job)
     if status:
         query = query.where(Job.status == status)
-    return session.exec(query.order_by(Job.started_at.desc())).all()
+    if tenant_id:
+        query = query.where(Job.tenant_id == tenant_id)
+    return await _page_async(session, response, query, Job.started_at, Job.id, limit, cursor)
+
+
+@app.get("/jobs/engine")
+def job_engine_status():
+    return job_engine.stats()
 
 
 @app.get("/jobs/{job_id}")
-def get_job(job_id: int, session: Session = Depends(get_session)):
+def get_job(job_id: int, session: Session = Depends(get_read_session)):
     job = session.get(Job, job_id)
     if not job:
         raise HTTPException(status_code=404, detail="job_not_found")
@@ -129,14 +392,11 @@ def get_job(job_id: int, session: Session = Depends(get_session)):
 
 
 @app.post("/jobs/{job_id}/abort")
-def abort_job(job_id: int, session: Session = Depends(get_session)):
+def abort_job_endpoint(job_id: int, session: Session = Depends(get_session)):
     job = session.get(Job, job_id)
     if not job:
         raise HTTPException(status_code=404, detail="job_not_found")
-    job.status = JobStatus.aborted
-    job.updated_at = datetime.utcnow()
-    session.add(job)
-    session.commit()
+    job = abort_job(session, job)
     return {"ok": True, "job_id": job_id, "status": job.status}
 
 
@@ -145,10 +405,11 @@ def retry_job(job_id: int, session: Session = Depends(get_session)):
     job = session.get(Job, job_id)
     if not job:
         raise HTTPException(status_code=404, detail="job_not_found")
-    job.status = JobStatus.executing
-    job.updated_at = datetime.utcnow()
-    session.add(job)
-    session.commit()
+    try:
+        job = requeue_job(session, job)
+    except ValueError as exc:
+        raise HTTPException(status_code=409, detail=str(exc)) from exc
+    job_engine.wake()
     return {"ok": True, "job_id": job_id, "status": job.status}
 
 
@@ -157,12 +418,9 @@ def approve(approval_id: int, payload: ApprovalDecision, session: Session = Depe
     approval = session.get(Approval, approval_id)
     if not approval:
         raise HTTPException(status_code=404, detail="approval_not_found")
-    approval.decision = "approved"
-    approval.comment = payload.comment
-    approval.decided_by = payload.decided_by
-    session.add(approval)
-    session.commit()
-    return {"ok": True}
+    job = decide_approval(session, approval, "approved", payload.comment, payload.decided_by)
+    job_engine.wake()
+    return {"ok": True, "job_id": job.id, "job_status": job.status}
 
 
 @app.post("/approvals/{approval_id}/reject")
@@ -170,34 +428,114 @@ def reject(approval_id: int, payload: ApprovalDecision, session: Session = Depen
     approval = session.get(Approval, approval_id)
     if not approval:
         raise HTTPException(status_code=404, detail="approval_not_found")
-    approval.decision = "rejected"
-    approval.comment = payload.comment
-    approval.decided_by = payload.decided_by
-    session.add(approval)
-    session.commit()
-    return {"ok": True}
+    job = decide_approval(session, approval, "rejected", payload.comment, payload.decided_by)
+    return {"ok": True, "job_id": job.id, "job_status": job.status}
 
 
 @app.get("/audit")
-def get_audit(query: str | None = None, session: Session = Depends(get_session)):
-    q = select(AuditLog)
-    if query:
-        q = q.where(AuditLog.payload_json.contains(query))
-    return session.exec(q.order_by(AuditLog.created_at.desc())).all()
+def get_audit(
+    response: Response,
+    query: str | None = None,
+    tenant_id: str | None = None,
+    event_type: str | None = None,
+    entity_id: str | None = None,
+    since: datetime | None = None,
+    until: datetime | None = None,
+    limit: int = Query(default=DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: str | None = None,
+    session: Session = Depends(get_read_session),
+):
+    try:
+        rows, next_cursor = list_audit(session, limit, cursor, query, tenant_id, event_type, entity_id, since, until)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc)) from exc
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return rows
+
+
+@app.get("/export/{entity}")
+def export_rows(
+    entity: Literal["audit", "jobs", "tasks"],
+    format: Literal["ndjson", "csv"] = "ndjson",
+    tenant_id: str | None = None,
+    since: datetime | None = None,
+    until: datetime | None = None,
+    status: str | None = None,
+):
+    # A sync generator: Starlette drains it in the threadpool, one yield_per batch per chunk.
+    filename = f"{entity}-{datetime.utcnow():%Y%m%dT%H%M%S}.{format}"
+    return StreamingResponse(
+        iter_export(entity, format, tenant_id, since, until, status),
+        media_type=MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
+@app.get("/audit/archive")
+def audit_archive_status(tenant_id: str | None = None, since: datetime | None = None, until: datetime | None = None):
+    # Segment listings walk the archive directory, so they are only returned for a tenant or time range.
+    segments = audit_archive.segments(tenant_id, since, until) if tenant_id or since or until else []
+    listed = [{key: value for key, value in segment.items() if key != "path"} for segment in segments]
+    return {**audit_archive.stats(), "segments": listed}
+
+
+@app.post("/audit/archive")
+def archive_audit(older_than_days: int | None = Query(default=None, ge=0)):
+    return {"ok": True, **audit_archive.archive(audit_archive.cutoff(older_than_days))}
+
+
+@app.get("/audit/search")
+def audit_search(
+    response: Response,
+    q: str = Query(min_length=1),
+    tenant_id: str | None = None,
+    event_type: str | None = None,
+    entity_id: str | None = None,
+    since: datetime | None = None,
+    until: datetime | None = None,
+    limit: int = Query(default=DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: str | None = None,
+    session: Session = Depends(get_read_session),
+):
+    try:
+        rows, next_cursor = search_audit(
+            session,
+            q,
+            limit,
+            cursor,
+            tenant_id=tenant_id,
+            event_type=event_type,
+            entity_id=entity_id,
+            since=since,
+            until=until,
+        )
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc)) from exc
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return rows
+
+
+def _manifest_response(request: Request, session: Session) -> Response:
+    manifest = manifest_cache.latest(session)
+    headers = {"ETag": manifest.etag, "Cache-Control": "no-cache"}
+    if_none_match = request.headers.get("if-none-match", "")
+    if manifest.etag in {tag.strip() for tag in if_none_match.split(",")} or if_none_match.strip() == "*":
+        return Response(status_code=304, headers=headers)
+    return Response(content=manifest.body, media_type="application/json", headers=headers)
 
 
 @app.get("/capabilities/latest", response_model=ManifestResponse)
-def capabilities_latest(session: Session = Depends(get_session)):
-    manifest = latest_manifest(session)
-    if not manifest:
-        return ManifestResponse(version="bootstrap", pages=[])
-    return ManifestResponse(version=manifest.version, pages=json.loads(manifest.manifest_json)["pages"])
+def capabilities_latest(request: Request, session: Session = Depends(get_read_session)):
+    return _manifest_response(request, session)
 
 
 @app.post("/capabilities/rescan")
-def capabilities_rescan(session: Session = Depends(get_session)):
+def capabilities_rescan(payload: ManifestPush | None = None, session: Session = Depends(get_session)):
+    version = datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")
     demo_manifest = {
-        "version": datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "version": version,
         "pages": [
             {
                 "id": "customers",
@@ -220,39 +558,40 @@ def capabilities_rescan(session: Session = Depends(get_session)):
             }
         ],
     }
-    snapshot = CapabilitySnapshot(version=demo_manifest["version"], manifest_json=json.dumps(demo_manifest))
-    session.add(snapshot)
-    session.commit()
-    return {"ok": True, "version": snapshot.version}
+    manifest = {"version": version, "pages": payload.pages} if payload else demo_manifest
+    snapshot, created = record_capability_snapshot(session, manifest)
+    if created:
+        manifest_cache.invalidate()
+    return {"ok": True, "version": snapshot.version, "deduplicated": not created}
+
+
+@app.get("/capabilities/diff")
+def capabilities_diff(
+    from_version: str = Query(alias="from"),
+    to_version: str = Query(alias="to"),
+    session: Session = Depends(get_read_session),
+):
+    try:
+        return capability_diff(session, from_version, to_version)
+    except ValueError as exc:
+        raise HTTPException(status_code=404, detail=str(exc)) from exc
 
 
+@app.post("/capabilities/compact")
+def capabilities_compact(
+    keep_latest: int = Query(default=CAPABILITY_RETENTION_KEEP, ge=1),
+    max_age_days: int = Query(default=CAPABILITY_RETENTION_DAYS, ge=0),
+    session: Session = Depends(get_session),
+):
+    result = compact_capability_snapshots(session, keep_latest, max_age_days)
+    manifest_cache.invalidate()
+    return {"ok": True, **result}
 
 
 @app.get("/capabilities/insights")
 def capabilities_insights(session: Session = Depends(get_session)):
-    snapshots = session.exec(
-        select(CapabilitySnapshot).order_by(CapabilitySnapshot.created_at.desc())
-    ).all()
-    if not snapshots:
-        return {
-            "latest_version": None,
-            "total_snapshots": 0,
-            "learned_pages": 0,
-            "learned_actions": 0,
-            "recent_versions": [],
-        }
-
-    latest = snapshots[0]
-    manifest = json.loads(latest.manifest_json)
-    pages = manifest.get("pages", [])
-    learned_actions = sum(len(page.get("actions", [])) for page in pages)
-    return {
-        "latest_version": latest.version,
-        "total_snapshots": len(snapshots),
-        "learned_pages": len(pages),
-        "learned_actions": learned_actions,
-        "recent_versions": [item.version for item in snapshots[:5]],
-    }
+    return capability_insights(session)
+
 
 @app.get("/ai/integration/status")
 def ai_integration_status():
@@ -261,12 +600,57 @@ def ai_integration_status():
         **status,
         "setup": {
             "required_env": ["AI_API_KEY"],
-            "optional_env": ["AI_PROVIDER", "AI_BASE_URL", "AI_MODEL"],
+            "optional_env": [
+                "AI_PROVIDER",
+                "AI_BASE_URL",
+                "AI_MODEL",
+                "CLASSIFY_CONCURRENCY",
+                "CLASSIFY_QUEUE_SIZE",
+                "CLASSIFY_CACHE_SIZE",
+                "CLASSIFY_CACHE_TTL_SECONDS",
+                "CLASSIFY_CACHE_PERSIST",
+                "AI_POOL_SIZE",
+                "AI_CONNECT_TIMEOUT",
+                "AI_READ_TIMEOUT",
+                "AI_MAX_RETRIES",
+                "AI_BREAKER_THRESHOLD",
+                "AI_BREAKER_COOLDOWN_SECONDS",
+            ],
         },
+        "http_client": get_ai_client(status["base_url"].rstrip("/")).stats(),
+        "classification_queue": classification_pool.stats(),
+        "classification_cache": classification_cache.stats(),
         "note": "If AI_API_KEY is missing, classifier falls back to local rule-based logic.",
     }
 
 
+@app.get("/classifier/rules")
+def get_classification_rules(tenant_id: str | None = None, session: Session = Depends(get_read_session)):
+    query = select(ClassificationRule)
+    if tenant_id:
+        query = query.where(ClassificationRule.tenant_id == tenant_id)
+    return session.exec(query.order_by(ClassificationRule.priority.desc(), ClassificationRule.id)).all()
+
+
+@app.post("/classifier/rules")
+def create_classification_rules(payload: ClassificationRulesPayload, session: Session = Depends(get_session)):
+    try:
+        return add_classification_rules(session, [rule.model_dump() for rule in payload.rules])
+    except ValueError as exc:
+        raise HTTPException(status_code=422, detail=str(exc)) from exc
+
+
+@app.delete("/classifier/rules/{rule_id}")
+def delete_classification_rule(rule_id: int, session: Session = Depends(get_session)):
+    rule = session.get(ClassificationRule, rule_id)
+    if not rule:
+        raise HTTPException(status_code=404, detail="rule_not_found")
+    session.delete(rule)
+    session.commit()
+    rule_engines.invalidate(rule.tenant_id)
+    return {"ok": True, "rule_id": rule_id}
+
+
 @app.get("/settings")
 def get_settings(tenant_id: str, session: Session = Depends(get_session)):
     return ensure_default_settings(session, tenant_id)
@@ -285,30 +669,42 @@ def set_settings(payload: SettingsPayload, session: Session = Depends(get_sessio
     settings.outlook_connected = payload.outlook_connected
     settings.require_manual_learnalyze_login = payload.require_manual_learnalyze_login
     session.add(settings)
+    session.flush()
+    # Bumped in SQL so concurrent updates from other workers cannot both write the same version.
+    session.execute(update(Settings).where(Settings.id == settings.id).values(version=Settings.version + 1))
     session.commit()
     session.refresh(settings)
+    tenant_settings.invalidate(payload.tenant_id)
     return settings
 
 
-@app.get("/agent/manifest")
-def agent_manifest(session: Session = Depends(get_session)):
-    return capabilities_latest(session)
+@app.get("/agent/manifest", response_model=ManifestResponse)
+def agent_manifest(request: Request, session: Session = Depends(get_read_session)):
+    return _manifest_response(request, session)
+
+
+DISPATCH_ERRORS = {
+    "unknown_action": 404,
+    "missing_scope": 403,
+    "tenant_required": 403,
+    "idempotency_key_conflict": 409,
+    "kill_switch_enabled": 423,
+}
 
 
 @app.post("/agent/dispatch")
-def agent_dispatch(payload: DispatchRequest, session: Session = Depends(get_session)):
-    session.add(
-        AuditLog(
-            tenant_id="shared",
-            event_type="dispatch_called",
-            payload_json=json.dumps(payload.model_dump()),
-            entity_id=payload.action_id,
-        )
-    )
-    session.commit()
-    return {
-        "ok": True,
-        "action_id": payload.action_id,
-        "idempotency_key": payload.idempotency_key,
-        "performed_as": payload.on_behalf_of,
-    }
+async def agent_dispatch(
+    payload: DispatchRequest, response: Response, session: AsyncSession = Depends(get_async_session)
+):
+    try:
+        result, replayed = await dispatch_action_async(session, payload.model_dump())
+    except ValueError as exc:
+        raise HTTPException(status_code=DISPATCH_ERRORS[str(exc)], detail=str(exc)) from exc
+    if replayed:
+        response.headers["Idempotent-Replayed"] = "true"
+    return result
+
+
+@app.get("/agent/dispatch/idempotency")
+def dispatch_idempotency_status():
+    return idempotency_store.stats()
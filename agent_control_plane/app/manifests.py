@@ -0,0 +1,116 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import zlib
+from typing import Any
+
+from sqlmodel import Session
+
+from .models import CapabilitySnapshot
+
+ENCODING_JSON = "json"
+ENCODING_FULL = "zlib"
+ENCODING_DELTA = "zlib-delta"
+
+
+def manifest_hash(manifest: dict) -> str:
+    # "version" is a scan timestamp, so it is excluded: an unchanged app yields the same hash.
+    content = {key: value for key, value in manifest.items() if key != "version"}
+    canonical = json.dumps(content, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def _keyed(items: list) -> dict[Any, dict] | None:
+    if not all(isinstance(item, dict) and "id" in item for item in items):
+        return None
+    keyed = {item["id"]: item for item in items}
+    return keyed if len(keyed) == len(items) else None
+
+
+def diff_manifest(old: Any, new: Any) -> dict | None:
+    if old == new:
+        return None
+
+    if isinstance(old, dict) and isinstance(new, dict):
+        delta: dict[str, Any] = {}
+        removed = [key for key in old if key not in new]
+        added = {}
+        nested = {}
+        for key, value in new.items():
+            if key not in old:
+                added[key] = value
+                continue
+            child = diff_manifest(old[key], value)
+            if child is not None:
+                nested[key] = child
+        if removed:
+            delta["$del"] = removed
+        if added:
+            delta["$set"] = added
+        if nested:
+            delta["$sub"] = nested
+        return delta
+
+    if isinstance(old, list) and isinstance(new, list):
+        # Pages and actions carry stable ids, so lists of them are diffed per item.
+        old_keyed, new_keyed = _keyed(old), _keyed(new)
+        if old_keyed is not None and new_keyed is not None:
+            added = {}
+            nested = {}
+            for key, item in new_keyed.items():
+                if key not in old_keyed:
+                    added[key] = item
+                    continue
+                child = diff_manifest(old_keyed[key], item)
+                if child is not None:
+                    nested[key] = child
+            delta = {"$ids": list(new_keyed)}
+            if added:
+                delta["$new"] = [added[key] for key in new_keyed if key in added]
+            if nested:
+                delta["$sub"] = [[key, child] for key, child in nested.items()]
+            return delta
+
+    return {"$value": new}
+
+
+def apply_manifest_diff(old: Any, delta: dict | None) -> Any:
+    if delta is None:
+        return old
+    if "$value" in delta:
+        return delta["$value"]
+
+    if "$ids" in delta:
+        items = {item["id"]: item for item in old}
+        items.update({item["id"]: item for item in delta.get("$new", [])})
+        for key, child in delta.get("$sub", []):
+            items[key] = apply_manifest_diff(items[key], child)
+        return [items[key] for key in delta["$ids"]]
+
+    result = {key: value for key, value in old.items() if key not in delta.get("$del", [])}
+    result.update(delta.get("$set", {}))
+    for key, child in delta.get("$sub", {}).items():
+        result[key] = apply_manifest_diff(result[key], child)
+    return result
+
+
+def compress(value: Any) -> bytes:
+    return zlib.compress(json.dumps(value, separators=(",", ":")).encode("utf-8"), 9)
+
+
+def decompress(blob: bytes) -> Any:
+    return json.loads(zlib.decompress(blob).decode("utf-8"))
+
+
+def load_manifest(session: Session, snapshot: CapabilitySnapshot) -> dict:
+    # Walk back to the nearest full snapshot, then replay the deltas forward.
+    chain = []
+    current = snapshot
+    while current.encoding == ENCODING_DELTA:
+        chain.append(current)
+        current = session.get(CapabilitySnapshot, current.base_id)
+    manifest = json.loads(current.manifest_json) if current.encoding == ENCODING_JSON else decompress(current.manifest_blob)
+    for item in reversed(chain):
+        manifest = apply_manifest_diff(manifest, decompress(item.manifest_blob))
+    return manifest
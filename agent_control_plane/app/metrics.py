@@ -0,0 +1,311 @@
+from __future__ import annotations
+
+import bisect
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextvars import ContextVar
+from typing import Any, Callable, Iterable
+
+from fastapi import Request, Response
+from sqlalchemy import event, func
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import SQLAlchemyError
+from sqlmodel import Session, select
+
+from . import db
+from .models import Job
+from .workers import classification_pool
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100, 250)
+
+Sample = tuple[str, dict[str, str], float]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(str(value))}"' for key, value in labels.items()) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric(ABC):
+    kind = "untyped"
+
+    def __init__(self, name: str, help_text: str, labelnames: tuple[str, ...] = ()) -> None:
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict[str, Any]) -> tuple[str, ...]:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    @abstractmethod
+    def samples(self) -> list[Sample]:
+        ...
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labelnames: tuple[str, ...] = ()) -> None:
+        super().__init__(name, help_text, labelnames)
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: Any) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def samples(self) -> list[Sample]:
+        with self._lock:
+            items = list(self._values.items())
+        return [(self.name, dict(zip(self.labelnames, key)), value) for key, value in items]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, amount: float = 1.0, **labels: Any) -> None:
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self, name: str, help_text: str, labelnames: tuple[str, ...] = (), buckets: tuple[float, ...] = LATENCY_BUCKETS
+    ) -> None:
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: non-cumulative bucket counts (last slot is +Inf), sum of observations.
+        self._values: dict[tuple[str, ...], tuple[list[int], list[float]]] = {}
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        position = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.setdefault(key, ([0] * (len(self.buckets) + 1), [0.0]))
+            counts[position] += 1
+            total[0] += value
+
+    def count(self, **labels: Any) -> int:
+        with self._lock:
+            counts, _ = self._values.get(self._key(labels), ([0], [0.0]))
+            return sum(counts)
+
+    def samples(self) -> list[Sample]:
+        with self._lock:
+            items = [(key, list(counts), total[0]) for key, (counts, total) in self._values.items()]
+        samples = []
+        for key, counts, total in items:
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float("inf")), counts):
+                cumulative += count
+                samples.append((f"{self.name}_bucket", {**labels, "le": _format_value(bound)}, cumulative))
+            samples.append((f"{self.name}_sum", labels, total))
+            samples.append((f"{self.name}_count", labels, cumulative))
+        return samples
+
+
+class MetricsRegistry:
+    def __init__(self) -> None:
+        self._metrics: list[_Metric] = []
+        self._collectors: list[Callable[[], Iterable[tuple[str, str, str, list[Sample]]]]] = []
+
+    def counter(self, name: str, help_text: str, labelnames: tuple[str, ...] = ()) -> Counter:
+        return self._register(Counter(name, help_text, labelnames))
+
+    def gauge(self, name: str, help_text: str, labelnames: tuple[str, ...] = ()) -> Gauge:
+        return self._register(Gauge(name, help_text, labelnames))
+
+    def histogram(
+        self, name: str, help_text: str, labelnames: tuple[str, ...] = (), buckets: tuple[float, ...] = LATENCY_BUCKETS
+    ) -> Histogram:
+        return self._register(Histogram(name, help_text, labelnames, buckets))
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def collector(self, fn: Callable[[], Iterable[tuple[str, str, str, list[Sample]]]]):
+        # Collectors yield (name, type, help, samples) computed at scrape time, e.g. from the database.
+        self._collectors.append(fn)
+        return fn
+
+    def render(self) -> str:
+        families = [(metric.name, metric.kind, metric.help, metric.samples()) for metric in self._metrics]
+        for collect in self._collectors:
+            families.extend(collect())
+        lines = []
+        for name, kind, help_text, samples in families:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for sample, labels, value in samples:
+                lines.append(f"{sample}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+http_requests = registry.counter(
+    "acp_http_requests_total", "HTTP requests by route template, method and status.", ("method", "route", "status")
+)
+http_duration = registry.histogram(
+    "acp_http_request_duration_seconds",
+    "Time until the response starts, by route template; streaming bodies are not included.",
+    ("method", "route"),
+)
+http_in_flight = registry.gauge("acp_http_requests_in_flight", "Requests currently being handled.", ("method",))
+request_db_queries = registry.histogram(
+    "acp_http_request_db_queries", "SQL statements executed per request.", ("method", "route"), COUNT_BUCKETS
+)
+request_db_seconds = registry.histogram(
+    "acp_http_request_db_seconds", "Time spent in SQL per request.", ("method", "route"), LATENCY_BUCKETS
+)
+db_queries = registry.histogram(
+    "acp_db_query_duration_seconds", "SQL statement duration by statement kind.", ("statement",), QUERY_BUCKETS
+)
+ai_classify_duration = registry.histogram(
+    "acp_ai_classify_duration_seconds",
+    "AI classification calls by mode (single/batch) and outcome (ok, no_response, parse_failure).",
+    ("mode", "outcome"),
+)
+ai_timeouts = registry.counter("acp_ai_timeouts_total", "AI provider HTTP attempts that timed out.")
+ai_errors = registry.counter(
+    "acp_ai_http_errors_total",
+    "Failed AI provider calls by reason (circuit_open, client_error, exhausted).",
+    ("reason",),
+)
+ai_parse_failures = registry.counter(
+    "acp_ai_parse_failures_total", "AI responses (or batch items) that could not be parsed.", ("mode",)
+)
+classifications = registry.counter(
+    "acp_classifications_total",
+    "Email classifications by source; rules_fallback means AI was configured but gave no usable answer.",
+    ("source",),
+)
+
+
+class RequestStats:
+    __slots__ = ("scope", "tenant_id", "queries", "seconds")
+
+    def __init__(self, scope: dict[str, Any], tenant_id: str | None) -> None:
+        self.scope = scope
+        self.tenant_id = tenant_id
+        self.queries = 0
+        self.seconds = 0.0
+
+    @property
+    def route(self) -> str:
+        # The router stores the matched route in the shared scope, so this is known once routing has run.
+        # Route templates keep label sets bounded; unmatched paths are folded into one series.
+        return getattr(self.scope.get("route"), "path", "unmatched")
+
+
+# Mutable per-request holder; threadpool handlers and async DB greenlets run in a copy of the request's context.
+_request_stats: ContextVar[RequestStats | None] = ContextVar("acp_request_stats", default=None)
+
+
+def current_request() -> RequestStats | None:
+    return _request_stats.get()
+
+
+def _statement_kind(statement: str) -> str:
+    kind = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else ""
+    return kind if kind in {"SELECT", "INSERT", "UPDATE", "DELETE", "WITH", "PRAGMA"} else "OTHER"
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    conn.info.setdefault("acp_query_started", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    started = conn.info.get("acp_query_started")
+    if not started:
+        return
+    elapsed = time.perf_counter() - started.pop()
+    db_queries.observe(elapsed, statement=_statement_kind(statement))
+    stats = _request_stats.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.seconds += elapsed
+
+
+@event.listens_for(Engine, "handle_error")
+def _handle_error(context) -> None:
+    if context.connection is not None:
+        started = context.connection.info.get("acp_query_started")
+        if started:
+            started.pop()
+
+
+async def track_request(request: Request, call_next) -> Response:
+    method = request.method
+    stats = RequestStats(request.scope, request.query_params.get("tenant_id"))
+    token = _request_stats.set(stats)
+    http_in_flight.inc(method=method)
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        elapsed = time.perf_counter() - started
+        http_in_flight.dec(method=method)
+        _request_stats.reset(token)
+        route = stats.route
+        http_requests.inc(method=method, route=route, status=status)
+        http_duration.observe(elapsed, method=method, route=route)
+        request_db_queries.observe(stats.queries, method=method, route=route)
+        request_db_seconds.observe(stats.seconds, method=method, route=route)
+
+
+@registry.collector
+def _job_status() -> list[tuple[str, str, str, list[Sample]]]:
+    try:
+        with Session(db.read_engine) as session:
+            rows = session.exec(
+                select(Job.tenant_id, Job.status, func.count()).group_by(Job.tenant_id, Job.status)
+            ).all()
+    except SQLAlchemyError:
+        rows = []
+    samples = [
+        ("acp_jobs", {"tenant_id": tenant_id, "status": getattr(status, "value", status)}, count)
+        for tenant_id, status, count in rows
+    ]
+    return [("acp_jobs", "gauge", "Jobs by tenant and status.", samples)]
+
+
+@registry.collector
+def _worker_pools() -> list[tuple[str, str, str, list[Sample]]]:
+    stats = classification_pool.stats()
+    return [
+        (
+            "acp_worker_pool_in_flight",
+            "gauge",
+            "Tasks submitted to a bounded worker pool and not yet finished.",
+            [("acp_worker_pool_in_flight", {"pool": classification_pool.name}, stats["in_flight"])],
+        )
+    ]
@@ -4,6 +4,7 @@ from datetime import datetime
 from enum import Enum
 from typing import Optional
 
+from sqlalchemy import Index
 from sqlmodel import Field, SQLModel
 
 
@@ -30,13 +31,38 @@ class AutonomyMode(str, Enum):
 
 
 class CapabilitySnapshot(SQLModel, table=True):
+    __table_args__ = (Index("ix_capabilitysnapshot_created", "created_at", "id"),)
+
     id: Optional[int] = Field(default=None, primary_key=True)
-    version: str
-    manifest_json: str
+    version: str = Field(index=True)
+    manifest_json: str = ""
+    manifest_blob: Optional[bytes] = None
+    encoding: str = "json"
+    base_id: Optional[int] = None
+    chain_length: int = 0
+    content_hash: Optional[str] = Field(default=None, index=True)
+    page_count: int = 0
+    action_count: int = 0
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
 
+class CapabilityInsights(SQLModel, table=True):
+    id: Optional[int] = Field(default=None, primary_key=True)
+    total_snapshots: int = 0
+    latest_snapshot_id: Optional[int] = None
+    latest_version: Optional[str] = None
+    learned_pages: int = 0
+    learned_actions: int = 0
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+
+
 class EmailNormalized(SQLModel, table=True):
+    __table_args__ = (
+        Index("ix_email_tenant_status_created", "tenant_id", "status", "created_at", "id"),
+        Index("ix_email_status_created", "status", "created_at", "id"),
+        Index("ix_email_created", "created_at", "id"),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
     tenant_id: str
     from_address: str
@@ -48,6 +74,12 @@ class EmailNormalized(SQLModel, table=True):
 
 
 class Task(SQLModel, table=True):
+    __table_args__ = (
+        Index("ix_task_tenant_status_created", "tenant_id", "status", "created_at", "id"),
+        Index("ix_task_status_created", "status", "created_at", "id"),
+        Index("ix_task_created", "created_at", "id"),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
     email_id: Optional[int] = Field(default=None, foreign_key="emailnormalized.id")
     tenant_id: str
@@ -61,6 +93,12 @@ class Task(SQLModel, table=True):
 
 
 class Job(SQLModel, table=True):
+    __table_args__ = (
+        Index("ix_job_tenant_status_started", "tenant_id", "status", "started_at", "id"),
+        Index("ix_job_status_started", "status", "started_at", "id"),
+        Index("ix_job_started", "started_at", "id"),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
     task_id: Optional[int] = Field(default=None, foreign_key="task.id")
     tenant_id: str
@@ -71,6 +109,11 @@ class Job(SQLModel, table=True):
 
 
 class JobStep(SQLModel, table=True):
+    __table_args__ = (
+        Index("ix_jobstep_job", "job_id", "index"),
+        Index("ix_jobstep_status_lease", "status", "lease_expires_at", "id"),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
     job_id: int = Field(foreign_key="job.id")
     index: int
@@ -80,12 +123,17 @@ class JobStep(SQLModel, table=True):
     output_json: Optional[str] = None
     status: str = "pending"
     requires_approval: bool = False
+    attempts: int = 0
+    lease_owner: Optional[str] = None
+    lease_expires_at: Optional[datetime] = None
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
 
 class Approval(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
-    job_step_id: int = Field(foreign_key="jobstep.id")
+    job_step_id: int = Field(foreign_key="jobstep.id", index=True)
     decision: Optional[str] = None
     comment: Optional[str] = None
     decided_by: Optional[str] = None
@@ -93,6 +141,13 @@ class Approval(SQLModel, table=True):
 
 
 class AuditLog(SQLModel, table=True):
+    __table_args__ = (
+        Index("ix_audit_tenant_created", "tenant_id", "created_at", "id"),
+        Index("ix_audit_created", "created_at", "id"),
+        Index("ix_audit_tenant_event_created", "tenant_id", "event_type", "created_at", "id"),
+        Index("ix_audit_entity_created", "entity_id", "created_at", "id"),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
     tenant_id: str
     event_type: str
@@ -103,7 +158,8 @@ class AuditLog(SQLModel, table=True):
 
 class Settings(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
-    tenant_id: str
+    tenant_id: str = Field(index=True)
+    version: int = 0
     autonomy_mode: AutonomyMode = AutonomyMode.off
     scopes: str = "Customers,Projects,Invoices,Emails,Support"
     kill_switch: bool = False
@@ -113,3 +169,56 @@ class Settings(SQLModel, table=True):
     )
     outlook_connected: bool = False
     require_manual_learnalyze_login: bool = True
+
+
+class ClassificationCacheEntry(SQLModel, table=True):
+    key: str = Field(primary_key=True)
+    model: str
+    result_json: str
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+
+class ClassificationRule(SQLModel, table=True):
+    id: Optional[int] = Field(default=None, primary_key=True)
+    tenant_id: Optional[str] = Field(default=None, index=True)
+    kind: str = "keyword"
+    pattern: str
+    intent: str
+    why: Optional[str] = None
+    confidence: float = 0.8
+    risk: RiskLevel = RiskLevel.low
+    priority: int = 0
+    enabled: bool = True
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+
+class DispatchIdempotency(SQLModel, table=True):
+    __table_args__ = (
+        Index("ux_dispatchidempotency_tenant_key", "tenant_id", "idempotency_key", unique=True),
+        Index("ix_dispatchidempotency_expires", "expires_at"),
+    )
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    tenant_id: str
+    idempotency_key: str
+    request_hash: str
+    response_json: str
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    expires_at: datetime
+
+
+class ChangeEvent(SQLModel, table=True):
+    # AUTOINCREMENT: ids are stream cursors and must never be reused, even after a prune empties the table.
+    __table_args__ = (
+        Index("ix_changeevent_tenant", "tenant_id", "id"),
+        Index("ix_changeevent_created", "created_at"),
+        {"sqlite_autoincrement": True},
+    )
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    tenant_id: str
+    entity_type: str
+    entity_id: str
+    status: Optional[str] = None
+    payload_json: str = "{}"
+    created_at: datetime = Field(default_factory=datetime.utcnow)
@@ -0,0 +1,280 @@
+from __future__ import annotations
+
+import hmac
+import logging
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from datetime import datetime
+from pathlib import Path
+from typing import Any
+
+from fastapi import Request, Response
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from .metrics import current_request
+
+logger = logging.getLogger(__name__)
+slow_query_logger = logging.getLogger("app.slow_query")
+
+PROFILE_HEADER = "X-Profile"
+# Top frames of threads parked waiting for work; samples ending there are idle time, not request time.
+_IDLE_FRAMES = {
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("selectors.py", "select"),
+    ("queue.py", "get"),
+    ("thread.py", "_worker"),
+    ("socket.py", "accept"),
+}
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    module = frame.f_globals.get("__name__", Path(code.co_filename).stem)
+    return f"{module}:{code.co_name}:{frame.f_lineno}"
+
+
+class StackSampler:
+    def __init__(self, interval: float) -> None:
+        self.interval = interval
+        self.samples: Counter[str] = Counter()
+        self.total = 0
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self._thread.join(timeout=5)
+
+    def _run(self) -> None:
+        own = threading.get_ident()
+        while not self._stopped.is_set():
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own or (Path(frame.f_code.co_filename).name, frame.f_code.co_name) in _IDLE_FRAMES:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame))
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.samples[";".join(reversed(stack))] += 1
+                self.total += 1
+            self._stopped.wait(self.interval)
+
+
+class RequestProfiler:
+    def __init__(
+        self,
+        sample_rate: float,
+        admin_token: str | None,
+        interval: float,
+        keep: int,
+        max_concurrent: int,
+        directory: str | None,
+    ) -> None:
+        # Sampling profiles every thread, so concurrent requests show up in each other's profiles; the caps
+        # keep the overhead bounded and the header mode is meant for a quiet instance.
+        self.sample_rate = sample_rate
+        self.admin_token = admin_token
+        self.interval = interval
+        self.directory = Path(directory) if directory else None
+        self._profiles: deque[dict[str, Any]] = deque(maxlen=keep)
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+        self._lock = threading.Lock()
+        self.profiled = 0
+        self.skipped = 0
+
+    def authorized(self, token: str | None) -> bool:
+        return bool(self.admin_token and token and hmac.compare_digest(token, self.admin_token))
+
+    def _reason(self, request: Request) -> str | None:
+        if request.headers.get(PROFILE_HEADER) is not None:
+            return "header" if self.authorized(request.headers.get(PROFILE_HEADER)) else None
+        if self.sample_rate > 0 and random.random() < self.sample_rate:
+            return "sampled"
+        return None
+
+    async def __call__(self, request: Request, call_next) -> Response:
+        reason = self._reason(request)
+        if reason is None:
+            return await call_next(request)
+        if not self._slots.acquire(blocking=False):
+            self.skipped += 1
+            return await call_next(request)
+
+        sampler = StackSampler(self.interval)
+        sampler.start()
+        started = time.perf_counter()
+        status = 500
+        try:
+            response = await call_next(request)
+            status = response.status_code
+        finally:
+            sampler.stop()
+            self._slots.release()
+            profile = self._store(request, reason, status, time.perf_counter() - started, sampler)
+        response.headers["X-Profile-Id"] = profile["id"]
+        return response
+
+    def _store(
+        self, request: Request, reason: str, status: int, elapsed: float, sampler: StackSampler
+    ) -> dict[str, Any]:
+        own: Counter[str] = Counter()
+        for stack, count in sampler.samples.items():
+            own[stack.rsplit(";", 1)[-1]] += count
+        profile = {
+            "id": uuid.uuid4().hex[:16],
+            "created_at": datetime.utcnow().isoformat(),
+            "reason": reason,
+            "method": request.method,
+            "path": request.url.path,
+            "route": getattr(request.scope.get("route"), "path", "unmatched"),
+            "tenant_id": request.query_params.get("tenant_id"),
+            "status": status,
+            "duration_ms": round(elapsed * 1000, 3),
+            "interval_ms": round(self.interval * 1000, 3),
+            "samples": sampler.total,
+            "top": [{"frame": frame, "samples": count} for frame, count in own.most_common(10)],
+            # Brendan Gregg's folded format: feed it to flamegraph.pl or speedscope.
+            "folded": "\n".join(f"{stack} {count}" for stack, count in sampler.samples.most_common()),
+        }
+        with self._lock:
+            self._profiles.append(profile)
+            self.profiled += 1
+        if self.directory is not None:
+            try:
+                self.directory.mkdir(parents=True, exist_ok=True)
+                (self.directory / f"{profile['id']}.folded").write_text(profile["folded"] + "\n", encoding="utf-8")
+            except OSError:
+                logger.exception("failed to write profile %s", profile["id"])
+        return profile
+
+    def get(self, profile_id: str) -> dict[str, Any] | None:
+        with self._lock:
+            return next((profile for profile in self._profiles if profile["id"] == profile_id), None)
+
+    def profiles(self) -> list[dict[str, Any]]:
+        with self._lock:
+            profiles = list(self._profiles)
+        return [{key: value for key, value in profile.items() if key != "folded"} for profile in reversed(profiles)]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._profiles.clear()
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "sample_rate": self.sample_rate,
+            "header_enabled": bool(self.admin_token),
+            "interval_ms": round(self.interval * 1000, 3),
+            "stored": len(self._profiles),
+            "profiled": self.profiled,
+            "skipped": self.skipped,
+            "directory": str(self.directory) if self.directory else None,
+        }
+
+
+class SlowQueryLog:
+    def __init__(self, threshold_ms: float, keep: int, max_statement_chars: int = 2000) -> None:
+        self.threshold = threshold_ms / 1000
+        self.max_statement_chars = max_statement_chars
+        self._entries: deque[dict[str, Any]] = deque(maxlen=keep)
+        self._lock = threading.Lock()
+        self.recorded = 0
+
+    def check(self, statement: str, parameters, context, elapsed: float) -> None:
+        if self.threshold <= 0 or elapsed < self.threshold:
+            return
+        request = current_request()
+        route = request.route if request is not None else None
+        tenant_id = request.tenant_id if request is not None else None
+        if tenant_id is None:
+            tenant_id = _tenant_parameter(context)
+        # Only the statement is kept; bound values can carry email contents.
+        entry = {
+            "created_at": datetime.utcnow().isoformat(),
+            "duration_ms": round(elapsed * 1000, 3),
+            "route": route or "background",
+            "tenant_id": tenant_id,
+            "statement": " ".join(statement.split())[: self.max_statement_chars],
+            "rows": len(parameters) if isinstance(parameters, list) else 1,
+        }
+        with self._lock:
+            self._entries.append(entry)
+            self.recorded += 1
+        slow_query_logger.warning(
+            "slow query %.1fms route=%s tenant_id=%s: %s",
+            entry["duration_ms"],
+            entry["route"],
+            entry["tenant_id"],
+            entry["statement"][:500],
+        )
+
+    def entries(self, limit: int = 100) -> list[dict[str, Any]]:
+        with self._lock:
+            entries = list(self._entries)
+        return list(reversed(entries))[:limit]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "threshold_ms": round(self.threshold * 1000, 3),
+            "stored": len(self._entries),
+            "recorded": self.recorded,
+        }
+
+
+def _tenant_parameter(context) -> str | None:
+    # Background work (job engine, change feed) has no request; tenant-scoped statements still bind a tenant_id.
+    parameters = getattr(context, "compiled_parameters", None) or []
+    for key, value in (parameters[0] if parameters else {}).items():
+        if key.startswith("tenant_id") and isinstance(value, str):
+            return value
+    return None
+
+
+request_profiler = RequestProfiler(
+    sample_rate=float(os.getenv("PROFILE_SAMPLE_RATE", "0")),
+    admin_token=os.getenv("PROFILE_ADMIN_TOKEN") or None,
+    interval=float(os.getenv("PROFILE_INTERVAL_MS", "5")) / 1000,
+    keep=int(os.getenv("PROFILE_KEEP", "50")),
+    max_concurrent=int(os.getenv("PROFILE_MAX_CONCURRENT", "2")),
+    directory=os.getenv("PROFILE_DIR") or None,
+)
+slow_query_log = SlowQueryLog(
+    threshold_ms=float(os.getenv("SLOW_QUERY_MS", "250")),
+    keep=int(os.getenv("SLOW_QUERY_KEEP", "200")),
+)
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    conn.info.setdefault("acp_slow_query_started", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    started = conn.info.get("acp_slow_query_started")
+    if started:
+        slow_query_log.check(statement, parameters, context, time.perf_counter() - started.pop())
+
+
+@event.listens_for(Engine, "handle_error")
+def _handle_error(context) -> None:
+    if context.connection is not None:
+        started = context.connection.info.get("acp_slow_query_started")
+        if started:
+            started.pop()
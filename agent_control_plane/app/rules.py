@@ -0,0 +1,202 @@
+from __future__ import annotations
+
+import json
+import os
+import re
+import threading
+from collections import defaultdict
+from typing import Iterable
+
+from sqlmodel import Session, or_, select
+
+from . import db
+from .models import ClassificationRule, RiskLevel
+
+Classification = tuple[str, str, float, RiskLevel]
+
+FALLBACK: Classification = ("needs triage", "No strong intent; route to inbox", 0.55, RiskLevel.low)
+# An unescaped \1-\9, (?P=name) or (?(group)...) refers back to another group.
+_GROUP_REFERENCE = re.compile(r"(?<!\\)(?:\\\\)*(?:\\[1-9]|\(\?P=|\(\?\()")
+
+DEFAULT_RULES: list[dict] = [
+    {
+        "kind": "keyword",
+        "patterns": ["opret kunde", "new customer"],
+        "intent": "create customer",
+        "why": "Detected customer onboarding keywords",
+        "confidence": 0.93,
+        "risk": "low",
+        "priority": 30,
+    },
+    {
+        "kind": "keyword",
+        "patterns": ["invoice", "faktura"],
+        "intent": "invoice follow-up",
+        "why": "Detected invoicing workflow",
+        "confidence": 0.88,
+        "risk": "medium",
+        "priority": 20,
+    },
+    {
+        "kind": "keyword",
+        "patterns": ["delete", "slet"],
+        "intent": "dangerous change",
+        "why": "Detected destructive intent",
+        "confidence": 0.81,
+        "risk": "high",
+        "priority": 10,
+    },
+]
+
+
+def _trie_pattern(words: Iterable[str]) -> str:
+    # Factor shared prefixes so the combined keyword regex costs O(keyword length) per position,
+    # not O(number of keywords).
+    trie: dict = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def build(node: dict) -> str:
+        terminal = "" in node
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        if terminal:
+            return f"(?:{body})?" if len(branches) == 1 else body[:-1] + "|)"
+        return body
+
+    return build(trie)
+
+
+def validate_regex(pattern: str) -> None:
+    try:
+        compiled = re.compile(pattern)
+    except re.error as exc:
+        raise ValueError(f"invalid_pattern: {pattern}: {exc}") from exc
+    if compiled.groupindex:
+        raise ValueError(f"invalid_pattern: {pattern}: named groups are not supported")
+    if _GROUP_REFERENCE.search(pattern):
+        raise ValueError(f"invalid_pattern: {pattern}: backreferences are not supported")
+
+
+class RuleEngine:
+    def __init__(self, rules: list[dict]) -> None:
+        # Each entry: (priority, order, classification); lower sort key wins.
+        self._rules: list[tuple[int, int, Classification]] = []
+        keywords: dict[str, list[int]] = defaultdict(list)
+        regexes: list[tuple[int, re.Pattern]] = []
+
+        for order, rule in enumerate(rules):
+            index = len(self._rules)
+            self._rules.append(
+                (
+                    -int(rule.get("priority", 0)),
+                    order,
+                    (
+                        rule["intent"],
+                        rule.get("why") or f"Matched rule for {rule['intent']}",
+                        float(rule.get("confidence", 0.8)),
+                        RiskLevel(rule.get("risk", "low")),
+                    ),
+                )
+            )
+            for pattern in rule["patterns"]:
+                if rule.get("kind", "keyword") == "regex":
+                    regexes.append((index, re.compile(pattern, re.IGNORECASE)))
+                else:
+                    keywords[pattern.lower()].append(index)
+
+        self._keyword_rules = dict(keywords)
+        # The lookahead finds overlapping matches ("kunde" inside "opret kunde") in a single pass.
+        self._keyword_re = re.compile(f"(?=({_trie_pattern(keywords)}))") if keywords else None
+        # Regex rules are searched one at a time in priority order: a single alternation would consume text
+        # non-overlappingly and let a lower-priority pattern hide a higher-priority one.
+        self._regexes = sorted(regexes, key=lambda entry: self._rules[entry[0]][:2])
+
+    def _keyword_matches(self, text: str) -> set[int]:
+        matched: set[int] = set()
+        if self._keyword_re is not None:
+            for match in self._keyword_re.finditer(text):
+                found = match.group(1)
+                # The regex reports the longest keyword at each position; shorter keywords that are
+                # prefixes of it match too.
+                for end in range(1, len(found) + 1):
+                    matched.update(self._keyword_rules.get(found[:end], ()))
+        return matched
+
+    def classify(self, subject: str, body: str) -> Classification:
+        text = f"{subject} {body}".lower()
+        keyword_rules = [self._rules[index] for index in self._keyword_matches(text)]
+        best = min(keyword_rules, key=lambda rule: rule[:2], default=None)
+        for index, pattern in self._regexes:
+            rule = self._rules[index]
+            if best is not None and rule[:2] >= best[:2]:
+                break
+            if pattern.search(text):
+                best = rule
+                break
+        return best[2] if best is not None else FALLBACK
+
+    def classify_many(self, emails: list[tuple[str, str]]) -> list[Classification]:
+        return [self.classify(subject, body) for subject, body in emails]
+
+
+def _load_config_rules() -> list[dict]:
+    path = os.getenv("CLASSIFIER_RULES_PATH")
+    if not path:
+        return DEFAULT_RULES
+    with open(path, encoding="utf-8") as handle:
+        return json.load(handle)
+
+
+def _rule_to_dict(rule: ClassificationRule) -> dict:
+    return {
+        "kind": rule.kind,
+        "patterns": [rule.pattern],
+        "intent": rule.intent,
+        "why": rule.why,
+        "confidence": rule.confidence,
+        "risk": rule.risk.value,
+        "priority": rule.priority,
+    }
+
+
+class RuleEngineRegistry:
+    def __init__(self) -> None:
+        self._engines: dict[str | None, RuleEngine] = {}
+        self._lock = threading.Lock()
+
+    def get(self, tenant_id: str | None = None) -> RuleEngine:
+        engine = self._engines.get(tenant_id)
+        if engine is not None:
+            return engine
+        with self._lock:
+            engine = self._engines.get(tenant_id)
+            if engine is None:
+                engine = RuleEngine(self._load(tenant_id))
+                self._engines[tenant_id] = engine
+            return engine
+
+    def _load(self, tenant_id: str | None) -> list[dict]:
+        with Session(db.engine) as session:
+            query = select(ClassificationRule).where(ClassificationRule.enabled == True)  # noqa: E712
+            if tenant_id:
+                query = query.where(or_(ClassificationRule.tenant_id == tenant_id, ClassificationRule.tenant_id == None))  # noqa: E711
+            else:
+                query = query.where(ClassificationRule.tenant_id == None)  # noqa: E711
+            stored = session.exec(query.order_by(ClassificationRule.id)).all()
+        return [_rule_to_dict(rule) for rule in stored] + _load_config_rules()
+
+    def invalidate(self, tenant_id: str | None = None) -> None:
+        with self._lock:
+            if tenant_id is None:
+                self._engines.clear()
+            else:
+                self._engines.pop(tenant_id, None)
+
+
+rule_engines = RuleEngineRegistry()
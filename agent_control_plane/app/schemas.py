@@ -1,9 +1,9 @@
 from __future__ import annotations
 
 from datetime import datetime
-from typing import Any
+from typing import Any, Literal
 
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
 from .models import AutonomyMode, JobStatus, RiskLevel
 
@@ -15,8 +15,21 @@ class EmailCreate(BaseModel):
     body: str
 
 
+class EmailBatchCreate(BaseModel):
+    emails: list[EmailCreate] = Field(max_length=10000)
+
+
+class PipelineRequest(BaseModel):
+    emails: list[EmailCreate] = Field(min_length=1, max_length=10000)
+
+
 class TaskCreateFromEmail(BaseModel):
     email_id: int
+    async_classification: bool = False
+
+
+class TaskCreateFromEmails(BaseModel):
+    email_ids: list[int] = Field(min_length=1, max_length=10000)
 
 
 class TaskRead(BaseModel):
@@ -42,6 +55,10 @@ class JobRead(BaseModel):
     updated_at: datetime
 
 
+class JobPlanBatch(BaseModel):
+    task_ids: list[int] = Field(min_length=1, max_length=10000)
+
+
 class ApprovalDecision(BaseModel):
     comment: str | None = None
     decided_by: str
@@ -58,6 +75,7 @@ class SettingsPayload(BaseModel):
 
 
 class DispatchRequest(BaseModel):
+    tenant_id: str | None = None
     action_id: str
     payload: dict[str, Any]
     on_behalf_of: str
@@ -67,3 +85,22 @@ class DispatchRequest(BaseModel):
 class ManifestResponse(BaseModel):
     version: str
     pages: list[dict[str, Any]]
+
+
+class ManifestPush(BaseModel):
+    pages: list[dict[str, Any]]
+
+
+class ClassificationRuleCreate(BaseModel):
+    tenant_id: str | None = None
+    kind: Literal["keyword", "regex"] = "keyword"
+    patterns: list[str] = Field(min_length=1)
+    intent: str
+    why: str | None = None
+    confidence: float = Field(default=0.8, ge=0, le=1)
+    risk: RiskLevel = RiskLevel.low
+    priority: int = 0
+
+
+class ClassificationRulesPayload(BaseModel):
+    rules: list[ClassificationRuleCreate] = Field(min_length=1)
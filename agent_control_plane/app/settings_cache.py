@@ -0,0 +1,101 @@
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+from typing import Any
+
+from pydantic import BaseModel, ConfigDict
+from sqlmodel import Session, select
+
+from .models import AutonomyMode, Settings
+
+
+class TenantPolicy(BaseModel):
+    model_config = ConfigDict(extra="allow", frozen=True)
+
+    no_delete_without_approval: bool = True
+    max_bulk_updates: int = 100
+    max_monetary_change_pct: float = 10
+    email_after_hours: bool = False
+
+
+class TenantSettings(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
+    tenant_id: str
+    version: int
+    autonomy_mode: AutonomyMode
+    kill_switch: bool
+    scopes: frozenset[str]
+    policy: TenantPolicy
+
+
+def _parse(settings: Settings) -> TenantSettings:
+    try:
+        policy: dict[str, Any] = json.loads(settings.policy_json or "{}")
+    except json.JSONDecodeError:
+        policy = {}
+    return TenantSettings(
+        tenant_id=settings.tenant_id,
+        version=settings.version,
+        autonomy_mode=settings.autonomy_mode,
+        kill_switch=settings.kill_switch,
+        scopes=frozenset(scope for scope in settings.scopes.split(",") if scope),
+        policy=TenantPolicy(**policy),
+    )
+
+
+class TenantSettingsCache:
+    def __init__(self, check_interval: float) -> None:
+        # Entries are trusted for check_interval seconds; after that one indexed version lookup tells
+        # whether another worker changed the row.
+        self.check_interval = check_interval
+        self._entries: dict[str, tuple[float, TenantSettings]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.revalidations = 0
+        self.loads = 0
+
+    def get(self, session: Session, tenant_id: str) -> TenantSettings:
+        now = time.monotonic()
+        entry = self._entries.get(tenant_id)
+        if entry is not None:
+            checked_at, cached = entry
+            if now - checked_at < self.check_interval:
+                self.hits += 1
+                return cached
+            version = session.exec(select(Settings.version).where(Settings.tenant_id == tenant_id)).first()
+            if (version or 0) == cached.version:
+                self.revalidations += 1
+                with self._lock:
+                    self._entries[tenant_id] = (now, cached)
+                return cached
+
+        stored = session.exec(select(Settings).where(Settings.tenant_id == tenant_id)).first()
+        # Tenants without a row get the model defaults without writing on the read path.
+        loaded = _parse(stored or Settings(tenant_id=tenant_id))
+        self.loads += 1
+        with self._lock:
+            self._entries[tenant_id] = (now, loaded)
+        return loaded
+
+    def invalidate(self, tenant_id: str | None = None) -> None:
+        with self._lock:
+            if tenant_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(tenant_id, None)
+
+    def stats(self) -> dict[str, int | float]:
+        return {
+            "tenants": len(self._entries),
+            "check_interval": self.check_interval,
+            "hits": self.hits,
+            "revalidations": self.revalidations,
+            "loads": self.loads,
+        }
+
+
+tenant_settings = TenantSettingsCache(check_interval=float(os.getenv("SETTINGS_CACHE_CHECK_SECONDS", "1.0")))
@@ -0,0 +1,48 @@
+from __future__ import annotations
+
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable
+
+
+class BoundedExecutor:
+    def __init__(self, name: str, max_workers: int, max_pending: int) -> None:
+        self.name = name
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self._slots = threading.BoundedSemaphore(max_workers + max_pending)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+
+    def try_submit(self, fn: Callable[..., Any], *args: Any) -> Future | None:
+        if not self._slots.acquire(blocking=False):
+            return None
+        with self._lock:
+            self._in_flight += 1
+        future = self._executor.submit(fn, *args)
+        future.add_done_callback(self._release)
+        return future
+
+    def _release(self, _: Future) -> None:
+        with self._lock:
+            self._in_flight -= 1
+        self._slots.release()
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "concurrency": self.max_workers,
+            "queue_size": self.max_pending,
+            "in_flight": self._in_flight,
+        }
+
+    def shutdown(self, wait: bool = True) -> None:
+        self._executor.shutdown(wait=wait)
+
+
+classification_pool = BoundedExecutor(
+    "classify",
+    max_workers=int(os.getenv("CLASSIFY_CONCURRENCY", "4")),
+    max_pending=int(os.getenv("CLASSIFY_QUEUE_SIZE", "200")),
+)
@@ -0,0 +1,308 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import random
+import re
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Awaitable, Callable
+
+CUSTOMERS = ["Acme", "Nordlys", "Fjordtech", "Bølge", "Kastanje", "Granit", "Havn", "Lynhurtig", "Solsort", "Tårn"]
+TEMPLATES = [
+    ("Opret kunde {customer}", "Hej, vi vil gerne oprettes som kunde. Kontakt {person} angående {topic}."),
+    ("Faktura {customer} {topic}", "Fakturaen for {topic} skal rettes, {person} har spørgsmål til beløbet."),
+    ("Slet data for {customer}", "Vi ønsker alle data om {person} slettet efter aftale om {topic}."),
+    ("Support: {topic}", "{customer} oplever problemer med {topic}. Venlig hilsen {person}."),
+]
+PEOPLE = ["Anna", "Bo", "Carla", "Dennis", "Eva", "Frederik", "Gitte", "Hans", "Ida", "Jonas"]
+TOPICS = ["abonnement", "levering", "login", "rapport", "integration", "kontrakt", "opsætning", "fornyelse"]
+_SUBJECT_LINE = re.compile(r"^Subject: (.*)$", re.MULTILINE)
+
+
+class StubAIHandler(BaseHTTPRequestHandler):
+    # OpenAI-compatible chat completions with a fixed, configurable latency instead of a real provider. Tests
+    # script error statuses and read the request and connection counts.
+    protocol_version = "HTTP/1.1"
+    latency = 0.0
+    statuses: list[int] = []
+    connections: set[int] = set()
+    requests = 0
+
+    def do_POST(self) -> None:
+        handler = type(self)
+        handler.requests += 1
+        handler.connections.add(self.client_address[1])
+        request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        system, user = ([message["content"] for message in request.get("messages", [])] + ["", ""])[:2]
+        time.sleep(self.latency)
+        if "JSON array" in system:
+            subjects = _SUBJECT_LINE.findall(user)
+            content = json.dumps([{"index": index, **_stub_classification(s)} for index, s in enumerate(subjects)])
+        else:
+            content = json.dumps(_stub_classification(user))
+        body = json.dumps({"choices": [{"message": {"content": content}}]}).encode("utf-8")
+        self.send_response(handler.statuses.pop(0) if handler.statuses else 200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args: Any) -> None:
+        pass
+
+
+def _stub_classification(text: str) -> dict[str, Any]:
+    lowered = text.lower()
+    if "slet" in lowered:
+        return {"intent": "delete data", "why": "stub", "confidence": 0.92, "risk": "high"}
+    if "faktura" in lowered:
+        return {"intent": "update invoice", "why": "stub", "confidence": 0.85, "risk": "medium"}
+    if "opret" in lowered:
+        return {"intent": "create customer", "why": "stub", "confidence": 0.9, "risk": "low"}
+    return {"intent": "support request", "why": "stub", "confidence": 0.6, "risk": "low"}
+
+
+def start_ai_stub(latency_ms: float = 0.0, statuses: list[int] | None = None) -> ThreadingHTTPServer:
+    # Each server gets its own handler class, so statuses and counters are per stub.
+    handler = type(
+        "ConfiguredStubAIHandler",
+        (StubAIHandler,),
+        {"latency": latency_ms / 1000, "statuses": list(statuses or []), "connections": set(), "requests": 0},
+    )
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True).start()
+    return server
+
+
+def stub_url(server: ThreadingHTTPServer) -> str:
+    return f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+
+def make_email(rng: random.Random, tenant_id: str) -> dict[str, str]:
+    subject, body = rng.choice(TEMPLATES)
+    values = {"customer": rng.choice(CUSTOMERS), "person": rng.choice(PEOPLE), "topic": rng.choice(TOPICS)}
+    # A random word keeps the classification cache from turning every repeat into a hit.
+    salt = "".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(8))
+    return {
+        "tenant_id": tenant_id,
+        "from_address": f"{values['person'].lower()}@{values['customer'].lower()}.example",
+        "subject": subject.format(**values),
+        "body": f"{body.format(**values)} Ref {salt}",
+    }
+
+
+def percentile(sorted_values: list[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, math.ceil(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+
+def summarize(latencies: list[float], errors: int, seconds: float) -> dict[str, Any]:
+    ordered = sorted(latencies)
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "seconds": round(seconds, 4),
+        "throughput_rps": round(len(latencies) / seconds, 2) if seconds else 0.0,
+        "p50_ms": round(percentile(ordered, 50) * 1000, 3),
+        "p95_ms": round(percentile(ordered, 95) * 1000, 3),
+        "p99_ms": round(percentile(ordered, 99) * 1000, 3),
+        "max_ms": round(ordered[-1] * 1000, 3) if ordered else 0.0,
+    }
+
+
+async def run_phase(
+    requests: int, concurrency: int, operation: Callable[[int], Awaitable[Any]]
+) -> tuple[dict[str, Any], list[Any]]:
+    latencies: list[float] = []
+    results: list[Any] = [None] * requests
+    errors = 0
+    counter = iter(range(requests))
+
+    async def worker() -> None:
+        nonlocal errors
+        for index in counter:
+            started = time.perf_counter()
+            response = await operation(index)
+            latencies.append(time.perf_counter() - started)
+            if response.status_code >= 400:
+                errors += 1
+            else:
+                results[index] = response.json()
+
+    started = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(min(concurrency, requests))])
+    return summarize(latencies, errors, time.perf_counter() - started), results
+
+
+async def seed(http, rng: random.Random, tenants: list[str], emails: int, batch_size: int = 500) -> None:
+    # Background volume for the list endpoints: emails, their tasks and planned jobs.
+    for start in range(0, emails, batch_size):
+        batch = [make_email(rng, rng.choice(tenants)) for _ in range(min(batch_size, emails - start))]
+        ids = (await http.post("/emails/batch", json={"emails": batch})).raise_for_status().json()["ids"]
+        tasks = (await http.post("/tasks/from-emails", json={"email_ids": ids})).raise_for_status().json()
+        task_ids = [task["id"] for task in tasks]
+        (await http.post("/jobs/plan/batch", json={"task_ids": task_ids})).raise_for_status()
+
+
+async def run_benchmark(
+    http, seed_emails: int, requests: int, concurrency: int, tenants: int, rng_seed: int
+) -> dict[str, dict[str, Any]]:
+    rng = random.Random(rng_seed)
+    tenant_ids = [f"bench-{index}" for index in range(tenants)]
+    for tenant_id in tenant_ids:
+        settings = {"tenant_id": tenant_id, "autonomy_mode": "AUTONOMOUS", "scopes": ["Customers"], "policy": {}}
+        (await http.post("/settings", json={**settings, "kill_switch": False})).raise_for_status()
+    (await http.post("/capabilities/rescan")).raise_for_status()
+
+    started = time.perf_counter()
+    await seed(http, rng, tenant_ids, seed_emails)
+    report: dict[str, dict[str, Any]] = {
+        "seed": {"emails": seed_emails, "seconds": round(time.perf_counter() - started, 4)}
+    }
+
+    payloads = [make_email(rng, tenant_ids[index % tenants]) for index in range(requests)]
+    report["emails.create"], emails = await run_phase(
+        requests, concurrency, lambda i: http.post("/emails", json=payloads[i])
+    )
+    # Later phases only build on the requests that succeeded; failures are already counted as errors.
+    email_ids = [email["id"] for email in emails if email]
+    report["tasks.from_email"], tasks = await run_phase(
+        len(email_ids), concurrency, lambda i: http.post("/tasks/from-email", json={"email_id": email_ids[i]})
+    )
+    task_ids = [task["id"] for task in tasks if task]
+    report["jobs.plan"], _ = await run_phase(
+        len(task_ids), concurrency, lambda i: http.post(f"/jobs/plan/{task_ids[i]}")
+    )
+
+    lists = [("/emails", {"status": "triaged"}), ("/tasks", {}), ("/jobs", {})]
+
+    def list_page(i: int):
+        path, params = lists[i % len(lists)]
+        return http.get(path, params={**params, "tenant_id": tenant_ids[i % tenants], "limit": 100})
+
+    report["lists"], _ = await run_phase(requests, concurrency, list_page)
+
+    def dispatch(i: int):
+        # Every fourth request replays an earlier key, like an agent retrying after a timeout.
+        key = f"bench-{rng_seed}-{i - i % 4 if i % 4 == 3 else i}"
+        return http.post(
+            "/agent/dispatch",
+            json={
+                "tenant_id": tenant_ids[i % tenants],
+                "action_id": "customers.create",
+                "payload": {"name": rng.choice(CUSTOMERS)},
+                "on_behalf_of": "bench@example.com",
+                "idempotency_key": key,
+            },
+        )
+
+    report["agent.dispatch"], _ = await run_phase(requests, concurrency, dispatch)
+    return report
+
+
+def compare(report: dict[str, Any], baseline: dict[str, Any], max_regression: float) -> list[str]:
+    regressions = []
+    for phase, current in report["phases"].items():
+        previous = baseline.get("phases", {}).get(phase)
+        if not previous or "p95_ms" not in current:
+            continue
+        if current["p95_ms"] > previous["p95_ms"] * (1 + max_regression):
+            regressions.append(f"{phase}: p95 {previous['p95_ms']}ms -> {current['p95_ms']}ms")
+        if current["errors"] > previous["errors"]:
+            regressions.append(f"{phase}: errors {previous['errors']} -> {current['errors']}")
+    return regressions
+
+
+async def _run(args: argparse.Namespace) -> dict[str, Any]:
+    import httpx
+
+    from app.db import create_db
+    from app.main import app
+
+    create_db()
+    transport = httpx.ASGITransport(app=app) if not args.base_url else None
+    base_url = args.base_url or "http://bench"
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(transport=transport, base_url=base_url, timeout=60, limits=limits) as http:
+        phases = await run_benchmark(http, args.seed_emails, args.requests, args.concurrency, args.tenants, args.seed)
+    return {
+        "config": {
+            "seed_emails": args.seed_emails,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "tenants": args.tenants,
+            "seed": args.seed,
+            "ai_latency_ms": args.ai_latency_ms,
+            "target": args.base_url or "in-process",
+        },
+        "environment": {
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+        },
+        "phases": phases,
+    }
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the email -> task -> job pipeline.")
+    parser.add_argument("--seed-emails", type=int, default=2000)
+    parser.add_argument("--requests", type=int, default=500, help="requests per phase")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--tenants", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=42, help="random seed for generated emails")
+    parser.add_argument("--ai-latency-ms", type=float, default=20.0, help="latency of the stub AI provider")
+    parser.add_argument("--database-url", help="database for the in-process app (default: a fresh temp SQLite file)")
+    parser.add_argument(
+        "--base-url",
+        help="benchmark a running server instead of the in-process app; start it with AI_BASE_URL pointing at a stub",
+    )
+    parser.add_argument("--output", type=Path, help="write the JSON report here instead of stdout")
+    parser.add_argument("--baseline", type=Path, help="earlier JSON report to compare p95 latency and errors against")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="allowed p95 increase over the baseline")
+    args = parser.parse_args(argv)
+
+    stub = start_ai_stub(args.ai_latency_ms)
+    with tempfile.TemporaryDirectory(prefix="acp-bench-") as workdir:
+        # Configured before app modules are imported; they read the environment at import time.
+        os.environ["DATABASE_URL"] = args.database_url or f"sqlite:///{workdir}/bench.db"
+        os.environ.pop("DATABASE_READ_URL", None)
+        os.environ.pop("ASYNC_DATABASE_URL", None)
+        os.environ.pop("ASYNC_DATABASE_READ_URL", None)
+        os.environ["AI_BASE_URL"] = stub_url(stub)
+        os.environ["AI_API_KEY"] = "bench"
+        try:
+            report = asyncio.run(_run(args))
+        finally:
+            stub.shutdown()
+            stub.server_close()
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        args.output.write_text(output + "\n", encoding="utf-8")
+    else:
+        print(output)
+
+    if args.baseline:
+        regressions = compare(report, json.loads(args.baseline.read_text(encoding="utf-8")), args.max_regression)
+        for regression in regressions:
+            print(f"regression: {regression}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
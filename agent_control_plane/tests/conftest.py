@@ -0,0 +1,77 @@
+import os
+import shutil
+import tempfile
+
+import pytest
+
+# Each run gets a fresh database. app.db reads the URLs at import time, so this must happen before any app import.
+_DB_DIR = tempfile.mkdtemp(prefix="acp-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{_DB_DIR}/test.db"
+for _name in ("DATABASE_READ_URL", "ASYNC_DATABASE_URL", "ASYNC_DATABASE_READ_URL"):
+    os.environ.pop(_name, None)
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+from app.ai_client import close_ai_client  # noqa: E402
+from app.db import create_db  # noqa: E402
+from app.execution import JobEngine  # noqa: E402
+from app.main import app  # noqa: E402
+from benchmarks.pipeline import start_ai_stub  # noqa: E402
+
+
+@pytest.fixture(scope="session", autouse=True)
+def _create_tables():
+    create_db()
+    yield
+    shutil.rmtree(_DB_DIR, ignore_errors=True)
+
+
+@pytest.fixture(scope="session")
+def client():
+    return TestClient(app)
+
+
+@pytest.fixture
+def plan(client):
+    # Ingest -> triage -> plan through the API; returns the planned jobs in subject order.
+    def plan(tenant_id, subjects):
+        emails = [
+            {"tenant_id": tenant_id, "from_address": "a@example.com", "subject": subject, "body": "x"}
+            for subject in subjects
+        ]
+        email_ids = client.post("/emails/batch", json={"emails": emails}).json()["ids"]
+        task_ids = [task["id"] for task in client.post("/tasks/from-emails", json={"email_ids": email_ids}).json()]
+        return client.post("/jobs/plan/batch", json={"task_ids": task_ids}).json()
+
+    return plan
+
+
+@pytest.fixture
+def make_engine():
+    # A private engine with no background thread; tests drive it with run_once()/drain().
+    options = {"max_workers": 4, "tenant_concurrency": 2, "lease_seconds": 60, "max_attempts": 2, "poll_interval": 60}
+    engines = []
+
+    def make(**overrides):
+        engines.append(JobEngine(**{**options, **overrides}))
+        return engines[-1]
+
+    yield make
+    for engine in engines:
+        engine.shutdown()
+
+
+@pytest.fixture
+def ai_stub():
+    # The benchmark's OpenAI-compatible stub; servers and the pooled AI client are closed at teardown.
+    servers = []
+
+    def start(latency_ms=0.0, statuses=None):
+        servers.append(start_ai_stub(latency_ms, statuses))
+        return servers[-1]
+
+    yield start
+    close_ai_client()
+    for server in servers:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,44 @@
+from app import logic
+from app.ai_client import AIHTTPClient, CircuitBreaker
+from benchmarks.pipeline import stub_url
+
+
+def test_client_reuses_keep_alive_connection(ai_stub):
+    stub = ai_stub()
+    client = AIHTTPClient(stub_url(stub))
+    for _ in range(3):
+        assert client.post_json("/chat/completions", {"model": "m"}, {}) is not None
+    assert stub.RequestHandlerClass.requests == 3
+    assert len(stub.RequestHandlerClass.connections) == 1
+    assert client.connections_opened == 1
+    client.close()
+
+
+def test_client_retries_on_429_and_5xx(ai_stub):
+    stub = ai_stub(statuses=[429, 503])
+    client = AIHTTPClient(stub_url(stub), max_retries=2, backoff_base=0.001)
+    assert client.post_json("/chat/completions", {"model": "m"}, {}) is not None
+    assert stub.RequestHandlerClass.requests == 3
+    client.close()
+
+
+def test_circuit_breaker_short_circuits_after_failures(ai_stub):
+    stub = ai_stub(statuses=[500] * 4)
+    breaker = CircuitBreaker(failure_threshold=2, cooldown_seconds=60)
+    client = AIHTTPClient(stub_url(stub), max_retries=1, backoff_base=0.001, breaker=breaker)
+    assert client.post_json("/chat/completions", {"model": "m"}, {}) is None
+    assert client.post_json("/chat/completions", {"model": "m"}, {}) is None
+    assert breaker.state == "open"
+
+    assert client.post_json("/chat/completions", {"model": "m"}, {}) is None
+    assert stub.RequestHandlerClass.requests == 4
+    client.close()
+
+
+def test_ai_classification_goes_through_pooled_client(ai_stub, monkeypatch):
+    stub = ai_stub()
+    monkeypatch.setenv("AI_API_KEY", "test-key")
+    monkeypatch.setenv("AI_BASE_URL", stub_url(stub))
+    assert logic.classify_email_with_ai("Hej", "opret kunde")[0] == "create customer"
+    assert logic.classify_email_with_ai("Hej igen", "opret kunde")[0] == "create customer"
+    assert len(stub.RequestHandlerClass.connections) == 1
@@ -1,12 +1,22 @@
-from fastapi.testclient import TestClient
+import asyncio
+import json
+import threading
+import time
 
-from app.main import app
+import httpx
 
+from sqlmodel import Session, select
 
-client = TestClient(app)
+from app import cache, db, logic, main
+from app.cache import classification_cache, manifest_cache
+from app.idempotency import idempotency_store
+from app.main import app
+from app.models import AutonomyMode, CapabilitySnapshot, DispatchIdempotency, RiskLevel, Settings, Task
+from app.rules import RuleEngine
+from app.settings_cache import tenant_settings
 
 
-def test_email_to_task_to_job_flow():
+def test_email_to_task_to_job_flow(client):
     email = client.post(
         "/emails",
         json={
@@ -28,7 +38,7 @@ def test_email_to_task_to_job_flow():
     assert job.json()["status"] in {"planned", "executing", "requires_approval"}
 
 
-def test_settings_store_outlook_and_manual_login_constraint():
+def test_settings_store_outlook_and_manual_login_constraint(client):
     response = client.post(
         "/settings",
         json={
@@ -49,32 +59,39 @@ def test_settings_store_outlook_and_manual_login_constraint():
     assert read_back.json()["require_manual_learnalyze_login"] is True
 
 
-def test_webapp_root_is_served():
+def test_webapp_root_is_served(client):
     response = client.get("/")
     assert response.status_code == 200
     assert "ARX Agent Control Plane" in response.text
 
 
-def test_capability_insights_endpoint():
+def test_capability_insights_endpoint(client):
     bootstrap = client.get("/capabilities/insights")
     assert bootstrap.status_code == 200
     assert bootstrap.json()["total_snapshots"] >= 0
 
-    client.post("/capabilities/rescan")
+    # A manifest no earlier snapshot can match, so the rescan is never deduplicated away.
+    page = {"id": f"insights-{time.time_ns()}", "actions": [{"id": "insights.check", "risk": "low"}]}
+    assert client.post("/capabilities/rescan", json={"pages": [page]}).json()["deduplicated"] is False
     after = client.get("/capabilities/insights")
     assert after.status_code == 200
-    assert after.json()["total_snapshots"] >= 1
-    assert "learned_actions" in after.json()
+    assert after.json()["total_snapshots"] == bootstrap.json()["total_snapshots"] + 1
+    assert after.json()["learned_pages"] == 1
+    assert after.json()["learned_actions"] == 1
+    assert after.json()["recent_versions"][0] == after.json()["latest_version"]
 
+    assert client.post("/capabilities/rescan", json={"pages": [page]}).json()["deduplicated"] is True
+    assert client.get("/capabilities/insights").json()["total_snapshots"] == after.json()["total_snapshots"]
 
-def test_learnalyze_embed_is_not_used():
+
+def test_learnalyze_embed_is_not_used(client):
     response = client.get("/")
     assert response.status_code == 200
     assert "Open LearnAlyze directly" in response.text
     assert "<iframe" not in response.text
 
 
-def test_ai_integration_status_endpoint():
+def test_ai_integration_status_endpoint(client):
     response = client.get("/ai/integration/status")
     assert response.status_code == 200
     payload = response.json()
@@ -84,7 +101,7 @@ def test_ai_integration_status_endpoint():
     assert payload["setup"]["required_env"] == ["AI_API_KEY"]
 
 
-def test_task_creation_works_without_ai_key(monkeypatch):
+def test_task_creation_works_without_ai_key(monkeypatch, client):
     monkeypatch.delenv("AI_API_KEY", raising=False)
     email = client.post(
         "/emails",
@@ -100,3 +117,673 @@ def test_task_creation_works_without_ai_key(monkeypatch):
     task = client.post("/tasks/from-email", json={"email_id": email.json()["id"]})
     assert task.status_code == 200
     assert task.json()["intent"]
+
+
+def test_email_batch_ingestion_returns_ids_and_audits(client):
+    emails = [
+        {
+            "tenant_id": "tenant-batch",
+            "from_address": f"sender{i}@example.com",
+            "subject": f"Faktura {i}",
+            "body": "invoice reminder",
+        }
+        for i in range(3)
+    ]
+    response = client.post("/emails/batch", json={"emails": emails})
+    assert response.status_code == 200
+    payload = response.json()
+    assert payload["count"] == 3
+    assert payload["ids"] == sorted(payload["ids"])
+
+    listed = client.get("/emails", params={"tenant_id": "tenant-batch"})
+    assert {item["id"] for item in listed.json()} >= set(payload["ids"])
+
+
+def test_email_ndjson_ingestion(client):
+    lines = [
+        json.dumps(
+            {
+                "tenant_id": "tenant-ndjson",
+                "from_address": "ops@example.com",
+                "subject": f"Email {i}",
+                "body": "body",
+            }
+        )
+        for i in range(4)
+    ]
+    response = client.post(
+        "/emails/ndjson",
+        content="\n".join(lines) + "\n",
+        headers={"Content-Type": "application/x-ndjson"},
+    )
+    assert response.status_code == 200
+    assert response.json()["count"] == 4
+
+    rejected = json.dumps(
+        {"tenant_id": "tenant-ndjson-rejected", "from_address": "a@example.com", "subject": "s", "body": "b"}
+    )
+    invalid = client.post("/emails/ndjson", content=rejected + "\n{\"tenant_id\": \"x\"}\n")
+    assert invalid.status_code == 422
+    assert invalid.json()["detail"]["line"] == 2
+    # Nothing is written until the whole body has validated.
+    assert client.get("/emails", params={"tenant_id": "tenant-ndjson-rejected"}).json() == []
+
+
+def test_email_bulk_ingest_is_capped(monkeypatch, client):
+    email = {"tenant_id": "tenant-capped", "from_address": "a@example.com", "subject": "s", "body": "b"}
+    assert client.post("/emails/batch", json={"emails": [email] * 10001}).status_code == 422
+
+    monkeypatch.setattr(main, "INGEST_MAX_LINES", 2)
+    too_many = client.post("/emails/ndjson", content="\n".join([json.dumps(email)] * 3))
+    assert too_many.status_code == 413 and too_many.json()["detail"] == "too_many_lines"
+    monkeypatch.setattr(main, "INGEST_MAX_BYTES", 64)
+    too_large = client.post("/emails/ndjson", content=json.dumps(email) + "\n" + json.dumps(email))
+    assert too_large.status_code == 413 and too_large.json()["detail"] == "body_too_large"
+    assert client.get("/emails", params={"tenant_id": "tenant-capped"}).json() == []
+
+
+def test_list_endpoints_use_keyset_pagination(client):
+    emails = [
+        {"tenant_id": "tenant-page", "from_address": "a@example.com", "subject": f"S{i}", "body": "b"}
+        for i in range(5)
+    ]
+    ids = client.post("/emails/batch", json={"emails": emails}).json()["ids"]
+
+    first = client.get("/emails", params={"tenant_id": "tenant-page", "limit": 2})
+    assert first.status_code == 200
+    assert len(first.json()) == 2
+    cursor = first.headers["X-Next-Cursor"]
+
+    seen = [item["id"] for item in first.json()]
+    while cursor:
+        page = client.get("/emails", params={"tenant_id": "tenant-page", "limit": 2, "cursor": cursor})
+        seen.extend(item["id"] for item in page.json())
+        cursor = page.headers.get("X-Next-Cursor")
+    assert seen == sorted(ids, reverse=True)
+
+    bad = client.get("/jobs", params={"cursor": "not-a-cursor"})
+    assert bad.status_code == 400
+
+
+def test_audit_search_uses_indexed_filters(client):
+    client.post(
+        "/emails",
+        json={
+            "tenant_id": "tenant-audit",
+            "from_address": "compliance@example.com",
+            "subject": "Kvartalsrapport revisionsspor",
+            "body": "body",
+        },
+    )
+    client.post(
+        "/emails",
+        json={
+            "tenant_id": "tenant-audit-other",
+            "from_address": "compliance@example.com",
+            "subject": "Kvartalsrapport revisionsspor",
+            "body": "body",
+        },
+    )
+
+    ranked = client.get("/audit/search", params={"q": "kvartalsrapport", "tenant_id": "tenant-audit"})
+    assert ranked.status_code == 200
+    assert [row["tenant_id"] for row in ranked.json()] == ["tenant-audit"]
+    assert ranked.json()[0]["event_type"] == "email_ingested"
+
+    prefix = client.get("/audit", params={"query": "revisionssp", "event_type": "email_ingested"})
+    assert {row["tenant_id"] for row in prefix.json()} == {"tenant-audit", "tenant-audit-other"}
+
+    future = client.get("/audit", params={"query": "kvartalsrapport", "since": "2999-01-01T00:00:00"})
+    assert future.json() == []
+
+
+def test_async_classification_returns_pending_task(monkeypatch, client):
+    release = threading.Event()
+
+    def slow_ai(subject, body):
+        release.wait(timeout=5)
+        return "invoice follow-up", "AI says invoice", 0.91, logic.RiskLevel.medium
+
+    monkeypatch.setenv("AI_API_KEY", "test-key")
+    monkeypatch.setattr(logic, "classify_email_with_ai", slow_ai)
+    email = client.post(
+        "/emails",
+        json={"tenant_id": "tenant-async", "from_address": "a@example.com", "subject": "Faktura", "body": "b"},
+    )
+
+    task = client.post("/tasks/from-email", json={"email_id": email.json()["id"], "async_classification": True})
+    assert task.status_code == 200
+    assert task.json()["status"] == "classifying"
+
+    release.set()
+    for _ in range(100):
+        tasks = client.get("/tasks", params={"tenant_id": "tenant-async"}).json()
+        if tasks[0]["status"] == "proposed":
+            break
+        time.sleep(0.02)
+    assert tasks[0]["status"] == "proposed"
+    assert tasks[0]["intent"] == "invoice follow-up"
+    assert tasks[0]["risk"] == "medium"
+
+
+def test_failed_deferred_classification_falls_back_to_rules(monkeypatch, client):
+    def broken_triage(subject, body, tenant_id=None):
+        raise RuntimeError("classifier crashed")
+
+    monkeypatch.setenv("AI_API_KEY", "test-key")
+    monkeypatch.setattr(logic, "triage_email", broken_triage)
+    email = client.post(
+        "/emails",
+        json={"tenant_id": "tenant-async-fail", "from_address": "a@example.com", "subject": "Faktura", "body": "b"},
+    )
+    task = client.post("/tasks/from-email", json={"email_id": email.json()["id"], "async_classification": True})
+    assert task.json()["status"] == "classifying"
+
+    for _ in range(100):
+        tasks = client.get("/tasks", params={"tenant_id": "tenant-async-fail"}).json()
+        if tasks[0]["status"] == "proposed":
+            break
+        time.sleep(0.02)
+    assert tasks[0]["status"] == "proposed"
+    assert tasks[0]["intent"] == "invoice follow-up"
+
+
+def test_startup_requeues_tasks_left_classifying(monkeypatch, client):
+    monkeypatch.delenv("AI_API_KEY", raising=False)
+    email_id = client.post(
+        "/emails",
+        json={"tenant_id": "tenant-requeue", "from_address": "a@example.com", "subject": "Opret kunde", "body": "b"},
+    ).json()["id"]
+    with Session(db.engine) as session:
+        stranded = Task(email_id=email_id, tenant_id="tenant-requeue", intent="pending", confidence=0.0, why="")
+        stranded.status = "classifying"
+        session.add(stranded)
+        session.commit()
+
+    assert logic.requeue_pending_classifications() >= 1
+    for _ in range(100):
+        tasks = client.get("/tasks", params={"tenant_id": "tenant-requeue"}).json()
+        if tasks[0]["status"] == "proposed":
+            break
+        time.sleep(0.02)
+    assert tasks[0]["intent"] == "create customer"
+
+
+def test_classification_cache_skips_repeat_ai_calls(monkeypatch, client):
+    calls = []
+
+    def fake_ai(subject, body):
+        calls.append(subject)
+        return "invoice follow-up", "AI says invoice", 0.9, logic.RiskLevel.medium
+
+    monkeypatch.setenv("AI_API_KEY", "test-key")
+    monkeypatch.setattr(logic, "classify_email_with_ai", fake_ai)
+    monkeypatch.setattr(classification_cache, "persist", True)
+    classification_cache.clear()
+
+    for invoice_no in (1001, 1002):
+        email = client.post(
+            "/emails",
+            json={
+                "tenant_id": "tenant-cache",
+                "from_address": "billing@example.com",
+                "subject": f"Reminder: invoice {invoice_no}",
+                "body": "Your  invoice is overdue.",
+            },
+        )
+        task = client.post("/tasks/from-email", json={"email_id": email.json()["id"]})
+        assert task.json()["intent"] == "invoice follow-up"
+    assert len(calls) == 1
+
+    classification_cache.clear()
+    assert logic.triage_email("Reminder: invoice 1003", "Your invoice is overdue.")[0] == "invoice follow-up"
+    assert len(calls) == 1
+
+    stats = client.get("/ai/integration/status").json()["classification_cache"]
+    assert stats["hits"] >= 2
+    assert stats["persistent_hits"] >= 1
+
+
+def test_bulk_task_creation_batches_ai_and_falls_back_per_item(monkeypatch, client):
+    prompts = []
+
+    def fake_completion(system_prompt, user_content):
+        prompts.append(user_content)
+        # Only the first email gets a parseable result; the second must fall back to rules.
+        return '```json\n[{"index": 0, "intent": "create customer", "why": "AI", "confidence": 0.97, "risk": "low"}]\n```'
+
+    monkeypatch.setenv("AI_API_KEY", "test-key")
+    monkeypatch.setattr(logic, "_chat_completion", fake_completion)
+    classification_cache.clear()
+
+    emails = [
+        {"tenant_id": "tenant-bulk", "from_address": "a@example.com", "subject": "Velkommen ny kunde 77", "body": "x"},
+        {"tenant_id": "tenant-bulk", "from_address": "b@example.com", "subject": "Slet projekt 88", "body": "y"},
+    ]
+    ids = client.post("/emails/batch", json={"emails": emails}).json()["ids"]
+
+    response = client.post("/tasks/from-emails", json={"email_ids": ids})
+    assert response.status_code == 200
+    tasks = response.json()
+    assert len(prompts) == 1
+    assert [task["email_id"] for task in tasks] == ids
+    assert tasks[0]["intent"] == "create customer"
+    assert tasks[1]["intent"] == "dangerous change"
+
+    missing = client.post("/tasks/from-emails", json={"email_ids": [ids[0], 10**9]})
+    assert missing.status_code == 404
+
+
+def test_tenant_classification_rules_take_priority(monkeypatch, client):
+    monkeypatch.delenv("AI_API_KEY", raising=False)
+    created = client.post(
+        "/classifier/rules",
+        json={
+            "rules": [
+                {
+                    "tenant_id": "tenant-rules",
+                    "kind": "regex",
+                    "patterns": [r"\bcvr[- ]?\d{8}\b"],
+                    "intent": "cvr lookup",
+                    "confidence": 0.9,
+                    "priority": 100,
+                },
+                {
+                    "tenant_id": "tenant-rules",
+                    "patterns": ["Tilbud", "quote request"],
+                    "intent": "prepare quote",
+                    "risk": "medium",
+                    "priority": 5,
+                },
+            ]
+        },
+    )
+    assert created.status_code == 200
+    assert len(created.json()) == 3
+
+    def triage(tenant_id, subject):
+        email = client.post(
+            "/emails",
+            json={"tenant_id": tenant_id, "from_address": "a@example.com", "subject": subject, "body": "opret kunde"},
+        )
+        return client.post("/tasks/from-email", json={"email_id": email.json()["id"]}).json()
+
+    assert triage("tenant-rules", "CVR 12345678")["intent"] == "cvr lookup"
+    assert triage("tenant-rules", "Nyt tilbud")["intent"] == "create customer"
+    assert triage("tenant-other", "CVR 12345678")["intent"] == "create customer"
+    assert logic.classify_emails([("tilbud", ""), ("hej", "")], "tenant-rules")[0][0] == "prepare quote"
+
+    invalid = client.post("/classifier/rules", json={"rules": [{"kind": "regex", "patterns": ["("], "intent": "x"}]})
+    assert invalid.status_code == 422
+
+    rule_id = created.json()[0]["id"]
+    assert client.delete(f"/classifier/rules/{rule_id}").status_code == 200
+    assert triage("tenant-rules", "CVR 12345678")["intent"] == "create customer"
+
+
+def test_overlapping_regex_rules_resolve_by_priority(client):
+    engine = RuleEngine(
+        [
+            {"kind": "regex", "patterns": ["invoice"], "intent": "generic", "priority": 1},
+            {"kind": "regex", "patterns": [r"invoice \d+ overdue"], "intent": "overdue", "priority": 100},
+        ]
+    )
+    assert engine.classify("invoice 12 overdue", "")[0] == "overdue"
+    assert engine.classify("invoice 12", "")[0] == "generic"
+
+    for pattern in [r"(a)\1", r"(?P<n>a)", r"(a)(?(1)b|c)"]:
+        rule = {"tenant_id": "tenant-rules", "kind": "regex", "patterns": [pattern], "intent": "x"}
+        assert client.post("/classifier/rules", json={"rules": [rule]}).status_code == 422
+
+
+def test_batch_job_planning_creates_steps_and_approvals(monkeypatch, client):
+    monkeypatch.delenv("AI_API_KEY", raising=False)
+    emails = [
+        {"tenant_id": "tenant-plan", "from_address": "a@example.com", "subject": "Opret kunde", "body": "x"},
+        {"tenant_id": "tenant-plan", "from_address": "a@example.com", "subject": "Slet alt", "body": "y"},
+    ]
+    email_ids = client.post("/emails/batch", json={"emails": emails}).json()["ids"]
+    task_ids = [task["id"] for task in client.post("/tasks/from-emails", json={"email_ids": email_ids}).json()]
+
+    response = client.post("/jobs/plan/batch", json={"task_ids": task_ids})
+    assert response.status_code == 200
+    jobs = response.json()
+    assert [job["task_id"] for job in jobs] == task_ids
+    assert [job["status"] for job in jobs] == ["executing", "requires_approval"]
+
+    audit = client.get("/audit", params={"tenant_id": "tenant-plan", "event_type": "job_planned"}).json()
+    assert {row["entity_id"] for row in audit} == {str(job["id"]) for job in jobs}
+
+    assert client.post("/jobs/plan/batch", json={"task_ids": [10**9]}).status_code == 404
+
+
+def test_pipeline_honors_autonomy_mode_and_kill_switch(monkeypatch, client):
+    monkeypatch.delenv("AI_API_KEY", raising=False)
+    for tenant_id, mode, kill_switch in [
+        ("pipe-off", "OFF", False),
+        ("pipe-supervised", "SUPERVISED", False),
+        ("pipe-autonomous", "AUTONOMOUS", False),
+        ("pipe-killed", "AUTONOMOUS", True),
+    ]:
+        client.post(
+            "/settings",
+            json={"tenant_id": tenant_id, "autonomy_mode": mode, "scopes": [], "kill_switch": kill_switch, "policy": {}},
+        )
+    emails = [
+        {"tenant_id": tenant_id, "from_address": "a@example.com", "subject": "Opret kunde", "body": "x"}
+        for tenant_id in ["pipe-off", "pipe-supervised", "pipe-autonomous", "pipe-killed"]
+    ]
+
+    response = client.post("/pipeline/emails", json={"emails": emails})
+    assert response.status_code == 200
+    results = response.json()
+    assert [r["stage"] for r in results] == ["triaged", "planned", "planned", "ingested"]
+    assert [r["job_status"] for r in results] == [None, "requires_approval", "executing", None]
+    assert results[0]["task_id"] and results[3]["task_id"] is None
+
+    tasks = client.get("/tasks", params={"tenant_id": "pipe-off"}).json()
+    assert [task["status"] for task in tasks] == ["proposed"]
+    jobs = client.get("/jobs", params={"tenant_id": "pipe-supervised"}).json()
+    assert jobs[0]["id"] == results[1]["job_id"]
+
+
+def test_pipeline_persists_ai_classifications_without_holding_the_write_lock(monkeypatch, client):
+    def fake_completion(system_prompt, user_content):
+        item = {"intent": "invoice follow-up", "why": "AI", "confidence": 0.9, "risk": "low"}
+        return json.dumps([{"index": index, **item} for index in (0, 1)])
+
+    monkeypatch.setenv("AI_API_KEY", "test-key")
+    monkeypatch.setattr(logic, "_chat_completion", fake_completion)
+    monkeypatch.setattr(classification_cache, "persist", True)
+    classification_cache.clear()
+    emails = [
+        {"tenant_id": "pipe-cache", "from_address": "a@example.com", "subject": f"Invoice {region}", "body": "x"}
+        for region in ("north", "south")
+    ]
+
+    response = client.post("/pipeline/emails", json={"emails": emails})
+    assert response.status_code == 200
+    assert [result["intent"] for result in response.json()] == ["invoice follow-up"] * 2
+    assert classification_cache.stats()["size"] >= 2
+    classification_cache.clear()
+
+
+def test_settings_cache_is_invalidated_on_update_and_enforces_kill_switch(client):
+    settings = {
+        "tenant_id": "tenant-kill",
+        "autonomy_mode": "AUTONOMOUS",
+        "scopes": ["Customers"],
+        "kill_switch": False,
+        "policy": {"max_bulk_updates": 5},
+    }
+    dispatch = {
+        "tenant_id": "tenant-kill",
+        "action_id": "customers.create",
+        "payload": {"name": "Acme"},
+        "on_behalf_of": "ops@example.com",
+        "idempotency_key": "kill-1",
+    }
+    created = client.post("/settings", json=settings)
+    assert created.status_code == 200
+    client.post("/capabilities/rescan")
+    assert client.post("/agent/dispatch", json=dispatch).status_code == 200
+
+    with Session(db.engine) as session:
+        cached = tenant_settings.get(session, "tenant-kill")
+    assert cached.autonomy_mode == AutonomyMode.autonomous
+    assert cached.version == created.json()["version"]
+    assert cached.policy.max_bulk_updates == 5
+
+    updated = client.post("/settings", json={**settings, "kill_switch": True})
+    assert updated.json()["version"] == created.json()["version"] + 1
+    blocked = client.post("/agent/dispatch", json={**dispatch, "idempotency_key": "kill-2"})
+    assert blocked.status_code == 423
+
+
+def test_settings_cache_detects_version_bump_from_another_worker(monkeypatch, client):
+    client.post(
+        "/settings",
+        json={"tenant_id": "tenant-stale", "autonomy_mode": "OFF", "scopes": [], "kill_switch": False, "policy": {}},
+    )
+    monkeypatch.setattr(tenant_settings, "check_interval", 0)
+    with Session(db.engine) as session:
+        assert tenant_settings.get(session, "tenant-stale").kill_switch is False
+        row = session.exec(select(Settings).where(Settings.tenant_id == "tenant-stale")).one()
+        row.kill_switch = True
+        row.version += 1
+        session.add(row)
+        session.commit()
+        assert tenant_settings.get(session, "tenant-stale").kill_switch is True
+
+
+def test_dispatch_validates_actions_and_replays_idempotent_requests(client):
+    client.post("/capabilities/rescan")
+    for tenant_id, scopes in [("tenant-idem", ["Customers"]), ("tenant-noscope", ["Invoices"])]:
+        client.post(
+            "/settings",
+            json={"tenant_id": tenant_id, "autonomy_mode": "AUTONOMOUS", "scopes": scopes, "kill_switch": False, "policy": {}},
+        )
+    dispatch = {
+        "tenant_id": "tenant-idem",
+        "action_id": "customers.create",
+        "payload": {"name": "Acme"},
+        "on_behalf_of": "ops@example.com",
+        "idempotency_key": "idem-1",
+    }
+
+    first = client.post("/agent/dispatch", json=dispatch)
+    assert first.status_code == 200
+    assert first.json()["risk"] == "low"
+    assert "Idempotent-Replayed" not in first.headers
+
+    idempotency_store.clear()
+    replay = client.post("/agent/dispatch", json=dispatch)
+    assert replay.json() == first.json()
+    assert replay.headers["Idempotent-Replayed"] == "true"
+    assert client.post("/agent/dispatch", json=dispatch).headers["Idempotent-Replayed"] == "true"
+    audit = client.get("/audit", params={"tenant_id": "tenant-idem", "event_type": "dispatch_called"}).json()
+    assert len(audit) == 1
+
+    conflict = client.post("/agent/dispatch", json={**dispatch, "payload": {"name": "Other"}})
+    assert conflict.status_code == 409
+    unknown = client.post("/agent/dispatch", json={**dispatch, "action_id": "customers.nuke", "idempotency_key": "idem-2"})
+    assert unknown.status_code == 404
+    denied = client.post("/agent/dispatch", json={**dispatch, "tenant_id": "tenant-noscope"})
+    assert denied.status_code == 403
+
+    with Session(db.engine) as session:
+        row = session.exec(select(DispatchIdempotency).where(DispatchIdempotency.idempotency_key == "idem-1")).one()
+        row.expires_at = row.created_at
+        session.add(row)
+        session.commit()
+        idempotency_store.clear()
+        assert idempotency_store.purge_expired(session) >= 1
+    assert "Idempotent-Replayed" not in client.post("/agent/dispatch", json=dispatch).headers
+
+
+def test_dispatch_without_tenant_only_runs_ungated_low_risk_actions(client):
+    actions = [
+        {"id": "notes.read", "risk": "low", "required_permissions": []},
+        {"id": "notes.purge", "risk": "high", "required_permissions": []},
+        {"id": "customers.create", "risk": "low", "required_permissions": ["customers:write"]},
+    ]
+    client.post("/capabilities/rescan", json={"pages": [{"id": "notes", "actions": actions}]})
+    dispatch = {"payload": {}, "on_behalf_of": "ops@example.com"}
+
+    statuses = [
+        client.post("/agent/dispatch", json={**dispatch, "action_id": action["id"], "idempotency_key": action["id"]})
+        for action in actions
+    ]
+    assert [response.status_code for response in statuses] == [200, 403, 403]
+    assert statuses[1].json()["detail"] == "tenant_required"
+    client.post("/capabilities/rescan")
+
+
+def test_async_dispatch_loads_manifests_and_purges_off_the_event_loop(monkeypatch, client):
+    settings = {
+        "tenant_id": "tenant-offloop",
+        "autonomy_mode": "AUTONOMOUS",
+        "scopes": ["Customers"],
+        "kill_switch": False,
+        "policy": {},
+    }
+    client.post("/settings", json=settings)
+    client.post("/capabilities/rescan")
+    manifest_cache.invalidate()
+    threads = []
+
+    def tracked(work):
+        def run(*args):
+            threads.append(threading.get_ident())
+            return work(*args)
+        return run
+
+    monkeypatch.setattr(cache, "load_manifest", tracked(cache.load_manifest))
+    monkeypatch.setattr(idempotency_store, "purge_expired", tracked(idempotency_store.purge_expired))
+    monkeypatch.setattr(idempotency_store, "_last_purge", 0.0)
+    dispatch = {
+        "tenant_id": "tenant-offloop",
+        "action_id": "customers.create",
+        "payload": {},
+        "on_behalf_of": "ops@example.com",
+        "idempotency_key": "offloop-1",
+    }
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+            return threading.get_ident(), await http.post("/agent/dispatch", json=dispatch)
+
+    loop_thread, response = asyncio.run(scenario())
+    assert response.status_code == 200
+    assert len(threads) == 2 and loop_thread not in threads
+
+
+def test_async_hot_endpoints_handle_concurrent_requests(monkeypatch, client):
+    monkeypatch.delenv("AI_API_KEY", raising=False)
+    client.post("/capabilities/rescan")
+    email = {"tenant_id": "tenant-async", "from_address": "a@example.com", "subject": "Opret kunde", "body": "x"}
+    dispatch = {
+        "tenant_id": "tenant-async",
+        "action_id": "customers.create",
+        "payload": {"name": "Acme"},
+        "on_behalf_of": "ops@example.com",
+    }
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+            emails = await asyncio.gather(*[http.post("/emails", json=email) for _ in range(10)])
+            tasks = await asyncio.gather(
+                *[http.post("/tasks/from-email", json={"email_id": r.json()["id"]}) for r in emails]
+            )
+            dispatches = await asyncio.gather(
+                *[http.post("/agent/dispatch", json={**dispatch, "idempotency_key": f"async-{i % 3}"}) for i in range(12)]
+            )
+            listed = await http.get("/emails", params={"tenant_id": "tenant-async", "status": "triaged", "limit": 5})
+            return emails, tasks, dispatches, listed
+
+    emails, tasks, dispatches, listed = asyncio.run(scenario())
+    assert {r.status_code for r in emails + tasks + dispatches} == {200}
+    assert {task.json()["intent"] for task in tasks} == {"create customer"}
+    assert sum(1 for r in dispatches if "Idempotent-Replayed" not in r.headers) == 3
+    assert len(listed.json()) == 5 and listed.headers["X-Next-Cursor"]
+
+
+def test_manifest_is_served_with_etag_and_conditional_get(client):
+    client.post("/capabilities/rescan")
+    first = client.get("/capabilities/latest")
+    assert first.status_code == 200
+    etag = first.headers["ETag"]
+    assert first.json()["pages"][0]["id"] == "customers"
+
+    cached = client.get("/agent/manifest", headers={"If-None-Match": etag})
+    assert cached.status_code == 304
+    assert cached.headers["ETag"] == etag
+    assert cached.content == b""
+
+    assert client.post("/capabilities/rescan").json()["deduplicated"] is True
+    assert client.get("/capabilities/latest", headers={"If-None-Match": etag}).status_code == 304
+
+    client.post("/capabilities/rescan", json={"pages": [{"id": "projects", "actions": []}]})
+    changed = client.get("/capabilities/latest", headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.headers["ETag"] != etag
+
+
+def _pages(*actions):
+    return [
+        {"id": "customers", "route": "/customers", "actions": [{"id": action, "risk": "low"} for action in actions]},
+        {"id": "invoices", "route": "/invoices", "actions": []},
+    ]
+
+
+def test_capability_snapshots_are_deduplicated_and_delta_encoded(client):
+    first = client.post("/capabilities/rescan", json={"pages": _pages("customers.create")}).json()
+    again = client.post("/capabilities/rescan", json={"pages": _pages("customers.create")}).json()
+    assert again == {**first, "deduplicated": True}
+
+    second = client.post("/capabilities/rescan", json={"pages": _pages("customers.create", "customers.delete")}).json()
+    assert second["deduplicated"] is False
+    assert second["version"] != first["version"]
+
+    with Session(db.engine) as session:
+        stored = session.exec(select(CapabilitySnapshot).where(CapabilitySnapshot.version == second["version"])).one()
+        assert stored.encoding == "zlib-delta"
+        assert stored.manifest_json == ""
+
+    latest = client.get("/capabilities/latest").json()
+    assert [action["id"] for action in latest["pages"][0]["actions"]] == ["customers.create", "customers.delete"]
+
+    diff = client.get("/capabilities/diff", params={"from": first["version"], "to": second["version"]}).json()
+    assert diff["changed"] is True
+    customers = dict(diff["diff"]["$sub"]["pages"]["$sub"])["customers"]
+    assert customers["$sub"]["actions"]["$new"] == [{"id": "customers.delete", "risk": "low"}]
+
+    assert client.get("/capabilities/diff", params={"from": "nope", "to": second["version"]}).status_code == 404
+
+
+def test_capability_compaction_keeps_latest_and_rebases_deltas(client):
+    versions = [
+        client.post("/capabilities/rescan", json={"pages": _pages(*[f"a{i}" for i in range(n)])}).json()["version"]
+        for n in range(1, 4)
+    ]
+    result = client.post("/capabilities/compact", params={"keep_latest": 2, "max_age_days": 0})
+    assert result.status_code == 200
+    assert result.json()["remaining"] == 2
+
+    insights = client.get("/capabilities/insights").json()
+    assert insights["total_snapshots"] == 2
+    assert insights["latest_version"] == versions[-1]
+    latest = client.get("/capabilities/latest").json()
+    assert [action["id"] for action in latest["pages"][0]["actions"]] == ["a0", "a1", "a2"]
+    diff = client.get("/capabilities/diff", params={"from": versions[1], "to": versions[2]})
+    assert diff.json()["changed"] is True
+
+
+def test_tenant_policy_gates_destructive_and_bulk_jobs(client):
+    def plan(policy):
+        settings = {
+            "tenant_id": "tenant-policy",
+            "autonomy_mode": "AUTONOMOUS",
+            "scopes": [],
+            "kill_switch": False,
+            "policy": policy,
+        }
+        assert client.post("/settings", json=settings).status_code == 200
+        with Session(db.engine) as session:
+            tasks = [
+                Task(tenant_id="tenant-policy", intent=intent, confidence=0.9, why="", risk=RiskLevel.low)
+                for intent in ("delete customer", "create customer", "create customer")
+            ]
+            session.add_all(tasks)
+            session.flush()
+            jobs = [job.status for job in logic.plan_jobs(session, tasks)]
+            session.rollback()
+        return jobs
+
+    assert plan({"no_delete_without_approval": True}) == ["requires_approval", "executing", "executing"]
+    assert plan({"no_delete_without_approval": False}) == ["executing"] * 3
+    assert plan({"no_delete_without_approval": False, "max_bulk_updates": 2}) == ["executing"] * 2 + [
+        "requires_approval"
+    ]
@@ -0,0 +1,84 @@
+import gzip
+import json
+from datetime import datetime, timedelta
+
+from sqlmodel import Session, select
+
+from app import db, logic, main
+from app.archive import AuditArchive
+from app.models import AuditLog
+
+
+def _insert(rows):
+    with Session(db.engine) as session:
+        for tenant_id, event_type, entity_id, created_at in rows:
+            payload = json.dumps({"note": f"{event_type} for {entity_id}"})
+            session.add(
+                AuditLog(
+                    tenant_id=tenant_id,
+                    event_type=event_type,
+                    entity_id=entity_id,
+                    payload_json=payload,
+                    created_at=created_at,
+                )
+            )
+        session.commit()
+
+
+def test_archive_rolls_old_rows_into_segments_and_audit_reads_them(monkeypatch, tmp_path, client):
+    archive = AuditArchive(str(tmp_path), retention_days=30, batch_size=2, interval=0)
+    monkeypatch.setattr(logic, "audit_archive", archive)
+    monkeypatch.setattr(main, "audit_archive", archive)
+    now = datetime.utcnow()
+    old = now - timedelta(days=400)
+    _insert(
+        [
+            ("tenant/arch", "job_planned", "1", old),
+            ("tenant/arch", "job_aborted", "1", old + timedelta(hours=1)),
+            ("tenant/arch", "job_planned", "2", old + timedelta(days=1)),
+            ("tenant-arch-other", "job_planned", "9", old),
+            ("tenant/arch", "job_planned", "3", now),
+        ]
+    )
+
+    result = client.post("/audit/archive", params={"older_than_days": 30}).json()
+    assert result["archived"] == 4
+    with Session(db.engine) as session:
+        left = session.exec(select(AuditLog).where(AuditLog.tenant_id.in_(["tenant/arch", "tenant-arch-other"]))).all()
+    assert [row.entity_id for row in left] == ["3"]
+
+    tenant_dir = tmp_path / "tenant%2Farch"
+    days = sorted(path.name for path in tenant_dir.iterdir())
+    assert days == [old.date().isoformat(), (old + timedelta(days=1)).date().isoformat()]
+    # batch_size=2 splits the first day over two runs of the loop, so it gets two append-only segments.
+    indexes = [json.loads(path.read_text(encoding="utf-8")) for path in (tenant_dir / days[0]).glob("*.index.json")]
+    indexes.sort(key=lambda index: index["min_id"])
+    assert [index["count"] for index in indexes] == [1, 1]
+    assert [index["event_types"] for index in indexes] == [["job_planned"], ["job_aborted"]]
+    for index in indexes:
+        segment = (tenant_dir / days[0] / index["segment"]).read_bytes()
+        [line] = gzip.decompress(segment).decode("utf-8").splitlines()
+        assert json.loads(line)["id"] == index["min_id"] == index["max_id"]
+
+    params = {"tenant_id": "tenant/arch", "since": (old - timedelta(days=1)).isoformat()}
+    rows = client.get("/audit", params=params).json()
+    assert [row["entity_id"] for row in rows] == ["3", "2", "1", "1"]
+    assert client.get("/audit", params={"tenant_id": "tenant/arch"}).json()[0]["entity_id"] == "3"
+    assert len(client.get("/audit", params={"tenant_id": "tenant/arch"}).json()) == 1
+
+    first = client.get("/audit", params={**params, "limit": 2})
+    assert [row["entity_id"] for row in first.json()] == ["3", "2"]
+    second = client.get("/audit", params={**params, "limit": 2, "cursor": first.headers["X-Next-Cursor"]})
+    assert [row["event_type"] for row in second.json()] == ["job_aborted", "job_planned"]
+    assert "X-Next-Cursor" not in second.headers
+
+    aborted = client.get("/audit", params={**params, "event_type": "job_aborted"}).json()
+    assert [row["entity_id"] for row in aborted] == ["1"]
+    matched = client.get("/audit", params={**params, "query": "JOB_PLANNED for 2"}).json()
+    assert [row["entity_id"] for row in matched] == ["2"]
+    recent = client.get("/audit", params={**params, "until": (old + timedelta(hours=12)).isoformat()}).json()
+    assert [row["entity_id"] for row in recent] == ["1", "1"]
+
+    status = client.get("/audit/archive", params={"tenant_id": "tenant-arch-other"}).json()
+    assert status["archived"] == 4 and [segment["count"] for segment in status["segments"]] == [1]
+    assert "path" not in status["segments"][0]
@@ -0,0 +1,91 @@
+import asyncio
+import time
+
+from sqlmodel import Session, select
+
+from app import db
+from app.audit import AuditSink
+from app.models import AuditLog
+
+
+def _count(tenant_id):
+    with Session(db.engine) as session:
+        return len(session.exec(select(AuditLog).where(AuditLog.tenant_id == tenant_id)).all())
+
+
+def test_buffered_sink_writes_after_commit_in_batches():
+    sink = AuditSink(mode="buffered", flush_size=100, flush_interval=60)
+    with Session(db.engine) as session:
+        for index in range(3):
+            sink.record(session, "tenant-sink", "email_ingested", str(index), {"index": index})
+        session.commit()
+
+    assert _count("tenant-sink") == 0
+    assert sink.stats()["queued"] == 3
+    sink.shutdown()
+    assert _count("tenant-sink") == 3
+    assert sink.stats()["flushed"] == 3
+
+
+def test_buffered_sink_drops_events_on_rollback_and_keeps_sync_tenants_inline():
+    sink = AuditSink(mode="buffered", flush_size=100, flush_interval=60, sync_tenants={"tenant-strict"})
+    with Session(db.engine) as session:
+        sink.record(session, "tenant-rolled-back", "job_planned", "1", {})
+        session.rollback()
+        sink.record(session, "tenant-strict", "job_planned", "2", {})
+        session.commit()
+
+    assert _count("tenant-strict") == 1
+    assert sink.stats()["queued"] == 0
+    sink.shutdown()
+    assert _count("tenant-rolled-back") == 0
+
+
+def test_full_queue_applies_backpressure_then_writes_synchronously():
+    sink = AuditSink(mode="buffered", max_queue=1, flush_size=100, flush_interval=60, enqueue_timeout=0.01)
+    with Session(db.engine) as session:
+        sink.record_many(
+            session,
+            [
+                {"tenant_id": "tenant-overflow", "event_type": "e", "entity_id": None, "payload_json": "{}"}
+                for _ in range(3)
+            ],
+        )
+        session.commit()
+
+    assert _count("tenant-overflow") == 2
+    assert sink.stats()["inline_overflow"] == 2
+    sink.shutdown()
+    assert _count("tenant-overflow") == 3
+
+
+def test_backpressure_waits_once_per_commit_not_per_row():
+    sink = AuditSink(mode="buffered", max_queue=1, flush_size=100, flush_interval=60, enqueue_timeout=0.2)
+    rows = [{"tenant_id": "tenant-deadline", "event_type": "e", "entity_id": None, "payload_json": "{}"}] * 10
+    with Session(db.engine) as session:
+        sink.record_many(session, rows)
+        started = time.monotonic()
+        session.commit()
+        elapsed = time.monotonic() - started
+
+    assert elapsed < 1.0
+    assert sink.stats()["inline_overflow"] == 9
+    sink.shutdown()
+    assert _count("tenant-deadline") == 10
+
+
+def test_commits_on_the_event_loop_never_wait_for_a_full_queue():
+    sink = AuditSink(mode="buffered", max_queue=1, flush_size=100, flush_interval=60, enqueue_timeout=5)
+    rows = [{"tenant_id": "tenant-loop", "event_type": "e", "entity_id": None, "payload_json": "{}"}] * 10
+
+    async def commit():
+        with Session(db.engine) as session:
+            sink.record_many(session, rows)
+            started = time.monotonic()
+            session.commit()
+            return time.monotonic() - started
+
+    assert asyncio.run(commit()) < 1.0
+    assert sink.stats()["inline_overflow"] == 9
+    sink.shutdown()
+    assert _count("tenant-loop") == 10
@@ -0,0 +1,37 @@
+import asyncio
+
+import httpx
+
+from app.main import app
+from benchmarks.pipeline import compare, percentile, run_benchmark, stub_url
+
+
+def test_percentile_uses_nearest_rank():
+    values = [float(value) for value in range(1, 101)]
+    assert percentile(values, 50) == 50.0
+    assert percentile(values, 95) == 95.0
+    assert percentile(values, 99) == 99.0
+    assert percentile([], 95) == 0.0
+
+
+def test_compare_flags_p95_and_error_regressions():
+    baseline = {"phases": {"lists": {"p95_ms": 10.0, "errors": 0}, "seed": {"seconds": 1.0}}}
+    assert compare({"phases": {"lists": {"p95_ms": 11.5, "errors": 0}}}, baseline, 0.2) == []
+    regressions = compare({"phases": {"lists": {"p95_ms": 13.0, "errors": 2}}}, baseline, 0.2)
+    assert regressions == ["lists: p95 10.0ms -> 13.0ms", "lists: errors 0 -> 2"]
+
+
+def test_benchmark_runs_every_phase_without_errors(monkeypatch, ai_stub):
+    monkeypatch.setenv("AI_API_KEY", "bench")
+    monkeypatch.setenv("AI_BASE_URL", stub_url(ai_stub(latency_ms=1)))
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as http:
+            return await run_benchmark(http, seed_emails=20, requests=12, concurrency=4, tenants=2, rng_seed=7)
+
+    report = asyncio.run(scenario())
+    assert report["seed"]["emails"] == 20
+    for phase in ["emails.create", "tasks.from_email", "jobs.plan", "lists", "agent.dispatch"]:
+        assert report[phase]["requests"] == 12 and report[phase]["errors"] == 0
+        assert 0 < report[phase]["p50_ms"] <= report[phase]["p95_ms"] <= report[phase]["max_ms"]
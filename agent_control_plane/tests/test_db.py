@@ -0,0 +1,20 @@
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+from app import db
+
+
+def test_sqlite_connections_use_wal_and_tuned_pragmas():
+    with db.engine.connect() as connection:
+        assert connection.exec_driver_sql("PRAGMA journal_mode").scalar() == "wal"
+        assert connection.exec_driver_sql("PRAGMA synchronous").scalar() == 1
+        assert connection.exec_driver_sql("PRAGMA busy_timeout").scalar() == db.SQLITE_BUSY_TIMEOUT_MS
+
+
+def test_read_session_rejects_writes():
+    session = next(db.get_read_session())
+    assert session.execute(text("SELECT count(*) FROM task")).scalar() >= 0
+    with pytest.raises(OperationalError):
+        session.execute(text("DELETE FROM task"))
+    session.close()
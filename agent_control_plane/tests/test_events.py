@@ -0,0 +1,91 @@
+import asyncio
+import json
+
+from sqlalchemy import delete, func
+from sqlmodel import Session, select
+
+from app import db
+from app.events import ChangeFeed
+from app.models import ChangeEvent
+
+
+async def _next_event(stream):
+    while True:
+        frame = await asyncio.wait_for(anext(stream), 5)
+        if not frame.startswith(":"):
+            return frame
+
+
+def _parse(frame):
+    fields = dict(line.split(": ", 1) for line in frame.strip().splitlines())
+    return fields["id"], fields["event"], json.loads(fields["data"])
+
+
+def test_stream_filters_changes_and_resumes_from_last_event_id(monkeypatch, plan):
+    monkeypatch.delenv("AI_API_KEY", raising=False)
+    feed = ChangeFeed(poll_interval=0.05, retention_seconds=3600, replay_limit=1000, max_queue=100, heartbeat_seconds=0.2)
+
+    async def scenario():
+        stream = feed.stream(feed.subscribe("tenant-sse", {"job", "approval"}), None)
+        assert await anext(stream) == ": connected\n\n"
+
+        await asyncio.to_thread(plan, "tenant-sse-other", ["Slet alt"])
+        [job] = await asyncio.to_thread(plan, "tenant-sse", ["Slet alt"])
+        first_id, first_type, first = _parse(await _next_event(stream))
+        second_id, second_type, second = _parse(await _next_event(stream))
+        await stream.aclose()
+        assert feed.stats()["subscribers"] == 0
+
+        assert (first_type, first["entity_id"], first["status"]) == ("job", str(job["id"]), "requires_approval")
+        assert second_type == "approval" and second["data"]["job_id"] == job["id"]
+        assert first["tenant_id"] == second["tenant_id"] == "tenant-sse"
+
+        resumed = feed.stream(feed.subscribe("tenant-sse", {"job", "approval"}), first_id)
+        assert _parse(await _next_event(resumed))[0] == second_id
+        await resumed.aclose()
+
+        stale = feed.stream(feed.subscribe(), "999999999")
+        assert (await _next_event(stale)).startswith("event: reset")
+        await stale.aclose()
+
+    asyncio.run(scenario())
+    feed.shutdown()
+
+
+def test_stream_rejects_unknown_entity_types(client):
+    assert client.get("/events/stream", params={"entity_type": "job,invoice"}).status_code == 400
+
+
+def test_subscriber_keeps_receiving_after_the_feed_table_is_emptied(monkeypatch, plan):
+    monkeypatch.delenv("AI_API_KEY", raising=False)
+    feed = ChangeFeed(poll_interval=60, retention_seconds=0, replay_limit=1000, max_queue=100, heartbeat_seconds=60)
+
+    async def next_job(subscription):
+        while True:
+            change = await asyncio.wait_for(subscription.queue.get(), 5)
+            if change["entity_type"] == "job":
+                return change
+
+    async def scenario():
+        subscription = feed.subscribe("tenant-prune", {"job"})
+        [first_job] = await asyncio.to_thread(plan, "tenant-prune", ["Opret kunde"])
+        feed.wake()
+        first = await next_job(subscription)
+        assert first["entity_id"] == str(first_job["id"])
+
+        # A prune with zero retention keeps only the newest row; emptying the table outright must not reuse ids.
+        feed._last_prune = 0
+        await asyncio.to_thread(feed.poll)
+        with Session(db.engine) as session:
+            assert session.exec(select(func.count()).select_from(ChangeEvent)).one() == 1
+            session.execute(delete(ChangeEvent))
+            session.commit()
+
+        [second_job] = await asyncio.to_thread(plan, "tenant-prune", ["Opret kunde"])
+        feed.wake()
+        second = await next_job(subscription)
+        assert second["entity_id"] == str(second_job["id"]) and second["id"] > first["id"]
+        feed.unsubscribe(subscription)
+
+    asyncio.run(scenario())
+    feed.shutdown()
@@ -0,0 +1,44 @@
+import csv
+import io
+import json
+
+from app.export import iter_export
+
+
+def test_export_streams_ndjson_and_csv_filtered_by_tenant(monkeypatch, client, plan):
+    monkeypatch.delenv("AI_API_KEY", raising=False)
+    jobs = plan("tenant-export", ["Opret kunde", "Slet alt", "Faktura, rettelse"])
+    plan("tenant-export-other", ["Opret kunde"])
+
+    response = client.get("/export/jobs", params={"tenant_id": "tenant-export"})
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    assert response.headers["content-disposition"].startswith('attachment; filename="jobs-')
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert [row["id"] for row in rows] == [job["id"] for job in jobs]
+    assert {row["tenant_id"] for row in rows} == {"tenant-export"}
+    assert rows[1]["status"] == "requires_approval"
+
+    tasks = client.get("/export/tasks", params={"tenant_id": "tenant-export", "format": "csv"})
+    assert tasks.headers["content-type"].startswith("text/csv")
+    table = list(csv.DictReader(io.StringIO(tasks.text)))
+    assert len(table) == 3 and table[0]["risk"] in {"low", "medium", "high"}
+    assert set(table[0]) >= {"id", "intent", "confidence", "created_at"}
+
+    approvals = client.get("/export/jobs", params={"tenant_id": "tenant-export", "status": "requires_approval"})
+    gated = [row["id"] for row in rows if row["status"] == "requires_approval"]
+    assert [json.loads(line)["id"] for line in approvals.text.splitlines()] == gated
+    future = client.get("/export/audit", params={"tenant_id": "tenant-export", "since": "2999-01-01T00:00:00"})
+    assert future.text == ""
+    assert client.get("/export/emails").status_code == 422
+
+
+def test_export_yields_one_chunk_per_batch(monkeypatch, plan):
+    monkeypatch.delenv("AI_API_KEY", raising=False)
+    plan("tenant-export-batches", ["Opret kunde"] * 5)
+    chunks = list(iter_export("audit", "csv", tenant_id="tenant-export-batches", batch_size=4))
+    header, *batches = chunks
+    assert header.startswith("id,tenant_id,event_type")
+    rows = [line for chunk in batches for line in chunk.splitlines()]
+    assert len(batches) == -(-len(rows) // 4) and all(chunk.count("\n") <= 4 for chunk in batches)
+    assert {line.split(",")[1] for line in rows} == {"tenant-export-batches"}
@@ -0,0 +1,156 @@
+import json
+import threading
+
+from sqlmodel import Session, select
+
+from app import db
+from app.models import Approval, Job, JobStep
+
+
+def _steps(job_id):
+    with Session(db.engine) as session:
+        return session.exec(select(JobStep).where(JobStep.job_id == job_id)).all()
+
+
+def test_engine_caps_tenants_and_completes_steps(monkeypatch, client, plan, make_engine):
+    monkeypatch.delenv("AI_API_KEY", raising=False)
+    make_engine().drain()
+    noisy = plan("tenant-noisy", ["Opret kunde"] * 6)
+    quiet = plan("tenant-quiet", ["Opret kunde"])
+
+    engine = make_engine()
+    release = threading.Event()
+    seen = []
+
+    def blocking(step):
+        seen.append(step["tenant_id"])
+        release.wait(5)
+        return {"ran": step["action_id"]}
+
+    engine.register("dispatch", blocking)
+    futures = engine.run_once()
+    assert len(futures) == 3
+    assert engine.stats()["running"] == {"tenant-noisy": 2, "tenant-quiet": 1}
+    assert engine.run_once() == []
+    release.set()
+    engine.drain()
+
+    assert sorted(seen).count("tenant-noisy") == 6
+    for job in noisy + quiet:
+        assert client.get(f"/jobs/{job['id']}").json()["status"] == "succeeded"
+        step = _steps(job["id"])[0]
+        assert step.status == "succeeded" and step.attempts == 1
+        assert json.loads(step.output_json) == {"ran": step.action_id}
+
+
+def test_engine_resumes_after_approval_and_retries_failures(monkeypatch, client, plan, make_engine):
+    monkeypatch.delenv("AI_API_KEY", raising=False)
+    make_engine().drain()
+    [gated] = plan("tenant-gated", ["Slet alt"])
+    assert gated["status"] == "requires_approval"
+
+    engine = make_engine()
+    calls = []
+
+    def flaky(step):
+        calls.append(step["id"])
+        raise RuntimeError("backend down")
+
+    engine.register("dispatch", flaky)
+    assert engine.drain() == 0
+
+    step = _steps(gated["id"])[0]
+    with Session(db.engine) as session:
+        approval = session.exec(select(Approval).where(Approval.job_step_id == step.id)).one()
+    approved = client.post(f"/approvals/{approval.id}/approve", json={"decided_by": "ops@example.com"})
+    assert approved.json()["job_status"] == "executing"
+
+    assert engine.drain() == 2
+    step = _steps(gated["id"])[0]
+    assert step.status == "failed" and step.attempts == 2
+    assert "backend down" in json.loads(step.output_json)["error"]
+    assert client.get(f"/jobs/{gated['id']}").json()["status"] == "failed"
+
+    engine.register("dispatch", lambda step: {"ok": True})
+    assert client.post(f"/jobs/{gated['id']}/retry").json()["status"] == "executing"
+    assert engine.drain() == 1
+    assert client.get(f"/jobs/{gated['id']}").json()["status"] == "succeeded"
+
+
+def test_rejected_approval_aborts_job_and_expired_leases_are_reclaimed(monkeypatch, client, plan, make_engine):
+    monkeypatch.delenv("AI_API_KEY", raising=False)
+    make_engine().drain()
+    rejected, stale = plan("tenant-lease", ["Slet alt", "Opret kunde"])
+    with Session(db.engine) as session:
+        step_id = session.exec(select(JobStep.id).where(JobStep.job_id == rejected["id"])).one()
+        approval = session.exec(select(Approval).where(Approval.job_step_id == step_id)).one()
+    assert client.post(f"/approvals/{approval.id}/reject", json={"decided_by": "ops"}).json()["job_status"] == "aborted"
+
+    crashed = make_engine(lease_seconds=-1)
+    crashed.register("dispatch", lambda step: {})
+    steps = crashed._claim()
+    assert [step["job_id"] for step in steps] == [stale["id"]]
+
+    engine = make_engine()
+    assert engine.drain() == 1
+    assert engine.stats()["claimed"] == 1
+    with Session(db.engine) as session:
+        assert session.get(Job, rejected["id"]).status == "aborted"
+        assert session.get(Job, stale["id"]).status == "succeeded"
+
+
+def test_kill_switch_stops_claims_and_hands_back_claimed_steps(monkeypatch, client, plan, make_engine):
+    monkeypatch.delenv("AI_API_KEY", raising=False)
+    make_engine().drain()
+    settings = {"tenant_id": "tenant-killed-jobs", "autonomy_mode": "AUTONOMOUS", "scopes": [], "policy": {}}
+    [job] = plan("tenant-killed-jobs", ["Opret kunde"])
+
+    engine = make_engine()
+    calls = []
+    engine.register("dispatch", lambda step: calls.append(step["id"]) or {})
+    [step] = engine._claim()
+    client.post("/settings", json={**settings, "kill_switch": True})
+    engine._execute(step)
+    assert calls == []
+    assert _steps(job["id"])[0].status == "pending" and _steps(job["id"])[0].attempts == 0
+    assert engine.stats()["running"] == {}
+    assert engine.drain() == 0
+
+    client.post("/settings", json={**settings, "kill_switch": False})
+    assert engine.drain() == 1
+    assert calls == [step["id"]]
+    assert client.get(f"/jobs/{job['id']}").json()["status"] == "succeeded"
+
+
+def test_retry_never_bypasses_approval_or_revives_finished_jobs(monkeypatch, client, plan, make_engine):
+    monkeypatch.delenv("AI_API_KEY", raising=False)
+    make_engine().drain()
+    gated, rejected, done = plan("tenant-retry-gate", ["Slet alt", "Slet alt", "Opret kunde"])
+    engine = make_engine()
+    assert engine.drain() == 1
+
+    retried = client.post(f"/jobs/{gated['id']}/retry")
+    assert (retried.status_code, retried.json()["detail"]) == (409, "job_requires_approval")
+    # Even a job forced to executing stays parked until its gated step is approved.
+    with Session(db.engine) as session:
+        job = session.get(Job, gated["id"])
+        job.status = "executing"
+        session.add(job)
+        session.commit()
+    assert engine.drain() == 0
+    assert _steps(gated["id"])[0].status == "pending"
+
+    step = _steps(rejected["id"])[0]
+    with Session(db.engine) as session:
+        approval = session.exec(select(Approval).where(Approval.job_step_id == step.id)).one()
+    client.post(f"/approvals/{approval.id}/reject", json={"decided_by": "ops"})
+    retried = client.post(f"/jobs/{rejected['id']}/retry")
+    assert (retried.status_code, retried.json()["detail"]) == (409, "job_rejected")
+    assert _steps(rejected["id"])[0].status == "rejected"
+
+    assert client.get(f"/jobs/{done['id']}").json()["status"] == "succeeded"
+    retried = client.post(f"/jobs/{done['id']}/retry")
+    assert (retried.status_code, retried.json()["detail"]) == (409, "job_has_no_failed_steps")
+    assert engine.drain() == 0
+    assert client.get(f"/jobs/{done['id']}").json()["status"] == "succeeded"
+    assert client.get(f"/jobs/{rejected['id']}").json()["status"] == "aborted"
@@ -0,0 +1,55 @@
+import re
+
+from app import logic
+from app.metrics import MetricsRegistry, ai_parse_failures, classifications
+
+
+def _sample(text, name, **labels):
+    selector = ",".join(f'{key}="{value}"' for key, value in labels.items())
+    match = re.search(rf"^{re.escape(name)}{{{re.escape(selector)}}} (\S+)$", text, re.MULTILINE)
+    return float(match.group(1)) if match else None
+
+
+def test_histogram_renders_cumulative_buckets():
+    registry = MetricsRegistry()
+    latency = registry.histogram("demo_seconds", "Demo.", ("route",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 5.0):
+        latency.observe(value, route="/x")
+    text = registry.render()
+    assert "# TYPE demo_seconds histogram" in text
+    assert _sample(text, "demo_seconds_bucket", route="/x", le="0.1") == 1
+    assert _sample(text, "demo_seconds_bucket", route="/x", le="1") == 2
+    assert _sample(text, "demo_seconds_bucket", route="/x", le="+Inf") == 3
+    assert _sample(text, "demo_seconds_count", route="/x") == 3
+
+
+def test_metrics_endpoint_reports_routes_queries_and_jobs(monkeypatch, client):
+    monkeypatch.delenv("AI_API_KEY", raising=False)
+    email = {"tenant_id": "tenant-metrics", "from_address": "a@example.com", "subject": "Opret kunde", "body": "x"}
+    email_id = client.post("/emails", json=email).json()["id"]
+    task = client.post("/tasks/from-email", json={"email_id": email_id}).json()
+    job_id = client.post(f"/jobs/plan/{task['id']}").json()["id"]
+    client.get(f"/jobs/{job_id}")
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    text = response.text
+    assert _sample(text, "acp_http_requests_total", method="GET", route="/jobs/{job_id}", status="200") >= 1
+    assert _sample(text, "acp_http_request_db_queries_count", method="POST", route="/tasks/from-email") >= 1
+    assert _sample(text, "acp_http_request_db_queries_sum", method="POST", route="/emails") >= 1
+    assert _sample(text, "acp_db_query_duration_seconds_count", statement="SELECT") >= 1
+    assert _sample(text, "acp_http_requests_in_flight", method="GET") == 1
+    assert _sample(text, "acp_jobs", tenant_id="tenant-metrics", status="executing") == 1
+
+
+def test_ai_parse_failures_and_fallbacks_are_counted(monkeypatch, client):
+    monkeypatch.setenv("AI_API_KEY", "test-key")
+    monkeypatch.setattr(logic, "_chat_completion", lambda prompt, content: "not json")
+    failures = ai_parse_failures.value(mode="single")
+    fallbacks = classifications.value(source="rules_fallback")
+
+    logic.triage_email("Opret kunde", "metrics parse failure")
+    assert ai_parse_failures.value(mode="single") == failures + 1
+    assert classifications.value(source="rules_fallback") == fallbacks + 1
+    assert 'outcome="parse_failure"' in client.get("/metrics").text
@@ -0,0 +1,55 @@
+from app import main
+from app.profiling import RequestProfiler, slow_query_log
+
+
+def _profiler(**overrides):
+    options = {"sample_rate": 0.0, "admin_token": "secret", "interval": 0.001, "keep": 5, "max_concurrent": 1}
+    return RequestProfiler(**{**options, "directory": None, **overrides})
+
+
+def test_admin_header_profiles_request_and_stores_folded_stacks(monkeypatch, tmp_path, client):
+    profiler = _profiler(directory=str(tmp_path))
+    monkeypatch.setattr(main, "request_profiler", profiler)
+
+    assert "X-Profile-Id" not in client.get("/tasks").headers
+    assert "X-Profile-Id" not in client.get("/tasks", headers={"X-Profile": "wrong"}).headers
+    response = client.get("/tasks", params={"tenant_id": "tenant-prof"}, headers={"X-Profile": "secret"})
+    assert response.status_code == 200
+    profile_id = response.headers["X-Profile-Id"]
+
+    assert client.get("/debug/profiles").status_code == 403
+    listed = client.get("/debug/profiles", headers={"X-Profile": "secret"}).json()
+    [profile] = listed["profiles"]
+    assert (profile["id"], profile["route"], profile["tenant_id"]) == (profile_id, "/tasks", "tenant-prof")
+    assert profile["reason"] == "header" and "folded" not in profile
+
+    folded = client.get(f"/debug/profiles/{profile_id}", headers={"X-Profile": "secret"})
+    assert folded.headers["content-type"].startswith("text/plain")
+    assert (tmp_path / f"{profile_id}.folded").read_text(encoding="utf-8") == folded.text
+    for line in folded.text.strip().splitlines():
+        stack, count = line.rsplit(" ", 1)
+        assert ";" in stack and int(count) > 0
+    assert client.get("/debug/profiles/missing", headers={"X-Profile": "secret"}).status_code == 404
+
+
+def test_sampled_profiling_without_header(monkeypatch, client):
+    profiler = _profiler(sample_rate=1.0, admin_token=None)
+    monkeypatch.setattr(main, "request_profiler", profiler)
+    assert "X-Profile-Id" in client.get("/health").headers
+    assert profiler.stats()["profiled"] == 1
+    # Without a configured token the stored profiles are not readable over HTTP.
+    assert client.get("/debug/profiles", headers={"X-Profile": ""}).status_code == 403
+
+
+def test_slow_queries_record_route_and_tenant(monkeypatch, client):
+    monkeypatch.setattr(main, "request_profiler", _profiler())
+    monkeypatch.setattr(slow_query_log, "threshold", 1e-9)
+    slow_query_log.clear()
+    client.get("/tasks", params={"tenant_id": "tenant-slow"})
+    monkeypatch.setattr(slow_query_log, "threshold", 60.0)
+
+    entries = client.get("/debug/slow-queries", headers={"X-Profile": "secret"}).json()["entries"]
+    [entry] = [entry for entry in entries if entry["route"] == "/tasks"]
+    assert entry["tenant_id"] == "tenant-slow"
+    assert entry["statement"].startswith("SELECT") and "FROM task" in entry["statement"]
+    assert entry["duration_ms"] >= 0